@@ -0,0 +1,67 @@
+"""
+Compares the time to rewrite pages with giza.tools.transformation.Rewriter and
+with the per-regex loop of munge_content(), using the substitutions that the
+json post-processing applies.
+
+Usage: python bin/benchmark_rewriter.py [file ...]
+
+Without arguments, uses a generated page where one line in ten contains markup.
+"""
+
+import sys
+import re
+import timeit
+
+from giza.tools.transformation import Rewriter, munge_content
+
+regexes = [
+    (re.compile(r'<a class=\"headerlink\"'), '<a'),
+    (re.compile(r'<[^>]*>'), ''),
+    (re.compile(r'&#8220;'), '"'),
+    (re.compile(r'&#8221;'), '"'),
+    (re.compile(r'&#8216;'), "'"),
+    (re.compile(r'&#8217;'), "'"),
+    (re.compile(r'&#\d{4};'), ''),
+    (re.compile(r'&nbsp;'), ''),
+    (re.compile(r'&gt;'), '>'),
+    (re.compile(r'&lt;'), '<')
+]
+
+
+def get_lines(fns):
+    if len(fns) == 0:
+        lines = []
+        for idx in range(50000):
+            if idx % 10 == 0:
+                lines.append('<p>paragraph &#8220;{0}&#8221; &gt; text</p>'.format(idx))
+            else:
+                lines.append('plain text of line number {0} in the page'.format(idx))
+
+        return lines
+
+    lines = []
+    for fn in fns:
+        with open(fn, 'r') as f:
+            lines.extend(ln.rstrip() for ln in f)
+
+    return lines
+
+
+def main():
+    lines = get_lines(sys.argv[1:])
+    rewriter = Rewriter(regexes)
+
+    assert [munge_content(ln, regexes) for ln in lines] == [rewriter.sub(ln) for ln in lines]
+
+    loop = min(timeit.repeat(lambda: [munge_content(ln, regexes) for ln in lines],
+                             number=3, repeat=3))
+    fused = min(timeit.repeat(lambda: [rewriter.sub(ln) for ln in lines],
+                              number=3, repeat=3))
+
+    print('{0} lines, {1} substitutions'.format(len(lines), len(regexes)))
+    print('per-regex loop: {0:.3f}s'.format(loop))
+    print('rewriter:       {0:.3f}s ({1:.1f}x)'.format(fused, loop / fused))
+
+
+if __name__ == '__main__':
+    main()
@@ -35,6 +35,7 @@ import giza.operations.tx
 import giza.operations.code_review
 import giza.operations.test
 import giza.operations.changelog
+import giza.tools.serialization
 
 logger = logging.getLogger('giza.main')
 
@@ -92,6 +93,7 @@ commands = {
         giza.operations.includes.list,
         giza.operations.includes.graph,
         giza.operations.includes.clean,
+        giza.operations.includes.stale,
     ],
     'packaging': [
         giza.operations.packaging.fetch,
@@ -165,6 +167,8 @@ def main():
         argh.dispatch(parser, namespace=args)
     except KeyboardInterrupt:
         logger.error('operation interrupted by user.')
+    finally:
+        giza.tools.serialization.log_load_timings()
 
 if __name__ == '__main__':
     main()
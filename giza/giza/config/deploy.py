@@ -91,6 +91,22 @@ class DeployTargetConfig(libgiza.config.ConfigurationBase):
             logger.critical('deployment targets must be a list')
             raise TypeError
 
+    @property
+    def fanout(self):
+        """The number of hosts to deploy to at once. Defaults to all hosts."""
+        if 'fanout' not in self.state:
+            return len(self.hosts)
+
+        return self.state['fanout']
+
+    @fanout.setter
+    def fanout(self, value):
+        if isinstance(value, int) and value > 0:
+            self.state['fanout'] = value
+        else:
+            logger.critical('deployment fanout must be a positive integer')
+            raise TypeError
+
 
 class StagingTargetConfig(libgiza.config.ConfigurationBase):
     """Configuration for a project's staging environment, specifying both an S3
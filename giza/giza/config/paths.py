@@ -209,3 +209,21 @@ class PathsConfig(RecursiveConfigurationBase):
         """Returns a path to the database containing output path mtimes and
            hashes to back FileCollector."""
         return os.path.join(self.projectroot, self.output, 'stage-cache.db')
+
+    @property
+    def deploy_manifests(self):
+        """Returns a path to the directory of the manifests of the files
+           deployed to each host, for every push target."""
+        return os.path.join(self.projectroot, self.output, 'deploy-manifests')
+
+    @property
+    def sphinx_warnings_database(self):
+        """Returns a path to the database containing the warnings of previous
+           sphinx builds."""
+        return os.path.join(self.projectroot, self.output, 'sphinx-warnings.db')
+
+    @property
+    def sphinx_build_timings(self):
+        """Returns a path to the file with the durations of previous sphinx
+           builds for the current branch."""
+        return os.path.join(self.projectroot, self.branch_output, 'sphinx-timings.json')
@@ -254,6 +254,76 @@ class RuntimeStateConfig(RuntimeStateConfigurationBase):
         else:
             self.state['serial_sphinx'] = value
 
+    @property
+    def warnings_diff(self):
+        if 'warnings_diff' not in self.state:
+            return False
+        else:
+            return self.state['warnings_diff']
+
+    @warnings_diff.setter
+    def warnings_diff(self, value):
+        if value in (True, False):
+            self.state['warnings_diff'] = value
+        else:
+            raise TypeError
+
+    @property
+    def shared_doctrees(self):
+        if 'shared_doctrees' not in self.state:
+            return False
+        else:
+            return self.state['shared_doctrees']
+
+    @shared_doctrees.setter
+    def shared_doctrees(self, value):
+        if value in (True, False):
+            self.state['shared_doctrees'] = value
+        else:
+            raise TypeError
+
+    @property
+    def source_copy_mode(self):
+        if 'source_copy_mode' not in self.state:
+            self.source_copy_mode = None
+
+        return self.state['source_copy_mode']
+
+    @source_copy_mode.setter
+    def source_copy_mode(self, value):
+        supported_modes = ['copy', 'hardlink', 'reflink']
+
+        if value is None:
+            self.state['source_copy_mode'] = 'copy'
+        elif value in supported_modes:
+            self.state['source_copy_mode'] = value
+        else:
+            m = '{0} is not a supported source copy mode, choose from: {1}'
+            m = m.format(value, supported_modes)
+            logger.error(m)
+            raise TypeError(m)
+
+    @property
+    def sphinx_driver(self):
+        if 'sphinx_driver' not in self.state:
+            self.sphinx_driver = None
+
+        return self.state['sphinx_driver']
+
+    @sphinx_driver.setter
+    def sphinx_driver(self, value):
+        supported_drivers = ['subprocess', 'inprocess']
+
+        if value is None:
+            self.state['sphinx_driver'] = 'subprocess'
+        elif value in supported_drivers:
+            self.state['sphinx_driver'] = value
+        else:
+            m = '{0} is not a supported sphinx driver, choose from: {1}'
+            m = m.format(value, supported_drivers)
+            logger.error(m)
+            raise TypeError(m)
+
     @property
     def conf_path(self):
         if 'conf_path' not in self.state:
@@ -18,7 +18,8 @@ import logging
 
 import libgiza.config
 import sphinx.builders
-import yaml
+
+from giza.tools.serialization import load_yaml
 
 logger = logging.getLogger('giza.config.sphinx_config')
 
@@ -34,10 +35,7 @@ def is_legacy_sconf(conf):
 
 def get_sconf_base(conf):
     sconf_path = os.path.join(conf.paths.projectroot, conf.paths.builddata, 'sphinx.yaml')
-    with open(sconf_path, 'r') as f:
-        sconf = yaml.safe_load(f)
-
-    return sconf
+    return load_yaml(sconf_path)
 
 
 def render_sconf(edition, builder, language, conf):
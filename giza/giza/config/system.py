@@ -15,8 +15,6 @@
 import logging
 import os.path
 
-import yaml
-
 from libgiza.config import RecursiveConfigurationBase, ConfigurationBase
 from giza.config.sphinx_local import SphinxLocalConfig
 from giza.config.manpage import ManpageConfig
@@ -28,6 +26,7 @@ from giza.config.replacements import ReplacementData
 from giza.config.migrations import MigrationData
 from giza.config.images import ImageData
 from giza.config.jeerah import JeerahConfig
+from giza.tools.serialization import load_yaml_file
 
 logger = logging.getLogger('giza.config.system')
 
@@ -117,6 +116,77 @@ class SystemConfig(RecursiveConfigurationBase):
         else:
             self.state['dependency_cache_fn'] = value
 
+    @property
+    def include_cache(self):
+        if 'include_cache' not in self.state:
+            self.include_cache = None
+
+        return self.state['include_cache']
+
+    @include_cache.setter
+    def include_cache(self, value):
+        if value is not None:
+            self.state['include_cache'] = value
+        else:
+            self.state['include_cache'] = os.path.join(self.conf.paths.projectroot,
+                                                       self.include_cache_fn)
+
+    @property
+    def include_cache_fn(self):
+        if 'include_cache_fn' not in self.state:
+            self.include_cache_fn = None
+
+        return self.state['include_cache_fn']
+
+    @include_cache_fn.setter
+    def include_cache_fn(self, value):
+        if value is None:
+            p = [self.conf.paths.branch_output]
+            if self.conf.project.edition is None:
+                p.append('includes.json')
+            else:
+                p.append('includes-' + self.conf.project.edition + '.json')
+
+            self.state['include_cache_fn'] = os.path.sep.join(p)
+        else:
+            self.state['include_cache_fn'] = value
+
+    @property
+    def content_cache(self):
+        if 'content_cache' not in self.state:
+            self.content_cache = None
+
+        return self.state['content_cache']
+
+    @content_cache.setter
+    def content_cache(self, value):
+        if value is not None:
+            self.state['content_cache'] = value
+        else:
+            p = [self.conf.paths.projectroot, self.conf.paths.branch_output]
+            if self.conf.project.edition is None:
+                p.append('content-cache')
+            else:
+                p.append('content-cache-' + self.conf.project.edition)
+
+            self.state['content_cache'] = os.path.join(*p)
+
+    @property
+    def source_sync_cache(self):
+        if 'source_sync_cache' not in self.state:
+            self.source_sync_cache = None
+
+        return self.state['source_sync_cache']
+
+    @source_sync_cache.setter
+    def source_sync_cache(self, value):
+        if value is not None:
+            self.state['source_sync_cache'] = value
+        else:
+            self.state['source_sync_cache'] = os.path.join(self.conf.paths.projectroot,
+                                                           self.conf.paths.branch_output,
+                                                           'source-sync.json')
+
     @property
     def runstate(self):
         return self.conf.runstate
@@ -384,24 +454,23 @@ class SystemConfigData(RecursiveConfigurationBase):
             }
             self._always_list_configs.extend(special_lists.keys())
 
-            with open(fn, 'r') as f:
-                data = yaml.safe_load_all(f)
-
-                if basename in mapping:
-                    data = [mapping[basename](doc) for doc in data]
-                elif basename in recur_mapping:
-                    data = [recur_mapping[basename](doc, self.conf) for doc in data]
-                elif basename in special_lists:
-                    l = special_lists[basename]()
-                    l.conf = self.conf
-                    l.extend([d for d in data])
-                    data = l
-                elif basename == 'replacement':
-                    data = ReplacementData([d for d in data], self.conf)
-                    return data
-
-                if not isinstance(data, list):
-                    data = [item for item in data]
+            data = load_yaml_file(fn)
+
+            if basename in mapping:
+                data = [mapping[basename](doc) for doc in data]
+            elif basename in recur_mapping:
+                data = [recur_mapping[basename](doc, self.conf) for doc in data]
+            elif basename in special_lists:
+                l = special_lists[basename]()
+                l.conf = self.conf
+                l.extend([d for d in data])
+                data = l
+            elif basename == 'replacement':
+                data = ReplacementData([d for d in data], self.conf)
+                return data
+
+            if not isinstance(data, list):
+                data = [item for item in data]
 
             if len(data) == 1 and (basename not in self._always_list_configs):
                 return data[0]
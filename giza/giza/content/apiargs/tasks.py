@@ -20,6 +20,7 @@ from libgiza.task import Task
 from giza.content.apiargs.inheritance import ApiArgDataCache
 from giza.content.apiargs.views import render_apiargs
 from giza.config.content import new_content_type
+from giza.content.helper import write_content
 
 logger = logging.getLogger('giza.content.apiargs.tasks')
 
@@ -34,8 +35,8 @@ def register_apiargs(conf):
 
 def write_apiargs(apiargs, fn):
     content = render_apiargs(apiargs)
-    content.write(fn)
-    logger.info('wrote apiarg table to: ' + fn)
+    if write_content(content, fn):
+        logger.info('wrote apiarg table to: ' + fn)
 
 
 def apiarg_tasks(conf):
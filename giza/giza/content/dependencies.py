@@ -24,6 +24,7 @@ combination with this cache of file hashes to ensure that Sphinx does not skip
 building files.
 """
 
+import collections
 import datetime
 import json
 import logging
@@ -31,8 +32,9 @@ import os
 
 import libgiza.task
 
-from giza.includes import include_files
-from giza.tools.files import expand_tree, safe_create_directory, md5_file
+from giza.includes import include_files, generated_includes, update_include_index
+from giza.tools.files import (expand_tree, safe_create_directory, md5_file,
+                              stat_signature, hash_files, break_hardlink)
 from giza.tools.timing import Timer
 
 logger = logging.getLogger('giza.content.dependencies')
@@ -44,83 +46,191 @@ def dump_file_hashes(conf):
     output = conf.system.dependency_cache
 
     o = {'time': datetime.datetime.utcnow().strftime("%s"),
-         'files': {}}
+         'files': {},
+         'stats': {}}
 
     files = expand_tree(os.path.join(conf.paths.projectroot, conf.paths.branch_source), None)
 
     fmap = o['files']
+    smap = o['stats']
 
+    # only rehash files whose size, mtime or inode differ from the last build.
+    previous = load_dependency_cache(conf)
+    if previous is None:
+        previous = {'files': {}, 'stats': {}}
+
+    to_hash = []
+    skipped = 0
     for fn in files:
         if os.path.exists(fn):
-            fmap[fn] = md5_file(fn)
+            smap[fn] = stat_signature(fn)
+
+            if fn in previous['files'] and previous['stats'].get(fn) == smap[fn]:
+                fmap[fn] = previous['files'][fn]
+                skipped += 1
+            else:
+                to_hash.append(fn)
+
+    with Timer('hashing {0} changed files'.format(len(to_hash))):
+        fmap.update(hash_files(to_hash, conf.runstate.pool_size))
+
+    o['hashed'] = len(to_hash)
+    o['skipped'] = skipped
 
     safe_create_directory(os.path.dirname(output))
 
     with open(output, 'w') as f:
         json.dump(o, f)
 
-    logger.info('wrote dependency cache to: {0}'.format(output))
+    m = 'wrote dependency cache to: {0} (hashed {1} files, skipped {2} unchanged files)'
+    logger.info(m.format(output, o['hashed'], o['skipped']))
 
 # Update Dependencies
 
 
-def _refresh_deps(graph, dep_map, conf):
-    warned = set()
-    count = 0
+def dependency_graph(conf):
+    """
+    Returns a mapping of every file (relative to ``source/``) to the set of
+    files that must be rebuilt when it changes. Combines the include graph from
+    :func:`giza.includes.include_files()` with the edges from
+    :func:`giza.includes.generated_includes()`, which are stored in the opposite
+    direction (i.e. the generated file to the files it inherits from.)
+    """
 
-    # For each file in the source tree, bump the timestamp of all files that
-    # include it, if the file changed since the last build.
-
-    for file, dependents in graph.items():
-        if check_hashed_dependency(file, dep_map, conf) is True:
-            core_file = normalize_dep_path(file, conf, False)
-            norm_file = normalize_dep_path(file, conf, True)
-
-            if os.path.isfile(norm_file) and not os.path.isfile(core_file):
-                # these are generated files in the build/<branch>/source. No
-                # need to touch these files.
-                continue
-            for dep in [normalize_dep_path(dep, conf, branch=True) for dep in dependents]:
-                if not os.path.exists(core_file):
-                    # this file doesn't exist in the source. Sphinx will
-                    # warn about this file later (though the output silently
-                    # ignores the unavailable content.)
-
-                    if core_file in warned:
-                        continue
-                    else:
-                        warned.add(core_file)
-                        logger.warning('included file does not exist: ' + core_file)
-                elif os.path.exists(dep):
-                    logger.debug('updating timestamp of "{0}" because of "{1}"'.format(dep, file))
-                    os.utime(dep, None)
-                    count += 1
-
-    logger.info('bumped timestamps for {0} files'.format(count))
+    index = update_include_index(conf)
+    graph = include_files(conf=conf, index=index)
+    generated = generated_includes(conf, index)
 
+    dependents = {}
+    for fn, includers in graph.items():
+        if fn in generated:
+            # generated_includes() entries are merged into the include graph;
+            # we add these edges below in the correct direction.
+            includers = [i for i in includers if i not in generated[fn]]
 
-def refresh_deps(conf):
+        dependents.setdefault(fn, set()).update(includers)
+
+    for fn, sources in generated.items():
+        for source in sources:
+            dependents.setdefault(source, set()).add(fn)
+
+    return dependents
+
+
+def resolve_stale_documents(dependents, dep_map, conf, hashes=None, stats=None):
+    """
+    Walks the dependency graph once, starting from every file whose hash in the
+    proxy source directory differs from the hash recorded in ``dep_map``, and
+    collects all files that transitively depend on a changed file.
+
+    :returns: a dict with the ``changed`` files, all ``affected`` files, the
+       ``documents`` (i.e. ``.txt`` files) that Sphinx must re-read, and the
+       ``missing`` included files that do not exist, as well as the number
+       of files ``hashed`` and ``skipped`` because their stat signature did
+       not change.
+    """
+
+    if hashes is None:
+        hashes = {}
+
+    changed = set()
+    missing = set()
+    skipped = set()
+
+    for fn in dependents:
+        if check_hashed_dependency(fn, dep_map, conf, hashes, stats, skipped) is True:
+            if not os.path.exists(normalize_dep_path(fn, conf, branch=True)):
+                missing.add(fn)
+            else:
+                changed.add(fn)
+
+    affected = set()
+    queue = collections.deque(changed)
+
+    while queue:
+        fn = queue.popleft()
+        for dep in dependents.get(fn, []):
+            if dep not in affected:
+                affected.add(dep)
+                queue.append(dep)
+
+    return {'changed': sorted(changed),
+            'affected': sorted(affected),
+            'documents': sorted(fn for fn in affected if fn.endswith('.txt')),
+            'missing': sorted(missing),
+            'hashed': len(hashes),
+            'skipped': len(skipped)}
+
+
+def load_dependency_cache(conf):
+    """
+    Returns the dependency cache written by :func:`dump_file_hashes()` during
+    the last build, or ``None`` if it does not exist. Caches written by earlier
+    versions of giza do not have ``stats``, and have an empty mapping.
+    """
+
+    # load, if possible, a mappping of all source files with hashes from the
+    # last build.
+    if not os.path.exists(conf.system.dependency_cache):
+        return None
+
+    with open(conf.system.dependency_cache, 'r') as f:
+        try:
+            dep_cache = json.load(f)
+            dep_cache.setdefault('stats', {})
+            return dep_cache
+        except (ValueError, AttributeError):
+            m = 'no stored dependency information, will rebuild more things than necessary.'
+            logger.warning(m)
+            return None
+
+
+def dependency_report(conf):
     with Timer('resolve dependency graph'):
-        # resolve a map of the source files to the files they depend on
-        # (i.e. the ones that they include).
-        graph = include_files(conf=conf)
-
-        # load, if possible, a mappping of all source files with hashes from the
-        # last build.
-        if not os.path.exists(conf.system.dependency_cache):
-            dep_map = None
+        # resolve a map of the source files to the files that depend on them
+        # (i.e. the ones that include them).
+        dependents = dependency_graph(conf)
+        dep_cache = load_dependency_cache(conf)
+
+    with Timer('resolve stale documents'):
+        if dep_cache is None:
+            return resolve_stale_documents(dependents, None, conf)
         else:
-            with open(conf.system.dependency_cache, 'r') as f:
-                try:
-                    dep_cache = json.load(f)
-                    dep_map = dep_cache['files']
-                except ValueError:
-                    dep_map = None
-                    m = 'no stored dependency information, will rebuild more things than necessary.'
-                    logger.warning(m)
+            return resolve_stale_documents(dependents, dep_cache['files'], conf,
+                                           stats=dep_cache['stats'])
+
+
+def _refresh_deps(report, conf):
+    for fn in report['missing']:
+        # this file doesn't exist in the source. Sphinx will warn about this
+        # file later (though the output silently ignores the unavailable
+        # content.)
+        logger.warning('included file does not exist: ' + normalize_dep_path(fn, conf, False))
+
+    count = 0
+    for fn in report['documents']:
+        dep = normalize_dep_path(fn, conf, branch=True)
+
+        if os.path.exists(dep):
+            logger.debug('updating timestamp of "{0}" because of a changed dependency'.format(dep))
+
+            # in hardlink mode, the file shares an inode with the canonical
+            # source and the other editions, which must keep their mtime.
+            break_hardlink(dep)
+            os.utime(dep, None)
+            count += 1
+
+    m = 'bumped timestamps for {0} files, {1} changed dependencies, hashed {2} files, skipped {3}'
+    logger.info(m.format(count, len(report['changed']), report['hashed'], report['skipped']))
+
+
+def refresh_deps(conf):
+    report = dependency_report(conf)
 
     with Timer('dependency updates'):
-        _refresh_deps(graph, dep_map, conf)
+        _refresh_deps(report, conf)
+
+    return report
 
 # In previous versions, giza loaded the dep_map in the main thread, and then
 # passed the checks and update to a worker pool, but the pool took ~40 seconds
@@ -175,24 +285,37 @@ def normalize_dep_path(fn, conf, branch):
     return fn
 
 
-def check_hashed_dependency(fn, dep_map, conf):
+def check_hashed_dependency(fn, dep_map, conf, hashes=None, stats=None, skipped=None):
     """
-    :return: ``True`` when any of the files that include ``fn`` have changed since
-        the generation of the the ``dep_map``. Always returns ``True`` if
+    :return: ``True`` when ``fn`` has changed in the proxy source directory
+        since the generation of the ``dep_map``. Always returns ``True`` if
         ``dep_map`` is ``None`` (i.e. if this is the first build.)
+
+    When specified, ``hashes`` is a dictionary used to memoize file hashes, so
+    that every file is hashed at most once, and ``stats`` is the mapping of
+    files to stat signatures from the dependency cache: files whose signature
+    has not changed are not hashed, and are added to the ``skipped`` set when
+    specified.
     """
-    # logger.info('checking dependency for: ' + fan)
 
-    fn = normalize_dep_path(fn, conf, branch=False)
+    fn = normalize_dep_path(fn, conf, branch=True)
 
     if dep_map is None:
         return True
     elif not os.path.exists(fn):
         return True
     elif fn in dep_map:
-        if dep_map[fn] != md5_file(fn):
-            return True
-        else:
+        if stats is not None and stats.get(fn) == stat_signature(fn):
+            if skipped is not None:
+                skipped.add(fn)
             return False
+
+        if hashes is None:
+            hashes = {}
+
+        if fn not in hashes:
+            hashes[fn] = md5_file(fn)
+
+        return dep_map[fn] != hashes[fn]
     else:
         return False
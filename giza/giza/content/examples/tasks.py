@@ -25,6 +25,7 @@ import shutil
 from libgiza.task import Task
 
 from giza.config.content import new_content_type
+from giza.content.helper import write_content
 from giza.content.examples.inheritance import ExampleDataCache
 from giza.content.examples.views import full_example
 
@@ -41,7 +42,7 @@ def register_examples(conf):
 
 def write_full_example(collection, examples, fn):
     content = full_example(collection, examples)
-    content.write(fn)
+    write_content(content, fn)
 
 
 def example_tasks(conf):
@@ -18,6 +18,7 @@ from giza.tools.transformation import append_to_file, prepend_to_file
 from giza.content.extract.inheritance import ExtractDataCache
 from giza.content.extract.views import render_extracts, get_include_statement
 from giza.config.content import new_content_type
+from giza.content.helper import write_content
 from libgiza.task import Task
 
 logger = logging.getLogger('giza.content.extract.tasks')
@@ -33,8 +34,8 @@ def register_extracts(conf):
 
 def write_extract_file(extract, fn):
     content = render_extracts(extract)
-    content.write(fn)
-    logger.info('wrote extract file: ' + fn)
+    if write_content(content, fn):
+        logger.info('wrote extract file: ' + fn)
 
 
 def extract_tasks(conf):
@@ -20,6 +20,7 @@ from libgiza.task import Task
 from giza.content.glossary.inheritance import GlossaryDataCache
 from giza.content.glossary.views import render_glossary
 from giza.config.content import new_content_type
+from giza.content.helper import write_content
 
 logger = logging.getLogger('giza.content.extract.tasks')
 
@@ -34,8 +35,8 @@ def register_glossary(conf):
 
 def write_glossary(terms, fn):
     content = render_glossary(terms)
-    content.write(fn)
-    logger.info('wrote glossary file: ' + fn)
+    if write_content(content, fn):
+        logger.info('wrote glossary file: ' + fn)
 
 
 def glossary_tasks(conf):
@@ -25,6 +25,8 @@ import os
 import libgiza.task
 from rstcloth.rstcloth import RstCloth
 
+from giza.tools.files import break_hardlink
+
 logger = logging.getLogger('giza.hash')
 
 # Rendering
@@ -54,6 +56,7 @@ def generate_hash_file(fn, conf):
             with open(fn, 'a'):
                 os.utime(fn, None)
     else:
+        break_hardlink(fn)
         r.write(fn)
         logger.info('regenerated {0} with new commit hash: {1}'.format(fn, commit[:10]))
 
@@ -20,8 +20,12 @@ the current build environment and returns a boolean that reflects if the object
 is appropriate for the edition.
 """
 
+import os
+
 from pygments.lexers import get_all_lexers
 
+from giza.tools.files import replace_if_changed, safe_create_directory
+
 level_characters = {
     "=": 1,
     "-": 2,
@@ -93,3 +97,25 @@ def get_all_languages():
         all_languages.extend(lexers[1])
 
     return all_languages
+
+
+def write_content(content, fn):
+    """
+    Writes a rendered :class:`~rstcloth.rstcloth.RstCloth` or
+    :class:`~rstcloth.table.TableBuilder` object to ``fn`` with its
+    ``write()`` method, by way of a temporary file that only replaces ``fn``
+    if the output differs from the current content of ``fn``. Render tasks
+    that leave ``fn`` unchanged are current by their stamp files, see
+    :func:`giza.content.rendering.needs_rebuild()`.
+
+    :returns: ``True`` if the file was written, and ``False`` otherwise.
+    """
+
+    dirname = os.path.dirname(fn)
+    if dirname != '' and not os.path.isdir(dirname):
+        safe_create_directory(dirname)
+
+    tmp_fn = '{0}.tmp-{1}'.format(fn, os.getpid())
+    content.write(tmp_fn)
+
+    return replace_if_changed(tmp_fn, fn)
@@ -12,10 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import functools
 import logging
 import os
+import pipes
 import shlex
 import subprocess
+import tempfile
+
+from multiprocessing.pool import ThreadPool
 
 import libgiza.task
 
@@ -53,25 +59,35 @@ def generate_image(build_type, dpi, width, target, source):
     logger.info('wrote: ' + target)
 
 
-def generate_image_inkscape(build_type, dpi, width, target, source):
-    inkscape = None
-
+def find_inkscape():
     for path in ('/usr/bin/inkscape', '/usr/local/bin/inkscape',
                  '/Applications/Inkscape.app/Contents/Resources/bin/inkscape'):
         if os.path.exists(path):
-            inkscape = path
-            break
+            return path
+
+    return None
 
-    if inkscape is None:
-        logger.error("dependency INKSCAPE not installed. not building images.")
-        return
 
+def get_inkscape_args(build_type, dpi, width, target, source):
     if build_type == 'png':
-        cmd = '{cmd} -z -d {dpi} -w {width} -y 0.0 -e {target} {source}'
+        args = '-z -d {dpi} -w {width} -y 0.0 -e {target} {source}'
     elif build_type == 'eps':
-        cmd = '{cmd} -z -d {dpi} -w {width} -y 1.0 -E {target} {source}'
+        args = '-z -d {dpi} -w {width} -y 1.0 -E {target} {source}'
+    else:
+        raise TypeError(build_type + " is not supported")
+
+    return args.format(dpi=dpi, width=width, target=pipes.quote(target),
+                       source=pipes.quote(source))
 
-    cmd = cmd.format(cmd=inkscape, dpi=dpi, width=width, target=target, source=source)
+
+def generate_image_inkscape(build_type, dpi, width, target, source):
+    inkscape = find_inkscape()
+
+    if inkscape is None:
+        logger.error("dependency INKSCAPE not installed. not building images.")
+        return
+
+    cmd = ' '.join((inkscape, get_inkscape_args(build_type, dpi, width, target, source)))
     logger.debug(cmd)
     with open(os.devnull, 'w') as null:
         r = subprocess.call(shlex.split(cmd), stdout=null, stderr=null)
@@ -83,6 +99,152 @@ def generate_image_inkscape(build_type, dpi, width, target, source):
         logger.error(cmd)
 
 
+def _run_inkscape_shell(inkscape, jobs):
+    commands = [get_inkscape_args(*job) for job in jobs]
+    commands.append('quit')
+
+    with open(os.devnull, 'w') as null:
+        p = subprocess.Popen([inkscape, '--shell'], stdin=subprocess.PIPE,
+                             stdout=null, stderr=null)
+        p.communicate('\n'.join(commands).encode('utf-8') + b'\n')
+
+    if p.returncode != 0:
+        logger.warning('inkscape shell exited with code {0}'.format(p.returncode))
+
+    return p.returncode
+
+
+def _remove_output(fn):
+    if os.path.exists(fn):
+        os.remove(fn)
+
+
+def generate_images_inkscape(jobs, pool_size=1):
+    """
+    Renders a list of ``(build_type, dpi, width, target, source)`` jobs with
+    at most ``pool_size`` ``inkscape --shell`` processes, which divide the
+    jobs between them, rather than starting inkscape for every image. Requires
+    inkscape, see :func:`find_inkscape()`.
+
+    When a shell fails, its outputs may be incomplete, so all of them are
+    removed and reported as failures.
+
+    :returns: the list of jobs that did not produce a target.
+    """
+
+    inkscape = find_inkscape()
+    num_shells = max(1, min(pool_size, len(jobs)))
+    shards = [jobs[idx::num_shells] for idx in range(num_shells)]
+
+    if num_shells == 1:
+        return_codes = [_run_inkscape_shell(inkscape, jobs)]
+    else:
+        pool = ThreadPool(num_shells)
+        try:
+            return_codes = pool.map(functools.partial(_run_inkscape_shell, inkscape), shards)
+        finally:
+            pool.close()
+            pool.join()
+
+    errors = []
+    for shard, return_code in zip(shards, return_codes):
+        for job in shard:
+            target = job[3]
+
+            if return_code == 0 and os.path.isfile(target) and os.path.getsize(target) > 0:
+                logger.info('wrote: ' + target)
+            else:
+                _remove_output(target)
+                logger.warning('error generating image: ' + target)
+                logger.error(' '.join((inkscape, get_inkscape_args(*job))))
+                errors.append(job)
+
+    return errors
+
+
+def render_images(jobs, pool_size=1):
+    """
+    Renders ``(build_type, dpi, width, target, source)`` jobs with inkscape,
+    or in-process with :func:`generate_image()` when inkscape is not installed.
+
+    :returns: the list of jobs that did not produce a target.
+    """
+
+    if find_inkscape() is not None:
+        return generate_images_inkscape(jobs, pool_size)
+
+    logger.info('inkscape is not installed, rendering images with wand.')
+
+    errors = []
+    for job in jobs:
+        try:
+            generate_image(*job)
+        except ImportError:
+            logger.error("dependency INKSCAPE not installed. not building images.")
+            return jobs
+        except Exception as e:
+            _remove_output(job[3])
+            logger.warning('error generating image {0}: {1}'.format(job[3], e))
+            errors.append(job)
+
+    return errors
+
+
+def image_cache_key(source_hash, build_type, dpi, width):
+    return '{0}-{1}-{2}.{3}'.format(source_hash, dpi, width, build_type)
+
+
+def generate_image_outputs(images, cache_dir, pool_size=1):
+    """
+    Creates all outputs for a list of ``(jobs, source)`` tuples, one for every
+    source image, where ``jobs`` is a list of ``(build_type, dpi, width,
+    target)`` tuples.
+
+    Rendered images are stored in ``cache_dir``, keyed by the hash of the
+    source and the output options. The cache is shared by all branches and
+    editions, so each distinct output is rendered once. Outputs of all images
+    that are not in the cache render together, with :func:`render_images()`.
+    """
+
+    giza.tools.files.safe_create_directory(cache_dir)
+
+    to_render = collections.OrderedDict()
+    targets = []
+    for jobs, source in images:
+        source_hash = giza.tools.files.md5_file(source)
+
+        for build_type, dpi, width, target in jobs:
+            cache_fn = os.path.join(cache_dir,
+                                    image_cache_key(source_hash, build_type, dpi, width))
+            targets.append((cache_fn, target))
+
+            if not os.path.isfile(cache_fn) and cache_fn not in to_render:
+                # render into a file unique to this call, because another
+                # edition, in this process or another, may be rendering the
+                # same image at the same time.
+                prefix = os.path.splitext(os.path.basename(cache_fn))[0] + '.'
+                fd, tmp_fn = tempfile.mkstemp(suffix='.' + build_type, prefix=prefix,
+                                              dir=cache_dir)
+                os.close(fd)
+                to_render[cache_fn] = (build_type, dpi, width, tmp_fn, source)
+
+    if len(to_render) > 0:
+        failed = set(job[3] for job in render_images(list(to_render.values()), pool_size))
+
+        for cache_fn, job in to_render.items():
+            if job[3] in failed:
+                _remove_output(job[3])
+            else:
+                os.rename(job[3], cache_fn)
+    else:
+        m = 'using {0} cached images for {1} source images'
+        logger.debug(m.format(len(targets), len(images)))
+
+    for cache_fn, target in targets:
+        if os.path.isfile(cache_fn):
+            giza.tools.files.copy_if_needed(cache_fn, target, 'image')
+
+
 def image_tasks(conf, sconf):
     tasks = []
 
@@ -94,6 +256,13 @@ def image_tasks(conf, sconf):
 
     giza.tools.files.safe_create_directory(os.path.join(conf.paths.projectroot,
                                                         conf.paths.branch_images))
+    cache_dir = os.path.join(conf.paths.projectroot, conf.paths.output, 'image-cache')
+
+    image_jobs = []
+    image_targets = []
+    image_sources = []
+    finalizers = []
+
     for image in conf.system.files.data.images:
 
         if not os.path.isfile(image.source_core):
@@ -112,17 +281,13 @@ def image_tasks(conf, sconf):
         if conf.runstate.fast is True:
             continue
 
-        for output in image.outputs:
-            description = 'generating image file {0} from {1}'.format(output.output,
-                                                                      image.source_core)
-            t = libgiza.task.Task(job=generate_image_inkscape,
-                                  args=(output.build_type, output.dpi, output.width,
-                                        output.output, image.source_file),
-                                  target=output.output,
-                                  dependency=image.source_core,
-                                  description=description)
-            tasks.append(t)
+        image_jobs.append(([(output.build_type, output.dpi, output.width, output.output)
+                            for output in image.outputs],
+                           image.source_file))
+        image_targets.extend(output.output for output in image.outputs)
+        image_sources.append(image.source_core)
 
+        for output in image.outputs:
             if output.type == 'target':
                 image_output = os.path.join(conf.paths.projectroot,
                                             conf.paths.branch_output,
@@ -136,11 +301,27 @@ def image_tasks(conf, sconf):
                 description = 'copying fullsize image file {0} from {1}'.format(image_output,
                                                                                 output.output)
 
-                t.add_finalizer(libgiza.task.Task(job=giza.tools.files.copy_if_needed,
-                                                  args=(output.output, image_output),
-                                                  description=description,
-                                                  target=image_output,
-                                                  dependency=None))
+                finalizers.append(libgiza.task.Task(job=giza.tools.files.copy_if_needed,
+                                                    args=(output.output, image_output),
+                                                    description=description,
+                                                    target=image_output,
+                                                    dependency=None))
+
+    # all images render in one task, so that their inkscape exports share a
+    # small, fixed number of inkscape shells.
+    if len(image_jobs) > 0:
+        description = 'generating {0} image files from {1} images'.format(len(image_targets),
+                                                                          len(image_jobs))
+        t = libgiza.task.Task(job=generate_image_outputs,
+                              args=(image_jobs, cache_dir, conf.runstate.pool_size),
+                              target=image_targets,
+                              dependency=image_sources,
+                              description=description)
+
+        for finalizer in finalizers:
+            t.add_finalizer(finalizer)
+
+        tasks.append(t)
 
     logger.info('registered {0} image generation tasks'.format(len(tasks)))
 
@@ -24,7 +24,8 @@ import os.path
 
 import libgiza.task
 
-from giza.includes import generated_includes, included_recusively, include_files
+from giza.includes import (generated_includes, included_recusively, include_files,
+                           update_include_index)
 from giza.tools.files import expand_tree
 from giza.tools.timing import Timer
 
@@ -64,10 +65,11 @@ def write_include_index(overview_fn, conf):
 def include_file_data(conf):
     inc_path = os.path.join(conf.paths.includes)
     include_file_list = expand_tree(path=inc_path, input_extension=None)
-    include_graph = include_files(conf=conf)
+    index = update_include_index(conf)
+    include_graph = include_files(conf=conf, index=index)
 
     recursive_use = included_recusively(conf, include_graph)
-    generated = generated_includes(conf)
+    generated = generated_includes(conf, index)
 
     omni = {}
     for idx, fn in enumerate(include_file_list):
@@ -19,6 +19,7 @@ from giza.tools.files import verbose_remove
 from giza.content.options.inheritance import OptionDataCache
 from giza.content.options.views import render_options
 from giza.config.content import new_content_type
+from giza.content.helper import write_content
 from libgiza.task import Task
 
 logger = logging.getLogger('giza.content.options.tasks')
@@ -34,8 +35,8 @@ def register_options(conf):
 
 def write_options(option, fn, conf):
     content = render_options(option, conf)
-    content.write(fn)
-    logger.info('wrote options file: ' + fn)
+    if write_content(content, fn):
+        logger.info('wrote options file: ' + fn)
 
 
 def option_tasks(conf):
@@ -20,7 +20,8 @@ distributed as tarballs (i.e. html sites, manpages, and slides) for offline use.
 import os
 import logging
 
-from giza.tools.files import create_link, tarball
+from giza.tools.archive import incremental_tarball
+from giza.tools.files import create_link
 
 logger = logging.getLogger('giza.content.post.archives')
 
@@ -47,14 +48,20 @@ def get_tarball_name(builder, conf):
                         fn)
 
 
+def get_archive_cache(conf):
+    return os.path.join(conf.paths.projectroot, conf.paths.branch_output, 'archives')
+
+
 def html_tarball(builder, artifact_loc, conf):
     tarball_name = get_tarball_name('html', conf)
 
-    tarball(name=tarball_name,
-            path=artifact_loc,
-            cdir=os.path.join(conf.paths.projectroot,
-                              conf.paths.branch_output),
-            newp=os.path.splitext(os.path.basename(tarball_name))[0])
+    incremental_tarball(name=tarball_name,
+                        path=artifact_loc,
+                        cache_dir=get_archive_cache(conf),
+                        pool_size=conf.runstate.pool_size,
+                        cdir=os.path.join(conf.paths.projectroot,
+                                          conf.paths.branch_output),
+                        newp=os.path.splitext(os.path.basename(tarball_name))[0])
 
     link_name = get_tarball_name('link-html', conf)
 
@@ -68,11 +75,13 @@ def html_tarball(builder, artifact_loc, conf):
 def slides_tarball(builder, artifact_loc, conf):
     tarball_name = get_tarball_name('slides', conf)
 
-    tarball(name=tarball_name,
-            path=artifact_loc,
-            cdir=os.path.join(conf.paths.projectroot,
-                              conf.paths.branch_output),
-            newp=os.path.splitext(os.path.basename(tarball_name))[0])
+    incremental_tarball(name=tarball_name,
+                        path=artifact_loc,
+                        cache_dir=get_archive_cache(conf),
+                        pool_size=conf.runstate.pool_size,
+                        cdir=os.path.join(conf.paths.projectroot,
+                                          conf.paths.branch_output),
+                        newp=os.path.splitext(os.path.basename(tarball_name))[0])
 
     link_name = get_tarball_name('link-slides', conf)
 
@@ -86,10 +95,12 @@ def slides_tarball(builder, artifact_loc, conf):
 def man_tarball(builder, artifact_loc, conf):
     tarball_name = get_tarball_name('man', conf)
 
-    tarball(name=tarball_name,
-            path=artifact_loc,
-            cdir=os.path.join(conf.paths.projectroot, conf.paths.branch_output),
-            newp=conf.project.name + '-manpages')
+    incremental_tarball(name=tarball_name,
+                        path=artifact_loc,
+                        cache_dir=get_archive_cache(conf),
+                        pool_size=conf.runstate.pool_size,
+                        cdir=os.path.join(conf.paths.projectroot, conf.paths.branch_output),
+                        newp=conf.project.name + '-manpages')
 
     link_name = get_tarball_name('link-man', conf)
 
@@ -21,14 +21,28 @@ list of paths in the output.
 
 import json
 import logging
+import multiprocessing
 import os
 import re
 import subprocess
 
 import libgiza.task
 
-from giza.tools.files import expand_tree, copy_if_needed, safe_create_directory
-from giza.tools.transformation import munge_content
+from giza.content.post.search_index import export_search_index
+from giza.tools.files import (expand_tree, copy_if_needed, safe_create_directory,
+                              hash_files, md5_file, stat_signature, verbose_remove)
+from giza.tools.transformation import munge_content, Rewriter
+
+try:
+    import ujson
+
+    json_loads = ujson.loads
+
+    def json_dumps(doc):
+        return ujson.dumps(doc, escape_forward_slashes=False)
+except ImportError:
+    json_loads = json.loads
+    json_dumps = json.dumps
 
 logger = logging.getLogger('giza.content.post.json_output')
 
@@ -64,8 +78,54 @@ def json_output(conf):
         logger.error('error migrating json artifacts to local staging')
 
 
+#: Pages that the sphinx json builder generates without a source document.
+json_special_pages = ('genindex', 'search', 'py-modindex')
+
+#: Files that the sphinx json builder writes for the whole site, rather than for
+#: a page.
+json_builder_files = ('globalcontext.json', 'searchindex.json')
+
+
+def get_source_docnames(conf):
+    """
+    :returns: the set of the names of all documents in the source tree, without
+       the ``.txt`` extension, relative to the source directory.
+    """
+
+    source_dir = os.path.join(conf.paths.projectroot, conf.paths.branch_source)
+
+    return set(os.path.relpath(fn, source_dir)[:-4] for fn in expand_tree(source_dir, 'txt'))
+
+
+def remove_orphaned_json(json_dir, docnames):
+    """
+    Removes the ``.fjson`` and ``.json`` files in ``json_dir`` of pages that are
+    not in ``docnames``, because sphinx does not remove the output of documents
+    that were removed or renamed. Leaves the pages and files that sphinx
+    generates without a source document, and the ``_static`` and other
+    ``_``-prefixed directories.
+    """
+
+    for fn in expand_tree(json_dir, ['fjson', 'json']):
+        rel_fn = os.path.relpath(fn, json_dir)
+        docname = os.path.splitext(rel_fn)[0]
+
+        if (docname in docnames or docname in json_special_pages or
+                rel_fn in json_builder_files or rel_fn.startswith('_')):
+            continue
+
+        verbose_remove(fn)
+
+
+def get_json_dir(conf):
+    if 'edition' in conf.project and conf.project.edition != conf.project.name:
+        return os.path.join(conf.paths.branch_output, 'json-' + conf.project.edition)
+    else:
+        return os.path.join(conf.paths.branch_output, 'json')
+
+
 def json_output_tasks(conf):
-    regexes = [
+    regexes = Rewriter([
         (re.compile(r'<a class=\"headerlink\"'), '<a'),
         (re.compile(r'<[^>]*>'), ''),
         (re.compile(r'&#8220;'), '"'),
@@ -76,41 +136,17 @@ def json_output_tasks(conf):
         (re.compile(r'&nbsp;'), ''),
         (re.compile(r'&gt;'), '>'),
         (re.compile(r'&lt;'), '<')
-    ]
-
-    outputs = []
-
-    tasks = []
-
-    for fn in expand_tree('source', 'txt'):
-        # path = build/<branch>/json/<filename>
-
-        if 'edition' in conf.project and conf.project.edition != conf.project.name:
-            path = os.path.join(conf.paths.branch_output,
-                                'json-' + conf.project.edition,
-                                os.path.splitext(fn.split(os.path.sep, 1)[1])[0])
-
-        else:
-            path = os.path.join(conf.paths.branch_output,
-                                'json', os.path.splitext(fn.split(os.path.sep, 1)[1])[0])
-
-        fjson = path + '.fjson'
-        jsonf = path + '.json'
-
-        task = libgiza.task.Task(job=process_json_file,
-                                 args=(fjson, jsonf, regexes, conf),
-                                 target=jsonf,
-                                 dependency=fjson,
-                                 description="processing json file".format(json))
-        tasks.append(task)
-        outputs.append(jsonf)
+    ])
 
     list_file = os.path.join(conf.paths.branch_output, 'json-file-list')
-    tasks.append(libgiza.task.Task(job=generate_list_file,
-                                   args=(outputs, list_file, conf),
-                                   target=list_file,
-                                   dependency=None,
-                                   description="generating list of json files"))
+
+    # the fjson files do not exist until sphinx runs, so this task finds them
+    # when it runs.
+    tasks = [libgiza.task.Task(job=process_json_output,
+                               args=(get_json_dir(conf), list_file, regexes, conf),
+                               target=list_file,
+                               dependency=None,
+                               description="processing json output")]
 
     transfer = libgiza.task.Task(job=json_output,
                                  args=[conf],
@@ -121,14 +157,14 @@ def json_output_tasks(conf):
     return tasks, transfer
 
 
-def process_json_file(input_fn, output_fn, regexes, conf=None):
+def process_json_file(input_fn, output_fn, regexes, conf=None, url=None):
     if os.path.isfile(input_fn) is False:
         return False
 
     with open(input_fn, 'r') as f:
         document = f.read()
 
-    doc = json.loads(document)
+    doc = json_loads(document)
 
     if 'body' in doc:
         text = doc['body'].encode('ascii', 'ignore')
@@ -142,17 +178,136 @@ def process_json_file(input_fn, output_fn, regexes, conf=None):
 
         doc['title'] = title
 
-    url = get_site_url(conf)
-    url.extend(input_fn.rsplit('.', 1)[0].split(os.path.sep)[3:])
-    doc['url'] = '/'.join(url) + '/'
+    if url is None:
+        url = get_site_url(conf)
+
+    doc['url'] = get_document_url(url, input_fn)
 
     with open(output_fn, 'w') as f:
-        f.write(json.dumps(doc))
+        f.write(json_dumps(doc))
 
     return True
 
 
-def generate_list_file(outputs, path, conf):
+def get_document_url(url, fn):
+    """
+    :returns: the url of the page for ``fn``, a path in the form
+       ``build/<branch>/json/<page>.fjson``, given the site ``url`` as a list.
+    """
+
+    url = list(url)
+    url.extend(fn.rsplit('.', 1)[0].split(os.path.sep)[3:])
+
+    return '/'.join(url) + '/'
+
+
+def _process_json_chunk(args):
+    jobs, regexes, url = args
+
+    return [process_json_file(fjson, fjson[:-6] + '.json', regexes, url=url)
+            for fjson in jobs]
+
+
+def load_json_manifest(fn, settings):
+    if os.path.isfile(fn):
+        try:
+            with open(fn, 'r') as f:
+                manifest = json.load(f)
+
+            if manifest.get('settings') == settings:
+                return manifest['files']
+        except ValueError:
+            logger.warning('json output manifest {0} is corrupt'.format(fn))
+
+    return {}
+
+
+def process_json_output(json_dir, list_file, regexes, conf):
+    """
+    Processes the ``.fjson`` files in ``json_dir`` of all documents in the source
+    tree into ``.json`` files, and writes the list of ``.json`` files to
+    ``list_file``. Removes the output of all other pages, see
+    :func:`remove_orphaned_json()`.
+
+    Only processes files whose ``.fjson`` file changed since the last run,
+    according to a manifest of file hashes next to ``json_dir``. Divides the files
+    into chunks and processes the chunks in a process pool, unless this is
+    already a worker process of a pool.
+    """
+
+    url = get_site_url(conf)
+    manifest_fn = json_dir + '-manifest.json'
+    settings = '/'.join(url)
+    previous = load_json_manifest(manifest_fn, settings)
+
+    # sphinx never removes the output of a page, so only the pages of the
+    # documents in the source tree are current.
+    docnames = get_source_docnames(conf)
+    remove_orphaned_json(json_dir, docnames)
+    fjsons = sorted(fn for fn in (os.path.join(json_dir, docname + '.fjson')
+                                  for docname in docnames)
+                    if os.path.isfile(fn))
+
+    files = {}
+    to_hash = []
+    for fn in fjsons:
+        sig = stat_signature(fn)
+        if fn in previous and previous[fn][0] == sig:
+            files[fn] = previous[fn]
+        else:
+            files[fn] = [sig, None]
+            to_hash.append(fn)
+
+    for fn, digest in hash_files(to_hash, conf.runstate.pool_size).items():
+        files[fn][1] = digest
+
+    to_process = [fn for fn in fjsons
+                  if previous.get(fn, [None, None])[1] != files[fn][1] or
+                  not os.path.isfile(fn[:-6] + '.json')]
+
+    pool_size = conf.runstate.pool_size
+    chunk_size = max(1, len(to_process) // (pool_size * 4))
+    chunks = [(to_process[idx:idx + chunk_size], regexes, url)
+              for idx in range(0, len(to_process), chunk_size)]
+
+    if (pool_size <= 1 or len(chunks) <= 1 or
+            multiprocessing.current_process().daemon is True):
+        results = map(_process_json_chunk, chunks)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(pool_size)
+        results = pool.imap(_process_json_chunk, chunks)
+
+    try:
+        count = sum(sum(1 for r in result if r is True) for result in results)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    m = 'processed {0} of {1} json files, {2} unchanged'
+    logger.info(m.format(count, len(fjsons), len(fjsons) - len(to_process)))
+
+    tmp_fn = manifest_fn + '.tmp'
+    with open(tmp_fn, 'w') as f:
+        json.dump({'settings': settings, 'files': files}, f)
+    os.rename(tmp_fn, manifest_fn)
+
+    outputs = [fn[:-6] + '.json' for fn in fjsons]
+    update_list_file(outputs, list_file, conf)
+
+    urls = [get_document_url(url, os.path.join(json_dir, docname + '.fjson'))
+            for docname in docnames]
+    export_search_index(json_dir, outputs, [fn[:-6] + '.json' for fn in to_process],
+                        urls, regexes)
+
+
+def update_list_file(outputs, path, conf):
+    """
+    Writes the list of json files to ``path``, and only replaces ``path`` when
+    the list has changed.
+    """
+
     dirname = os.path.dirname(path)
     safe_create_directory(dirname)
 
@@ -160,14 +315,20 @@ def generate_list_file(outputs, path, conf):
     url.append('json')
     url = '/'.join(url)
 
-    with open(path, 'w') as f:
+    tmp_fn = path + '.tmp'
+    with open(tmp_fn, 'w') as f:
         for fn in outputs:
             if os.path.isfile(fn) is True:
                 line = '/'.join([url, fn.split('/', 3)[3:][0]])
                 f.write(line)
                 f.write('\n')
 
-    logger.info('rebuilt inventory of json output.')
+    if os.path.isfile(path) and md5_file(path) == md5_file(tmp_fn):
+        os.remove(tmp_fn)
+        logger.info('inventory of json output is unchanged.')
+    else:
+        os.rename(tmp_fn, path)
+        logger.info('rebuilt inventory of json output.')
 
 
 def get_site_url(conf):
@@ -16,31 +16,129 @@
 Post-processes Sphinx's latex output and generate PDFs from these ``tex`` files.
 """
 
+import hashlib
 import logging
 import os
 import re
+import shutil
 import subprocess
 import shlex
 
 import libgiza.task
 
 from giza.content.helper import edition_check
-from giza.tools.transformation import process_page_task
-from giza.tools.files import create_link, copy_if_needed
+from giza.tools.transformation import process_page_task, munge_page, Rewriter
+from giza.tools.files import (create_link, copy_if_needed, md5_file,
+                              safe_create_directory, verbose_remove)
 
 logger = logging.getLogger('giza.content.post.latex')
 
 # PDFs from Latex Produced by Sphinx
 
+#: The maximum number of times to run ``pdflatex`` for one document.
+MAX_PDFLATEX_PASSES = 5
 
-def _render_tex_into_pdf(fn, deployed_path, path, output_format="pdf"):
+#: Files that ``pdflatex`` and ``makeindex`` write and read on the next pass.
+#: The document is complete when none of these change between two passes.
+TEX_STATE_EXTENSIONS = ('.aux', '.toc', '.idx', '.ind', '.out')
+
+#: Files in the latex directory, other than those in the ``.tex`` file, that
+#: affect every PDF.
+TEX_SUPPORT_EXTENSIONS = ('.sty', '.cls', '.ist', '.fd', '.def')
+
+tex_input_rx = re.compile(r'\\(?:includegraphics|input|include)(?:\[[^\]]*\])?\{([^}]+)\}')
+
+
+def _file_signature(fn):
+    if os.path.isfile(fn):
+        return md5_file(fn)
+    else:
+        return None
+
+
+def _tex_inputs(fn, path):
+    """
+    :returns: a sorted list of the files that the ``.tex`` file ``fn`` reads:
+       included images and documents, and the support files in ``path``.
+    """
+
+    inputs = set()
+
+    with open(fn, 'r') as f:
+        for name in tex_input_rx.findall(f.read()):
+            base = os.path.join(path, name.strip())
+            for candidate in (base, base + '.tex', base + '.pdf', base + '.png',
+                              base + '.jpg', base + '.eps'):
+                if os.path.isfile(candidate):
+                    inputs.add(candidate)
+                    break
+
+    for support_fn in os.listdir(path):
+        if support_fn.endswith(TEX_SUPPORT_EXTENSIONS):
+            inputs.add(os.path.join(path, support_fn))
+
+    return sorted(inputs)
+
+
+def tex_content_hash(fn, path, output_format):
+    """
+    :returns: a hash of the ``.tex`` file ``fn`` and all of its inputs, which
+       identifies the PDF that rendering ``fn`` would produce.
+    """
+
+    h = hashlib.md5()
+    h.update(output_format.encode('utf-8'))
+    h.update(md5_file(fn).encode('utf-8'))
+
+    for input_fn in _tex_inputs(fn, path):
+        h.update(os.path.relpath(input_fn, path).encode('utf-8'))
+        h.update(md5_file(input_fn).encode('utf-8'))
+
+    return h.hexdigest()
+
+
+def _tex_state(path, base_fn):
+    return [_file_signature(os.path.join(path, base_fn + ext)) for ext in TEX_STATE_EXTENSIONS]
+
+
+def _cache_pdf(pdf_fn, cache_dir, cache_fn):
+    """
+    Stores a copy of ``pdf_fn`` as ``cache_fn``, and removes the previously
+    cached versions of the same document in the same output format. Cache
+    files are named ``<document>-<format>-<hash>.pdf``.
+    """
+
+    safe_create_directory(cache_dir)
+    name = os.path.basename(cache_fn)
+    prefix = name.rsplit('-', 1)[0] + '-'
+
+    for fn in os.listdir(cache_dir):
+        # hashes have a fixed length, so this does not match other documents
+        # whose names start with the same prefix.
+        if fn.startswith(prefix) and len(fn) == len(name) and fn != name:
+            verbose_remove(os.path.join(cache_dir, fn))
+
+    tmp_fn = cache_fn + '.tmp'
+    shutil.copyfile(pdf_fn, tmp_fn)
+    os.rename(tmp_fn, cache_fn)
+
+
+def _render_tex_into_pdf(fn, deployed_path, path, output_format="pdf", cache_dir=None):
     """
     Runs ``pdflatex`` operations, can generate ``dvi`` and ``pdf``. Runs
-    pdflatex multiple times to correctly index and cross reference the PDF.
+    pdflatex, and ``makeindex`` when the index changes, until the auxiliary
+    files stop changing, to correctly index and cross reference the PDF.
+
+    When ``cache_dir`` contains a PDF rendered from the same ``.tex`` file and
+    inputs, copies that PDF instead of running ``pdflatex``.
     """
 
     inputs_path = ".:{0}:".format(path)
-    os.environ['TEXINPUTS'] = inputs_path
+
+    # each job gets its own environment: changing os.environ would affect all
+    # PDFs rendering at the same time in a thread pool.
+    env = dict(os.environ)
+    env['TEXINPUTS'] = inputs_path
 
     if output_format == 'dvi':
         cmd = 'pdflatex --output-format dvi --interaction batchmode --output-directory {0} {1}'
@@ -51,41 +149,96 @@ def _render_tex_into_pdf(fn, deployed_path, path, output_format="pdf"):
         logger.error('not rendering pdf because {0} is not an output format'.format(output_format))
         return
 
-    base_fn = os.path.basename(fn)
-    cmds = [pdflatex,
-            "makeindex -s {0}/python.ist {0}/{1}.idx ".format(path, base_fn[:-4]),
-            pdflatex,
-            pdflatex]
+    base_fn = os.path.basename(fn)[:-4]
+    pdf_fn = os.path.splitext(fn)[0] + '.pdf'
+
+    if cache_dir is not None:
+        # the pdf and dvi renders of a document are cached side by side.
+        cache_fn = os.path.join(cache_dir, '-'.join((base_fn, output_format,
+                                                     tex_content_hash(fn, path, output_format))))
+        cache_fn += '.pdf'
 
-    if output_format == 'dvi':
-        cmds.append("dvipdf {0}.dvi".format(base_fn[:-4]))
+        if os.path.isfile(cache_fn):
+            copy_if_needed(cache_fn, pdf_fn, 'pdf')
+            copy_if_needed(pdf_fn, deployed_path, 'pdf')
+            logger.info('using cached pdf for {0}, the tex source has not changed.'.format(base_fn))
+            return
+
+    makeindex = "makeindex -s {0}/python.ist {0}/{1}.idx ".format(path, base_fn)
+    idx_fn = os.path.join(path, base_fn + '.idx')
 
     with open(os.devnull, 'w') as null:
-        for idx, cmd in enumerate(cmds):
-            ret = subprocess.call(args=shlex.split(cmd),
-                                  cwd=path,
-                                  stdout=null,
-                                  stderr=null)
-            if ret == 0:
-                m = 'pdf completed rendering stage {0} of {1} successfully ({2}, {3}).'
-                logger.info(m.format(idx + 1, len(cmds), base_fn, ret))
-                continue
-            else:
-                if idx <= 1:
+        def run(cmd):
+            return subprocess.call(args=shlex.split(cmd), cwd=path, env=env,
+                                   stdout=null, stderr=null)
+
+        previous = _tex_state(path, base_fn)
+
+        for idx in range(MAX_PDFLATEX_PASSES):
+            index = _file_signature(idx_fn)
+            ret = run(pdflatex)
+
+            if ret != 0:
+                if idx == 0:
                     m = 'pdf build encountered error early on {0}, continuing cautiously.'
                     logger.warning(m.format(base_fn))
+                    previous = None
                     continue
                 else:
                     m = 'pdf build encountered error running pdflatex, investigate {0}. terminating'
                     logger.error(m.format(base_fn))
                     logger.error(' '.join(['TEXINPUTS={0} '.format(inputs_path),
-                                           cmd.replace('--interaction batchmode', '')]))
+                                           pdflatex.replace('--interaction batchmode', '')]))
                     return False
 
-    pdf_fn = os.path.splitext(fn)[0] + '.pdf'
+            if os.path.isfile(idx_fn) and (_file_signature(idx_fn) != index or
+                                           not os.path.isfile(idx_fn[:-4] + '.ind')):
+                if run(makeindex) != 0:
+                    logger.warning('makeindex encountered an error for {0}'.format(base_fn))
+
+            current = _tex_state(path, base_fn)
+
+            m = 'pdf completed pdflatex pass {0} successfully ({1}).'
+            logger.info(m.format(idx + 1, base_fn))
+
+            if current == previous:
+                break
+            else:
+                previous = current
+        else:
+            m = 'pdf cross references for {0} did not stabilize after {1} passes.'
+            logger.warning(m.format(base_fn, MAX_PDFLATEX_PASSES))
+
+        if output_format == 'dvi':
+            ret = run("dvipdf {0}.dvi".format(base_fn))
+            if ret != 0:
+                logger.error('dvipdf encountered an error for {0}'.format(base_fn))
+                return False
+
+    if cache_dir is not None:
+        _cache_pdf(pdf_fn, cache_dir, cache_fn)
+
     copy_if_needed(pdf_fn, deployed_path, 'pdf')
 
 
+def _render_pdf(source_fn, processed_fn, tex_regexes, deployed_path, path,
+                output_format="pdf", cache_dir=None):
+    """
+    Post-processes the ``.tex`` file that Sphinx wrote, when it changed, then
+    renders the PDF. See :func:`_render_tex_into_pdf()`.
+    """
+
+    # tex files without a tag are processed in place, and must be processed
+    # every time.
+    if (processed_fn == source_fn or not os.path.isfile(processed_fn) or
+            os.stat(source_fn).st_mtime > os.stat(processed_fn).st_mtime):
+        tmp_fn = source_fn + '~'
+        munge_page(fn=source_fn, out_fn=tmp_fn, regex=tex_regexes, tag='tex-munge')
+        copy_if_needed(tmp_fn, processed_fn, 'tex-munge')
+
+    return _render_tex_into_pdf(processed_fn, deployed_path, path, output_format, cache_dir)
+
+
 def pdf_tasks(sconf, conf):
     """Returns a list of Tasks() to generate all PDFs."""
 
@@ -95,12 +248,12 @@ def pdf_tasks(sconf, conf):
         return []
 
     # a list of tuples in (compileRegex, substitution) format.
-    tex_regexes = [
+    tex_regexes = Rewriter([
         (re.compile(r'(index|bfcode)\{(.*)--(.*)\}'),
          r'\1\{\2-\{-\}\3\}'),
         (re.compile(r'\\PYGZsq{}'), "'"),
         (re.compile(r'\\code\{/(?!.*{}/|etc|usr|data|var|srv|data|bin|dev|opt|proc|24|private)'),
-         r'\code{' + conf.project.url + r'/' + conf.project.tag + r'/')]
+         r'\code{' + conf.project.url + r'/' + conf.project.tag + r'/')])
 
     # the path that sphinx writes tex files to are are different for editions.
     if 'edition' in conf.project and conf.project.edition != conf.project.name:
@@ -111,6 +264,7 @@ def pdf_tasks(sconf, conf):
         latex_dir = os.path.join(conf.paths.projectroot, conf.paths.branch_output, target)
 
     deploy_path = os.path.join(conf.paths.projectroot, conf.paths.public_site_output)
+    cache_dir = os.path.join(conf.paths.projectroot, conf.paths.branch_output, 'pdf-cache')
 
     # special case operations on "offset pdfs", which use EPS images.
     if 'tags' in sconf and "offset" in sconf.tags:
@@ -148,21 +302,17 @@ def pdf_tasks(sconf, conf):
         i['link'] = os.path.join(deploy_path, link_name)
         i['path'] = latex_dir
 
-        # add the processing task
-        t = process_page_task(fn=i['source'],
-                              output_fn=i['processed'],
-                              regex=tex_regexes,
-                              builder='tex-munge',
-                              copy='ifNeeded')
-        tasks.append(t)
-
-        # add task for changing TEX to PDF. (this also copies the pdf to the deployed path).
-        render_task = libgiza.task.Task(job=_render_tex_into_pdf,
-                                        args=(i['processed'], i['deployed'],
-                                              i['path'], output_format),
+        # add task for processing the TEX and changing it to PDF. (this also
+        # copies the pdf to the deployed path). The pool renders PDFs
+        # concurrently.
+        render_task = libgiza.task.Task(job=_render_pdf,
+                                        args=(i['source'], i['processed'], tex_regexes,
+                                              i['deployed'], i['path'], output_format,
+                                              cache_dir),
                                         target=i['pdf'],
-                                        dependency=None)  # i['processed']
-        t.finalizers.append(render_task)
+                                        dependency=None,
+                                        description='rendering pdf ' + deploy_fn)
+        tasks.append(render_task)
 
         # if needed create links.
         if i['link'] != i['deployed']:
@@ -0,0 +1,163 @@
+# Copyright 2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Exports the processed json output as bulk files for the search indexer, so that
+reindexing the site is one sequential read rather than a crawl of thousands of
+``.json`` files:
+
+- ``search-index.ndjson.gz`` has one json document per line, with the ``url``,
+  ``title``, ``text`` and ``headings`` of every page.
+
+- ``search-index-delta.ndjson.gz`` has the same documents, with an ``action``
+  of ``index``, for the pages that changed since the previous build, and
+  documents with an ``action`` of ``delete`` for the pages that were removed.
+
+- ``search-index-urls.json`` has the list of the urls of all documents at the
+  previous build, to find the removed pages.
+
+Both files are in the json output directory, and are published with the rest
+of the json output.
+"""
+
+import gzip
+import json
+import logging
+import os
+import re
+
+from giza.tools.files import md5_file
+
+logger = logging.getLogger('giza.content.post.search_index')
+
+heading_rx = re.compile(r'<h([1-6])[^>]*>(.*?)</h\1>', re.DOTALL)
+
+
+def get_headings(body, regexes):
+    headings = []
+
+    for _, heading in heading_rx.findall(body):
+        heading = regexes.sub(heading).replace(u'\u00b6', '').strip()
+        if heading:
+            headings.append(heading)
+
+    return headings
+
+
+def get_search_document(doc, regexes):
+    return {
+        'url': doc['url'],
+        'title': doc.get('title', ''),
+        'text': doc.get('text', ''),
+        'headings': get_headings(doc.get('body', ''), regexes),
+    }
+
+
+def _write_ndjson(fn, records):
+    """
+    Writes ``records`` to a gzipped ndjson file, and only replaces ``fn`` if the
+    content changed. The gzip header has no timestamp, so the same records
+    always produce the same file.
+    """
+
+    tmp_fn = fn + '.tmp'
+    count = 0
+
+    with open(tmp_fn, 'wb') as f:
+        with gzip.GzipFile(filename='', fileobj=f, mode='wb', mtime=0) as out:
+            for record in records:
+                out.write(json.dumps(record).encode('utf-8'))
+                out.write(b'\n')
+                count += 1
+
+    if os.path.isfile(fn) and md5_file(fn) == md5_file(tmp_fn):
+        os.remove(tmp_fn)
+        return None
+    else:
+        os.rename(tmp_fn, fn)
+        return count
+
+
+def _read_documents(fns, regexes):
+    for fn in fns:
+        with open(fn, 'r') as f:
+            doc = json.load(f)
+
+        yield get_search_document(doc, regexes)
+
+
+def load_indexed_urls(urls_fn, bulk_fn):
+    """
+    :returns: the set of urls of all documents at the previous build, from
+       ``urls_fn``, or the urls in the bulk file ``bulk_fn`` when there is no
+       list of urls.
+    """
+
+    if os.path.isfile(urls_fn):
+        try:
+            with open(urls_fn, 'r') as f:
+                return set(json.load(f))
+        except ValueError:
+            logger.warning('list of indexed urls {0} is corrupt'.format(urls_fn))
+
+    if os.path.isfile(bulk_fn):
+        with gzip.open(bulk_fn, 'rb') as f:
+            return set(json.loads(line.decode('utf-8'))['url'] for line in f)
+
+    return set()
+
+
+def export_search_index(json_dir, outputs, changed, urls, regexes):
+    """
+    :param list outputs: the ``.json`` files of all pages.
+
+    :param list changed: the ``.json`` files of pages that changed since the
+       previous build.
+
+    :param list urls: the urls of all documents. The documents of the previous
+       build that are not in ``urls`` were removed, whether or not their output
+       still exists.
+
+    :param Rewriter regexes: the substitutions that turn html into text.
+    """
+
+    bulk_fn = os.path.join(json_dir, 'search-index.ndjson.gz')
+    delta_fn = os.path.join(json_dir, 'search-index-delta.ndjson.gz')
+    urls_fn = os.path.join(json_dir, 'search-index-urls.json')
+
+    removed = sorted(load_indexed_urls(urls_fn, bulk_fn) - set(urls))
+    outputs = [fn for fn in outputs if os.path.isfile(fn)]
+
+    if len(changed) > 0 or len(removed) > 0 or not os.path.isfile(bulk_fn):
+        count = _write_ndjson(bulk_fn, _read_documents(outputs, regexes))
+        if count is not None:
+            logger.info('wrote {0} documents to {1}'.format(count, bulk_fn))
+
+    def delta():
+        for doc in _read_documents([fn for fn in changed if os.path.isfile(fn)], regexes):
+            doc['action'] = 'index'
+            yield doc
+
+        for url in removed:
+            yield {'action': 'delete', 'url': url}
+
+    count = _write_ndjson(delta_fn, delta())
+    if count is not None:
+        m = 'wrote {0} changed and {1} removed documents to {2}'
+        logger.info(m.format(len(changed), len(removed), delta_fn))
+
+    tmp_fn = urls_fn + '.tmp'
+    with open(tmp_fn, 'w') as f:
+        json.dump(sorted(urls), f)
+    os.rename(tmp_fn, urls_fn)
@@ -25,7 +25,7 @@ import re
 import libgiza.task
 
 from giza.tools.files import expand_tree, copy_if_needed, safe_create_directory
-from giza.tools.transformation import decode_lines_from_file, encode_lines_to_file
+from giza.tools.transformation import munge_page, Rewriter
 
 logger = logging.getLogger('giza.content.post.singlehtml')
 
@@ -40,18 +40,14 @@ def manual_single_html(input_file, output_file):
         logging.info('singlehtml not changed, not reprocessing.')
         return False
     else:
-        text_lines = decode_lines_from_file(input_file)
-
-        regexes = [
+        regexes = Rewriter([
             (re.compile('href="contents.html'), 'href="index.html'),
             (re.compile('name="robots" content="index"'), 'name="robots" content="noindex"'),
             (re.compile('href="genindex.html'), 'href="../genindex/')
-        ]
-
-        for regex, subst in regexes:
-            text_lines = [regex.sub(subst, text) for text in text_lines]
+        ])
 
-        encode_lines_to_file(output_file, text_lines)
+        safe_create_directory(os.path.dirname(output_file))
+        munge_page(fn=input_file, out_fn=output_file, regex=regexes, tag='singlehtml')
 
         logger.info('processed singlehtml file.')
 
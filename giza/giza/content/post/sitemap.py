@@ -0,0 +1,409 @@
+# Copyright 2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Generates sitemaps for ``dirhtml`` builds from the pages that Sphinx wrote,
+rather than by walking the published site.
+
+The pages come from the ``filenames`` list in the ``searchindex.js`` file of
+the build, and the ``lastmod`` of every page is the modification time of its
+``index.html`` file. URLs are divided between shards by a hash of the URL, so
+that adding or changing a page only changes one shard. A manifest records a
+digest of every shard, and only shards whose digest changed are written again.
+Shards are gzipped ``urlset`` files, written one URL at a time. The URLs are
+never all in memory: the pages are read once to digest the shards, and once
+more for every shard that changed.
+
+With one shard, the sitemap is the ``store_into`` file from the sitemap
+configuration, as with ``bin/sitemap_gen.py``. With more than one shard,
+``store_into`` is a ``sitemapindex`` of the shards.
+
+The configuration file has the same format as the configuration of
+``bin/sitemap_gen.py``: the ``base_url`` and ``store_into`` of the ``site``,
+the ``url`` and ``default_file`` of the first ``directory``, any number of
+``url`` entries, and ``filter`` entries, of which the first that matches a URL
+decides if the URL is in the sitemap.
+"""
+
+import fnmatch
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import xml.etree.ElementTree
+
+from xml.sax.saxutils import escape
+
+from giza.tools.files import safe_create_directory
+
+logger = logging.getLogger('giza.content.post.sitemap')
+
+MANIFEST_VERSION = 1
+
+#: The maximum number of URLs in one sitemap file.
+SITEMAP_URL_LIMIT = 50000
+
+#: The average number of URLs per shard when the number of shards grows. Hash
+#: partitioning does not divide URLs evenly, so shards start half full.
+SHARD_TARGET_SIZE = SITEMAP_URL_LIMIT // 2
+
+SITEMAP_HEADER = (u'<?xml version="1.0" encoding="UTF-8"?>\n'
+                  u'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+SITEMAP_FOOTER = u'</urlset>\n'
+SITEMAP_ENTRY = u' <url>\n  <loc>{0}</loc>\n{1} </url>\n'
+LASTMOD_ENTRY = u'  <lastmod>{0}</lastmod>\n'
+
+SITEINDEX_HEADER = (u'<?xml version="1.0" encoding="UTF-8"?>\n'
+                    u'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+SITEINDEX_FOOTER = u'</sitemapindex>\n'
+SITEINDEX_ENTRY = u' <sitemap>\n  <loc>{0}</loc>\n  <lastmod>{1}</lastmod>\n </sitemap>\n'
+
+filenames_rx = re.compile(r'[{,]"?filenames"?:(\[[^\]]*\])')
+
+
+def timestamp(t):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(t))
+
+
+class SitemapConfig(object):
+    def __init__(self, fn):
+        tree = xml.etree.ElementTree.parse(fn)
+        site = tree.getroot()
+
+        if site.tag != 'site':
+            raise ValueError('{0} is not a sitemap configuration'.format(fn))
+
+        self.base_url = site.get('base_url')
+        self.store_into = site.get('store_into')
+
+        if self.base_url is None or self.store_into is None:
+            raise ValueError('{0} must specify a base_url and store_into'.format(fn))
+
+        if not self.base_url.endswith('/'):
+            self.base_url += '/'
+
+        self.url = self.base_url
+        self.default_file = 'index.html'
+        self.urls = []
+        self.filters = []
+
+        for el in site:
+            if el.tag == 'directory':
+                if self.url == self.base_url and el.get('url') is not None:
+                    self.url = el.get('url')
+                    if not self.url.endswith('/'):
+                        self.url += '/'
+                    if not self.url.startswith(self.base_url):
+                        self.url = self.base_url + self.url.lstrip('/')
+
+                    self.default_file = el.get('default_file', self.default_file)
+            elif el.tag == 'url' and el.get('href') is not None:
+                self.urls.append((el.get('href'), el.get('lastmod')))
+            elif el.tag == 'filter':
+                self.add_filter(el.get('pattern'),
+                                el.get('type', 'wildcard').lower(),
+                                el.get('action', 'drop').lower())
+            elif el.tag in ('urllist', 'accesslog', 'sitemap'):
+                m = 'sitemap: ignoring "{0}" input in {1}, pages come from the build'
+                logger.warning(m.format(el.tag, fn))
+
+    def add_filter(self, pattern, kind, action):
+        if pattern is None or kind not in ('wildcard', 'regexp') or action not in ('drop', 'pass'):
+            logger.error('sitemap: ignoring invalid filter for "{0}"'.format(pattern))
+            return
+
+        if kind == 'wildcard':
+            self.filters.append((lambda url: fnmatch.fnmatchcase(url, pattern), action == 'pass'))
+        else:
+            regex = re.compile(pattern)
+            self.filters.append((lambda url: regex.search(url) is not None, action == 'pass'))
+
+    def accept(self, url):
+        for match, accept in self.filters:
+            if match(url):
+                return accept
+
+        return True
+
+
+def get_dirhtml_pages(build_output):
+    """
+    :returns: the names of the documents in the ``dirhtml`` build in
+       ``build_output``, as listed in its search index, or ``None`` if the
+       build has no search index.
+    """
+
+    fn = os.path.join(build_output, 'searchindex.js')
+    if not os.path.isfile(fn):
+        return None
+
+    with open(fn, 'r') as f:
+        match = filenames_rx.search(f.read())
+
+    if match is None:
+        return None
+    else:
+        return json.loads(match.group(1))
+
+
+def get_page_path(docname, default_file):
+    """:returns: a tuple of the path of ``docname`` relative to the site, and of its html file."""
+
+    if docname == 'index':
+        return '', default_file
+    elif docname.endswith('/index'):
+        path = docname[:-5]
+    else:
+        path = docname + '/'
+
+    return path, path + default_file
+
+
+def iter_sitemap_urls(config, build_output, docnames, excluded=None):
+    """
+    Yields ``(loc, lastmod)`` tuples for every URL in the sitemap. ``lastmod``
+    is ``None`` for configured URLs without a ``lastmod`` attribute.
+    """
+
+    if excluded is None:
+        excluded = set()
+
+    for href, lastmod in config.urls:
+        if config.accept(href):
+            yield escape(href), lastmod
+
+    for docname in docnames:
+        path, html_fn = get_page_path(docname, config.default_file)
+
+        if path.rstrip('/') in excluded:
+            continue
+
+        loc = config.url + path
+        if not config.accept(loc):
+            continue
+
+        try:
+            mtime = os.stat(os.path.join(build_output, html_fn)).st_mtime
+        except OSError:
+            continue
+
+        yield escape(loc), timestamp(mtime)
+
+
+def get_shard(loc, shards):
+    return int(hashlib.md5(loc.encode('utf-8')).hexdigest()[:8], 16) % shards
+
+
+def scan_shards(urls, shards):
+    """
+    :returns: the number of the ``(loc, lastmod)`` tuples in ``urls``, and
+       lists of the number of URLs and of the digest of each of ``shards``
+       shards.
+    """
+
+    sizes = [0] * shards
+    digests = [hashlib.md5() for _ in range(shards)]
+    count = 0
+
+    for loc, lastmod in urls:
+        idx = get_shard(loc, shards)
+        sizes[idx] += 1
+        digests[idx].update(u'{0} {1}\n'.format(loc, lastmod).encode('utf-8'))
+        count += 1
+
+    return count, sizes, [d.hexdigest() for d in digests]
+
+
+def load_manifest(fn):
+    if os.path.isfile(fn):
+        try:
+            with open(fn, 'r') as f:
+                manifest = json.load(f)
+
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest
+        except ValueError:
+            logger.warning('sitemap manifest {0} is corrupt, rebuilding'.format(fn))
+
+    return {'version': MANIFEST_VERSION, 'shards': []}
+
+
+def dump_manifest(fn, manifest):
+    tmp_fn = fn + '.tmp'
+    with open(tmp_fn, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(tmp_fn, fn)
+
+
+def _write_file(fn, header, entries, footer):
+    """
+    Writes ``entries`` to ``fn`` as they are generated, and gzips the output if
+    ``fn`` ends with ``.gz``. The gzip header has no timestamp, so the same
+    entries always produce the same file.
+    """
+
+    tmp_fn = fn + '.tmp'
+
+    with open(tmp_fn, 'wb') as f:
+        if fn.endswith('.gz'):
+            out = gzip.GzipFile(filename='', fileobj=f, mode='wb', mtime=0)
+        else:
+            out = f
+
+        out.write(header.encode('utf-8'))
+        for entry in entries:
+            out.write(entry.encode('utf-8'))
+        out.write(footer.encode('utf-8'))
+        out.close()
+
+    os.rename(tmp_fn, fn)
+
+
+def write_sitemap(fn, urls):
+    _write_file(fn, SITEMAP_HEADER,
+                (SITEMAP_ENTRY.format(loc, LASTMOD_ENTRY.format(lastmod) if lastmod else '')
+                 for loc, lastmod in urls),
+                SITEMAP_FOOTER)
+
+
+def write_sitemap_index(fn, sitemaps):
+    _write_file(fn, SITEINDEX_HEADER,
+                (SITEINDEX_ENTRY.format(escape(loc), lastmod) for loc, lastmod in sitemaps),
+                SITEINDEX_FOOTER)
+
+
+def _split_sitemap_fn(store_into):
+    base = os.path.basename(store_into)
+    if base.endswith('.gz'):
+        base, ext = base[:-3], '.gz'
+    else:
+        ext = ''
+
+    base, xml_ext = os.path.splitext(base)
+
+    return base, xml_ext + ext
+
+
+def get_shard_fn(store_into, idx):
+    base, ext = _split_sitemap_fn(store_into)
+
+    return os.path.join(os.path.dirname(store_into), '{0}-{1}{2}'.format(base, idx, ext))
+
+
+def get_stale_shards(path, sitemap_fns):
+    """
+    :param list sitemap_fns: the sitemap files of a build, as returned by
+       :func:`generate_sitemap()`, of which the first is the ``store_into`` file.
+
+    :returns: the files in the directory ``path`` that are shards of the sitemap,
+       but not one of ``sitemap_fns``. Shards that :func:`generate_sitemap()`
+       removes from the build remain wherever the build was published.
+    """
+
+    if len(sitemap_fns) == 0 or not os.path.isdir(path):
+        return []
+
+    base, ext = _split_sitemap_fn(sitemap_fns[0])
+    shard_rx = re.compile(re.escape(base) + r'-[0-9]+' + re.escape(ext) + '$')
+    current = set(os.path.basename(fn) for fn in sitemap_fns)
+
+    return [os.path.join(path, fn) for fn in sorted(os.listdir(path))
+            if shard_rx.match(fn) and fn not in current]
+
+
+def generate_sitemap(config_fn, build_output, excluded=None):
+    """
+    Writes the sitemap for the ``dirhtml`` build in ``build_output``.
+
+    :param list excluded: paths, relative to the site, of pages removed from
+       the published site.
+
+    :returns: a list of the sitemap files that the site must publish, or
+       ``None`` if the build does not list its pages.
+    """
+
+    docnames = get_dirhtml_pages(build_output)
+    if docnames is None:
+        return None
+
+    config = SitemapConfig(config_fn)
+    excluded = set(fn.strip('/') for fn in excluded or [])
+    safe_create_directory(os.path.dirname(os.path.abspath(config.store_into)))
+
+    def urls():
+        return iter_sitemap_urls(config, build_output, docnames, excluded)
+
+    manifest_fn = config.store_into + '-manifest.json'
+    manifest = load_manifest(manifest_fn)
+
+    # the number of shards only grows, so that the assignment of URLs to
+    # shards, and therefore the shards, stay the same from build to build. The
+    # URLs are streamed rather than held in memory: the first pass counts and
+    # digests the shards, and the URLs of every shard that changed are read
+    # again to write the shard. A pass starts again when the number of shards
+    # must grow, which is rare.
+    num_shards = max(len(manifest['shards']), 1)
+
+    while True:
+        count, sizes, digests = scan_shards(urls(), num_shards)
+
+        if -(-count // SHARD_TARGET_SIZE) > num_shards:
+            num_shards = -(-count // SHARD_TARGET_SIZE)
+        elif max(sizes) > SITEMAP_URL_LIMIT:
+            num_shards *= 2
+        else:
+            break
+
+    if num_shards == 1:
+        shard_fns = [config.store_into]
+    else:
+        shard_fns = [get_shard_fn(config.store_into, idx) for idx in range(num_shards)]
+
+    previous = dict((shard['fn'], shard) for shard in manifest['shards'])
+    shards = []
+    changed = 0
+
+    for idx, fn in enumerate(shard_fns):
+        if (fn in previous and previous[fn]['digest'] == digests[idx] and
+                len(previous) == num_shards and os.path.isfile(fn)):
+            shards.append(previous[fn])
+            continue
+
+        write_sitemap(fn, ((loc, lastmod) for loc, lastmod in urls()
+                           if num_shards == 1 or get_shard(loc, num_shards) == idx))
+        shards.append({'fn': fn, 'digest': digests[idx], 'lastmod': timestamp(time.time())})
+        changed += 1
+
+    if num_shards > 1 and (changed > 0 or len(previous) != num_shards or
+                           not os.path.isfile(config.store_into)):
+        write_sitemap_index(config.store_into,
+                            [(config.base_url + os.path.basename(shard['fn']), shard['lastmod'])
+                             for shard in shards])
+
+    for fn in previous:
+        if fn not in shard_fns and fn != config.store_into and os.path.isfile(fn):
+            os.remove(fn)
+
+    dump_manifest(manifest_fn, {'version': MANIFEST_VERSION, 'shards': shards})
+
+    m = 'sitemap: wrote {0} of {1} sitemap files with {2} urls, from {3}'
+    logger.info(m.format(changed, num_shards, count, config_fn))
+
+    if num_shards == 1:
+        return shard_fns
+    else:
+        return [config.store_into] + shard_fns
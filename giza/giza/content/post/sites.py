@@ -22,6 +22,7 @@ import shutil
 from giza.tools.transformation import munge_page
 from giza.tools.files import create_link, copy_if_needed
 from giza.content.post.singlehtml import get_single_html_dir
+from giza.content.post.sitemap import generate_sitemap, get_stale_shards
 
 logger = logging.getLogger('giza.content.post.sites')
 
@@ -101,28 +102,25 @@ def finalize_dirhtml_build(sconf, conf):
             logger.info('removed file from dirhtml output directory: ' + fn)
 
     if conf.git.branches.current in conf.git.branches.published:
-        sitemap_exists = sitemap(config_path=None, conf=conf)
+        excluded = sconf['dirhtml']['excluded_files'] if 'excluded_files' in sconf else []
+        sitemap_fns = sitemap(config_path=None, conf=conf,
+                              build_output=sconf.fq_build_output, excluded=excluded)
 
-        legacy_sitemap_fn = os.path.join(conf.paths.projectroot,
-                                         conf.paths.branch_output,
-                                         'sitemap.xml.gz')
+        for fn in sitemap_fns:
+            if os.path.exists(fn):
+                copy_if_needed(source_file=fn,
+                               target_file=os.path.join(dest, os.path.basename(fn)))
 
-        if os.path.exists(legacy_sitemap_fn) and sitemap_exists is True:
-            copy_if_needed(source_file=legacy_sitemap_fn,
-                           target_file=os.path.join(conf.paths.projectroot,
-                                                    conf.paths.public_site_output,
-                                                    'sitemap.xml.gz'))
+        for fn in get_stale_shards(dest, sitemap_fns):
+            os.remove(fn)
+            logger.info('removed stale sitemap file from dirhtml output directory: ' + fn)
 
 
-def sitemap(config_path, conf):
-    sys.path.append(os.path.join(conf.paths.projectroot, conf.paths.buildsystem, 'bin'))
-    import sitemap_gen
-
+def get_sitemap_config(config_path, conf):
     config_paths = []
     if config_path is not None:
         config_paths.append(config_path)
         config_paths.append(os.path.join(conf.paths.projectroot, conf.paths.builddata, config_path))
-        config_path = None
 
     default_name = 'conf-sitemap.xml'
     config_paths.extend([default_name,
@@ -139,21 +137,51 @@ def sitemap(config_path, conf):
 
     for path in config_paths:
         if os.path.isfile(path):
-            config_path = path
-            break
+            return path
+
+    return None
+
+
+def sitemap(config_path, conf, build_output=None, excluded=None):
+    """
+    Generates the sitemap from the pages of the ``dirhtml`` build in
+    ``build_output``, and falls back to walking the site with
+    ``bin/sitemap_gen.py`` if the build does not list its pages.
+
+    :returns: a list of the sitemap files to publish.
+    """
 
-    if config_path is None:
+    config_fn = get_sitemap_config(config_path, conf)
+
+    if config_fn is None:
         m = 'sitemap: configuration file {0} does not exist. Returning early'
         logger.error(m.format(config_path))
-        return False
+        return []
+
+    if build_output is not None:
+        try:
+            sitemap_fns = generate_sitemap(config_fn, build_output, excluded)
+        except (ValueError, SyntaxError) as e:
+            logger.error('sitemap: could not read {0}: {1}'.format(config_fn, e))
+            return []
 
-    sitemap = sitemap_gen.CreateSitemapFromFile(configpath=config_path,
+        if sitemap_fns is not None:
+            return sitemap_fns
+        else:
+            m = 'sitemap: {0} has no search index, walking the site'
+            logger.warning(m.format(build_output))
+
+    sys.path.append(os.path.join(conf.paths.projectroot, conf.paths.buildsystem, 'bin'))
+    import sitemap_gen
+
+    sitemap = sitemap_gen.CreateSitemapFromFile(configpath=config_fn,
                                                 suppress_notify=True)
     if sitemap is None:
         logger.error('sitemap: failed to generate the sitemap due to encountered errors.')
-        return False
+        return []
 
     sitemap.Generate()
 
-    logger.info('sitemap: generated sitemap according to the config file {0}'.format(config_path))
-    return True
+    logger.info('sitemap: generated sitemap according to the config file {0}'.format(config_fn))
+
+    return [os.path.join(conf.paths.projectroot, conf.paths.branch_output, 'sitemap.xml.gz')]
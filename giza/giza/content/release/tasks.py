@@ -18,6 +18,7 @@ import shutil
 from giza.content.release.inheritance import ReleaseDataCache
 from giza.content.release.views import render_releases
 from giza.config.content import new_content_type
+from giza.content.helper import write_content
 from libgiza.task import Task
 
 logger = logging.getLogger('giza.content.release.tasks')
@@ -33,8 +34,8 @@ def register_releases(conf):
 
 def write_release_file(release, fn, conf):
     content = render_releases(release, conf)
-    content.write(fn)
-    logger.info('wrote release content: ' + fn)
+    if write_content(content, fn):
+        logger.info('wrote release content: ' + fn)
 
 
 def release_tasks(conf):
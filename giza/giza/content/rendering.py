@@ -0,0 +1,198 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Runs the rendering tasks of the content generators (steps, options, apiargs,
+extracts, tables, and so on) in a pool of processes.
+
+The tasks that the content generators return hold the parsed content objects
+and the configuration. Sending these to a process pool task by task pickles
+the configuration once for every output file, so :func:`render_content_tasks()`
+keeps the tasks in a module-level list before it creates the pool: the forked
+workers inherit the list, and receive only shards of indexes into it.
+
+The render functions write files with
+:func:`~giza.content.helper.write_content()`, which leaves unchanged files
+alone, so that re-rendering content does not change the ``mtime`` of the
+files that Sphinx reads. The target of a task that rendered unchanged output
+therefore stays older than its source, so every task that runs touches a stamp
+file for its target, and a task whose stamp is newer than its dependencies does
+not run again.
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import sys
+
+from libgiza.task import check_dependency
+
+from giza.tools.files import safe_create_directory
+
+logger = logging.getLogger('giza.content.rendering')
+
+if sys.version_info >= (3, 0):
+    basestring = str
+
+#: The tasks of the current :func:`render_content_tasks()` call, which pool
+#: workers inherit when they fork.
+_tasks = []
+
+
+def _run_task(task):
+    task.run()
+
+    if len(task.finalizers) > 0:
+        task.finalize()
+
+
+def _render_shard(shard):
+    errors = []
+
+    for idx in shard:
+        try:
+            _run_task(_tasks[idx])
+        except Exception as e:
+            errors.append((idx, '{0}: {1}'.format(type(e).__name__, e)))
+
+    return errors
+
+
+def shard_tasks(num_tasks, num_shards):
+    """
+    :returns: ``num_shards`` lists of indexes, that divide ``num_tasks`` tasks
+       round-robin, so that tasks from the same generator, which tend to take
+       similar time, spread over all shards.
+    """
+
+    return [list(range(idx, num_tasks, num_shards)) for idx in range(num_shards)]
+
+
+def get_targets(task):
+    """:returns: the list of target files of ``task``, or ``None`` if it has none."""
+
+    if isinstance(task.target, list):
+        return task.target
+    elif isinstance(task.target, basestring):
+        return [task.target]
+    else:
+        return None
+
+
+def get_stamp_fn(stamp_dir, task):
+    """
+    :returns: the name of the stamp file in ``stamp_dir`` for the targets of
+       ``task``, or ``None`` if the task has no target file.
+    """
+
+    targets = get_targets(task)
+    if targets is None:
+        return None
+
+    digest = hashlib.md5('\n'.join(targets).encode('utf-8')).hexdigest()
+    return os.path.join(stamp_dir, digest)
+
+
+def needs_rebuild(task, stamp_dir=None):
+    """
+    :returns: ``True`` if ``task`` needs to run, because its target is older
+       than its dependencies, and there is no stamp in ``stamp_dir`` from a
+       run since its dependencies changed.
+    """
+
+    if task.needs_rebuild is False:
+        return False
+    elif stamp_dir is None or task.force is True or task.dependency is None:
+        return True
+
+    targets = get_targets(task)
+    if targets is None or not all(os.path.exists(fn) for fn in targets):
+        return True
+    else:
+        return check_dependency(get_stamp_fn(stamp_dir, task), task.dependency)
+
+
+def touch_stamps(tasks, stamp_dir):
+    safe_create_directory(stamp_dir)
+
+    for task in tasks:
+        stamp_fn = get_stamp_fn(stamp_dir, task)
+        if stamp_fn is not None:
+            with open(stamp_fn, 'a'):
+                os.utime(stamp_fn, None)
+
+
+def render_content_tasks(tasks, pool_size, stamp_dir=None):
+    """
+    Runs every task in ``tasks`` that needs to rebuild. Runs the tasks in a
+    process pool of ``pool_size`` workers unless ``pool_size`` is 1 or this is
+    already a worker process of a pool.
+
+    :param string stamp_dir: a directory for the stamp files of the tasks that
+       ran, see :func:`needs_rebuild()`.
+
+    :returns: the number of tasks that ran.
+
+    :raises: :exc:`RuntimeError` if any task failed, after all other tasks ran.
+    """
+
+    global _tasks
+
+    tasks = [task for task in tasks if needs_rebuild(task, stamp_dir)]
+
+    if len(tasks) == 0:
+        logger.info('all generated content is current')
+        return 0
+
+    if (pool_size <= 1 or len(tasks) == 1 or
+            multiprocessing.current_process().daemon is True):
+        processes = 1
+        _tasks = tasks
+        try:
+            errors = _render_shard(range(len(tasks)))
+        finally:
+            _tasks = []
+    else:
+        processes = pool_size
+        num_shards = min(len(tasks), pool_size * 4)
+
+        _tasks = tasks
+        pool = multiprocessing.Pool(pool_size)
+        try:
+            errors = []
+            for shard_errors in pool.imap_unordered(_render_shard,
+                                                    shard_tasks(len(tasks), num_shards)):
+                errors.extend(shard_errors)
+        finally:
+            pool.close()
+            pool.join()
+            _tasks = []
+
+    for idx, error in errors:
+        m = 'generating content failed for "{0}": {1}'
+        logger.error(m.format(tasks[idx].description, error))
+
+    if stamp_dir is not None:
+        failed = set(idx for idx, _ in errors)
+        touch_stamps([task for idx, task in enumerate(tasks) if idx not in failed], stamp_dir)
+
+    if len(errors) > 0:
+        m = '{0} of {1} content generation tasks failed'
+        raise RuntimeError(m.format(len(errors), len(tasks)))
+
+    m = 'ran {0} content generation tasks in {1} processes'
+    logger.info(m.format(len(tasks), processes))
+
+    return len(tasks)
@@ -27,26 +27,58 @@ make it possible to:
 - have different versions of the source tree for different editions of the
   content (i.e. by redacting files or modifying the source,)
 
-At the center of this operation is an ``rsync`` operation that uses check-summing
-rather than timestampping to compare source and destination files.
+At the center of this operation is :func:`giza.tools.sync.sync_tree()`, which
+uses check-summing rather than timestampping to compare source and destination
+files, but keeps a manifest of file hashes between builds so that it only
+hashes files that have changed.
 """
 
 import os.path
 import logging
-import shutil
 import shlex
 import subprocess
 
 import libgiza.task
 
 from giza.tools.files import InvalidFile, safe_create_directory
+from giza.tools.sync import sync_tree
 
 logger = logging.getLogger('giza.content.source')
 
 # Transfer Source Files
 
 
-def transfer_source(conf, sconf):
+def source_exclusions(conf):
+    """
+    :returns: the list of patterns for files that are not copied to the
+       proxy-source directory, and are not deleted from it because content
+       generators create them there.
+    """
+
+    image_dir = os.path.join(conf.paths.images[len(conf.paths.source) + 1:])
+
+    exclusions = [os.path.join('includes', 'table'),
+                  os.path.join('includes', 'generated'),
+                  image_dir + os.path.sep + "*.png",
+                  image_dir + os.path.sep + "*.rst",
+                  image_dir + os.path.sep + "*.eps"]
+
+    prefix_len = len(os.path.join(conf.paths.projectroot, conf.paths.branch_source)) + 1
+    exclusions.extend([o for o in conf.system.content.output_directories(prefix_len)])
+
+    return exclusions
+
+
+def source_redactions(sconf):
+    """
+    :returns: the files and directories, relative to the source directory, that
+       the sphinx config for this build removes from the proxy-source directory.
+    """
+
+    return [fn.strip('/') for fn in sconf.excluded]
+
+
+def prepare_source_directory(conf):
     target = os.path.join(conf.paths.projectroot, conf.paths.branch_source)
 
     dir_exists = safe_create_directory(target)
@@ -60,57 +92,52 @@ def transfer_source(conf, sconf):
         logger.error(msg)
         raise InvalidFile(msg)
 
+    return target
+
+
+def canonical_source_directory(conf):
+    return os.path.join(conf.paths.projectroot, conf.paths.branch_output, 'source-canonical')
+
+
+def transfer_source_trees(conf, jobs):
+    """
+    Migrates the source directory to the proxy-source directories of all
+    ``jobs``, a list of ``(conf, sconf)`` pairs (e.g. from
+    :func:`giza.config.helper.get_restricted_builder_jobs()`), in one pass over
+    the source tree.
+    """
+
     source_dir = os.path.join(conf.paths.projectroot, conf.paths.source)
-    image_dir = os.path.join(conf.paths.images[len(conf.paths.source) + 1:])
 
-    exclusions = [os.path.join('includes', 'table'),
-                  os.path.join('includes', 'generated'),
-                  image_dir + os.path.sep + "*.png",
-                  image_dir + os.path.sep + "*.rst",
-                  image_dir + os.path.sep + "*.eps"]
+    targets = {}
+    exclusions = []
+    for build_conf, sconf in jobs:
+        target = prepare_source_directory(build_conf)
 
-    prefix_len = len(os.path.join(conf.paths.projectroot, conf.paths.branch_source)) + 1
-    exclusions.extend([o for o in conf.system.content.output_directories(prefix_len)])
+        # remove files from the source tree specified in the sphinx config for
+        # this build.
+        targets[target] = source_redactions(sconf)
+
+        for pattern in source_exclusions(build_conf):
+            if pattern not in exclusions:
+                exclusions.append(pattern)
+
+    # in "hardlink" mode, the proxy-source directories are hard links to a
+    # single copy of the source, and "reflink" mode makes copy-on-write clones
+    # where the filesystem supports them.
+    sync_tree(source_dir, targets, exclusions,
+              manifest_fn=conf.system.source_sync_cache,
+              pool_size=conf.runstate.pool_size,
+              mode=conf.runstate.source_copy_mode,
+              canonical=canonical_source_directory(conf))
+
+    for target in targets:
+        os.utime(target, None)
+        logger.info('prepared and migrated source for sphinx build in {0}'.format(target))
 
-    # we don't want rsync to delete directories that hold generated content in
-    # the target so we can have more incremental builds.
-    exclusions = "--exclude=" + ' --exclude='.join(exclusions)
-
-    cmd = 'rsync --links --checksum --recursive {2} --delete {0}/ {1}'
-    cmd = cmd.format(source_dir, target, exclusions)
-
-    try:
-        subprocess.check_call(shlex.split(cmd))
-    except subprocess.CalledProcessError as e:
-        logger.error('source transfer rsync had error: ' + str(e.returncode))
-        logger.info(cmd)
-
-    # remove files from the source tree specified in the sphinx config for this
-    # build.
-    source_exclusion(conf, sconf)
-    os.utime(target, None)
-
-    logger.info('prepared and migrated source for sphinx build in {0}'.format(target))
-
-
-def source_exclusion(conf, sconf):
-    ct = 0
-    if len(sconf.excluded) == 0:
-        return
-
-    for fn in sconf.excluded:
-        fqfn = os.path.join(conf.paths.projectroot, conf.paths.branch_source, fn[1:])
-        if os.path.isdir(fqfn):
-            shutil.rmtree(fqfn)
-            ct += 1
-        elif os.path.isfile(fqfn):
-            os.remove(fqfn)
-            ct += 1
-            logger.debug('redacted {0}'.format(fqfn))
-        else:
-            logger.warning('cannot redact non-existing file: ' + fqfn)
 
-    logger.info('redacted {0} files'.format(ct))
+def transfer_source(conf, sconf):
+    transfer_source_trees(conf, [(conf, sconf)])
 
 # Transfer Images
 
@@ -157,6 +184,16 @@ def latex_image_transfer_tasks(conf, sconf):
                               description=description)]
 
 
+def source_sync_tasks(conf, jobs):
+    targets = [build_conf.paths.branch_source for build_conf, _ in jobs]
+    description = 'migrating source to {0}'.format(', '.join(targets))
+
+    return [libgiza.task.Task(job=transfer_source_trees,
+                              args=(conf, jobs),
+                              target=targets,
+                              description=description)]
+
+
 def source_tasks(conf, sconf):
     description = 'migrating source to {0}'.format(conf.paths.branch_source)
 
@@ -14,16 +14,17 @@
 
 """
 Responsible for converting the Sphinx configuration stored by projects and used
-by giza, into a ``sphinx-build`` invocation. See
+by giza, into a ``sphinx-build`` invocation or, with the ``inprocess`` driver,
+a :class:`sphinx.application.Sphinx` application in the worker process. See
 :func:`giza.content.sphinx.run_sphinx` for the core of this operation.
 
 :mod:`giza.content.sphinx` also contains:
 
 - the error message processing, which normalizes references to paths,
   deduplicates log messages given multiple builds or multi-process Sphinx
-  operation, and removes non-actionable messages. See
-  :func:`giza.content.sphinx.output_sphinx_stream()`,
-  :func:`giza.content.sphinx.is_msg_worth()` and
+  operation, and removes non-actionable messages as ``sphinx-build`` produces
+  them. See :class:`giza.content.sphinx.SphinxOutputFilter()`,
+  :func:`giza.content.sphinx.compile_output_filter()` and
   :func:`giza.content.sphinx.path_normalization()`.
 
 - the orchestration of all post-processing. See
@@ -32,15 +33,21 @@ by giza, into a ``sphinx-build`` invocation. See
 
 import collections
 import logging
+import multiprocessing
 import os.path
 import pkg_resources
 import re
-import sys
 import numbers
+import sqlite3
 import subprocess
 import shlex
+import threading
+import time
 
 from libgiza.task import Task
+from giza.config.sphinx_config import resolve_builder_path
+from giza.content.sphinx_budget import SphinxBudget, load_build_timings
+from giza.content.sphinx_warnings import record_build_warnings
 from giza.tools.files import safe_create_directory, expand_tree
 from giza.tools.timing import Timer
 
@@ -53,7 +60,7 @@ def is_parallel_sphinx(version):
     return version >= '1.2'
 
 
-def get_tags(target, sconf):
+def get_tag_list(target, sconf):
     if 'tags' in sconf:
         ret = set(sconf.tags)
     else:
@@ -70,46 +77,90 @@ def get_tags(target, sconf):
     if 'edition' in sconf:
         ret.add(sconf.edition)
 
+    return [i for i in ret if i is not None]
+
+
+def get_tags(target, sconf):
     return ' '.join([' '.join(['-t', i])
-                     for i in ret
-                     if i is not None])
+                     for i in get_tag_list(target, sconf)])
+
+
+def get_sphinx_jobs(sconf, conf):
+    """
+    :returns: the number of parallel processes for a sphinx build, given the
+       ``serial_sphinx`` option and the number of builders. ``1`` means serial.
+    """
+
+    if not is_parallel_sphinx(pkg_resources.get_distribution("sphinx").version):
+        return 1
+
+    if 'serial_sphinx' in conf.runstate:
+        m = 'running with serial sphinx processes ({0}.{1}.{2}.{3})'
+        logger.info(m.format(sconf.builder, conf.project.name,
+                             conf.project.edition, conf.git.branches.current))
+        if conf.runstate.serial_sphinx == "publish":
+            if ((len(conf.runstate.builder) >= 1 or 'publish' in conf.runstate.builder) or
+                    len(conf.runstate.languages_to_build) >= 1 or
+                    len(conf.runstate.editions_to_build) >= 1):
+                return 1
+            else:
+                return conf.runstate.pool_size
+        elif conf.runstate.serial_sphinx is False:
+            logger.info('running with parallelized sphinx processes')
+            return conf.runstate.pool_size
+        elif (isinstance(conf.runstate.serial_sphinx, numbers.Number) and
+              conf.runstate.serial_sphinx > 1):
+            logger.info('running with parallelized sphinx processes')
+            return conf.runstate.serial_sphinx
+        else:
+            return 1
+    elif len(conf.runstate.builder) >= conf.runstate.pool_size:
+        logger.info('running with serail sphinx processes')
+        return 1
+    else:
+        logger.info('running with parallelized sphinx processes')
+        return conf.runstate.pool_size
 
 
-def get_sphinx_args(sconf, conf):
+def get_sphinx_budget(conf, manager=None):
+    """
+    :returns: a :class:`~giza.content.sphinx_budget.SphinxBudget` that divides
+       ``pool_size`` cores between all builders, or ``None`` when the build
+       should use :func:`get_sphinx_jobs()`, because the ``serial_sphinx``
+       option is set or sphinx does not support ``-j``.
+    """
+
+    if 'serial_sphinx' in conf.runstate:
+        return None
+    elif not is_parallel_sphinx(pkg_resources.get_distribution("sphinx").version):
+        return None
+
+    timings = load_build_timings(conf.paths.sphinx_build_timings)
+
+    if manager is None:
+        return SphinxBudget(conf.runstate.pool_size, timings)
+    else:
+        return SphinxBudget(conf.runstate.pool_size, timings, manager.dict(), manager.Lock())
+
+
+def get_sphinx_args(sconf, conf, jobs=None):
     o = []
 
     o.append(get_tags(sconf.builder, sconf))
     o.append('-q')
 
+    if conf.runstate.warnings_diff is True:
+        # sphinx only reports warnings for the documents it reads: read them
+        # all, so that the recorded warnings are complete.
+        o.append('-E')
+
     o.append('-b {0}'.format(sconf.builder))
 
-    if is_parallel_sphinx(pkg_resources.get_distribution("sphinx").version):
-        if 'serial_sphinx' in conf.runstate:
-            m = 'running with serial sphinx processes ({0}.{1}.{2}.{3})'
-            logger.info(m.format(sconf.builder, conf.project.name,
-                                 conf.project.edition, conf.git.branches.current))
-            if conf.runstate.serial_sphinx == "publish":
-                if ((len(conf.runstate.builder) >= 1 or 'publish' in conf.runstate.builder) or
-                        len(conf.runstate.languages_to_build) >= 1 or
-                        len(conf.runstate.editions_to_build) >= 1):
-                    pass
-                else:
-                    o.append(' '.join(['-j', str(conf.runstate.pool_size)]))
-            elif conf.runstate.serial_sphinx is False:
-                logger.info('running with parallelized sphinx processes')
-                o.append(' '.join(['-j', str(conf.runstate.pool_size)]))
-            elif (isinstance(conf.runstate.serial_sphinx, numbers.Number) and
-                  conf.runstate.serial_sphinx > 1):
-                logger.info('running with parallelized sphinx processes')
-                o.append(' '.join(['-j', str(conf.runstate.serial_sphinx)]))
-            else:
-                pass
-        elif len(conf.runstate.builder) >= conf.runstate.pool_size:
-            logger.info('running with serail sphinx processes')
-            pass
-        else:
-            logger.info('running with parallelized sphinx processes')
-            o.append(' '.join(['-j', str(conf.runstate.pool_size)]))
+    if jobs is None:
+        jobs = get_sphinx_jobs(sconf, conf)
+
+    if jobs > 1:
+        o.append(' '.join(['-j', str(jobs)]))
 
     o.append(' '.join(['-c', conf.paths.projectroot]))
 
@@ -118,65 +169,280 @@ def get_sphinx_args(sconf, conf):
 
     return ' '.join(o)
 
+
+def get_doctree_group(sconf):
+    """
+    :returns: the name for the class of builders (i.e. ``website`` or
+       ``print``, see :func:`get_tags()`) with the same tags as ``sconf``, which
+       can share a single doctree environment.
+    """
+
+    if sconf.builder.startswith('html') or sconf.builder.startswith('dirhtml'):
+        group = ['website']
+    else:
+        group = ['print']
+
+    if 'tags' in sconf and sconf.tags:
+        group.extend(sorted(sconf.tags))
+
+    return '-'.join(group)
+
+
+def get_doctree_name(sconf, conf):
+    """
+    :returns: the name of the doctree directory in ``build/<branch>`` for a
+       builder. When ``runstate.shared_doctrees`` is set, builders of the same
+       edition, language and doctree group share a directory.
+    """
+
+    if conf.runstate.shared_doctrees is True:
+        name = resolve_builder_path(get_doctree_group(sconf), sconf.edition, sconf.language, conf)
+    else:
+        name = sconf.build_output
+
+    return '-'.join(('doctrees', name))
+
 # Output Management
 
 
-def output_sphinx_stream(out, conf):
-    full_path = os.path.join(conf.paths.projectroot, conf.paths.branch_output)
+#: Messages from ``sphinx-build`` that are not actionable, and that giza does not
+#: print. Projects can extend these lists with a ``sphinx_output`` config file
+#: with the same keys.
+default_output_filters = {
+    'prefix': ['WARNING: unknown mimetype',
+               'WARNING: search index',
+               'source/includes/generated/overview.rst',
+               'source/meta/includes.txt'],
+    'suffix': ['source/reference/sharding-commands.txt',
+               'Duplicate ID: "cmdoption-h".',
+               '"/opt args" or "+opt args"',
+               '"--opt args" or "/opt args"'],
+    'contains': ['nonlocal image URI found'],
+    'regex': [],
+}
+
+
+def get_output_filters(conf):
+    filters = dict((k, list(v)) for k, v in default_output_filters.items())
+
+    if 'sphinx_output' in conf.system.files.data:
+        project_filters = conf.system.files.data.sphinx_output
+        if not isinstance(project_filters, list):
+            project_filters = [project_filters]
+
+        for doc in project_filters:
+            for key in filters:
+                if key in doc:
+                    filters[key].extend(doc[key])
+
+    return filters
+
+
+def compile_output_filter(filters):
+    """
+    Compiles a dictionary of ``prefix``, ``suffix``, ``contains`` and ``regex``
+    lists into a single regular expression that matches any message that should
+    not be printed.
+    """
+
+    patterns = [r'^$']
+
+    if filters['prefix']:
+        patterns.append('^(?:{0})'.format('|'.join(re.escape(p) for p in filters['prefix'])))
+    if filters['suffix']:
+        patterns.append('(?:{0})$'.format('|'.join(re.escape(p) for p in filters['suffix'])))
+    if filters['contains']:
+        patterns.append('(?:{0})'.format('|'.join(re.escape(p) for p in filters['contains'])))
+
+    patterns.extend('(?:{0})'.format(p) for p in filters['regex'])
+
+    return re.compile('|'.join(patterns))
+
+
+class SeenMessages(object):
+    """
+    The set of messages that :class:`SphinxOutputFilter` objects have printed,
+    shared by all filters that should deduplicate against each other (e.g. the
+    output of all builders in a build). With a
+    :class:`multiprocessing.Manager`, the set and its lock live in the manager
+    process, so that filters in different processes share them.
+    """
+
+    def __init__(self, manager=None):
+        if manager is None:
+            self.seen = {}
+            self.lock = threading.Lock()
+        else:
+            self.seen = manager.dict()
+            self.lock = manager.Lock()
 
-    regx = r'(.*):[0-9]+: WARNING: duplicate object description of ".*", other instance in (.*)'
-    regx = re.compile(regx)
+    def add(self, ln):
+        """:returns: ``True`` if ``ln`` was not seen before, and records it."""
 
-    printable = []
-    for idx, l in enumerate(out):
-        if is_msg_worthy(l) is False:
-            printable.append(None)
-            continue
+        with self.lock:
+            if ln in self.seen:
+                return False
+
+            self.seen[ln] = True
+            return True
+
+
+class SphinxOutputFilter(object):
+    """
+    Normalizes, filters and deduplicates ``sphinx-build`` output one line at a
+    time, so that messages can be printed as the build produces them.
 
-        f1 = regx.match(l)
+    ``seen`` is a :class:`SeenMessages` object shared by all filters that
+    should deduplicate against each other.
+
+    With ``--warnings-diff``, messages are recorded but not printed: the build
+    prints only the new and resolved warnings when it is complete.
+    """
+
+    duplicate_object = re.compile(r'(.*):[0-9]+: WARNING: duplicate object description '
+                                  r'of ".*", other instance in (.*)')
+
+    def __init__(self, conf, seen=None):
+        self.conf = conf
+        self.full_path = os.path.join(conf.paths.projectroot, conf.paths.branch_output)
+        self.ignore = compile_output_filter(get_output_filters(conf))
+
+        if seen is None:
+            seen = SeenMessages()
+        self.seen = seen
+
+        self.quiet = conf.runstate.warnings_diff is True
+        self.pending = None
+        self.count = 0
+        self.printed = 0
+
+        # every message this filter has processed, whether or not another
+        # filter had already printed it.
+        self.messages = []
+        self._messages = set()
+
+    def normalize(self, ln):
+        f1 = self.duplicate_object.match(ln)
         if f1 is not None:
             g = f1.groups()
 
             if g[1].endswith(g[0]):
-                printable.append(None)
-                continue
+                return None
+
+        ln = path_normalization(ln, self.full_path, self.conf)
 
-        l = path_normalization(l, full_path, conf)
+        if self.ignore.search(ln) is not None:
+            return None
+        else:
+            return ln
+
+    def feed(self, ln):
+        """
+        :returns: a list of messages, not previously seen by any filter that
+           shares ``seen``, that are ready to print.
+        """
+
+        if not isinstance(ln, str):
+            ln = ln.decode('utf-8', 'replace')
 
-        if l.startswith('InputError: [Errno 2] No such file or directory'):
+        self.count += 1
+        ln = self.normalize(ln.rstrip())
+
+        if ln is None:
+            return []
+        elif ln.startswith('InputError: [Errno 2] No such file or directory'):
+            # these errors refer to the message on the previous line.
             try:
-                l = path_normalization(l.split(' ')[-1].strip()[1:-2], full_path, conf)
-                printable[idx - 1] += ' ' + l
-                l = None
+                ln = path_normalization(ln.split(' ')[-1].strip()[1:-2], self.full_path, self.conf)
+                if self.pending is not None:
+                    self.pending += ' ' + ln
             except IndexError:
-                logger.error("error processing log: {0}".format(l))
-                continue
-        elif l.startswith('source/includes/generated/overview.rst'):
-            continue
-        elif l.startswith('source/meta/includes.txt'):
-            continue
+                logger.error("error processing log: {0}".format(ln))
 
-        printable.append(l)
+            return []
+        else:
+            ready = self.flush()
+            self.pending = ln
+            return ready
 
-    printable = stable_deduplicate(printable)
+    def flush(self):
+        ln, self.pending = self.pending, None
 
-    m = 'sphinx builder has {0} lines of output, processed from {1}'
-    logger.info(m.format(len(printable), len(out)))
-    print_build_messages(printable)
+        if ln is None:
+            return []
 
+        if ln not in self._messages:
+            self._messages.add(ln)
+            self.messages.append(ln)
 
-def stable_deduplicate(lines):
-    # this should probably just use OrderedSet() in the future
+        if self.seen.add(ln) is True:
+            return [ln]
+        else:
+            return []
 
-    mapping = collections.OrderedDict()
+    def write(self, ln):
+        """Processes one line of output and prints any messages that are ready."""
 
-    for idx, ln in enumerate(lines):
-        mapping[ln] = idx
+        self._print(self.feed(ln))
 
-    if sys.version_info >= (3, 0):
-        return [ln for _, ln in mapping.keys()]
-    else:
-        return mapping.keys()
+    def close(self):
+        self._print(self.flush())
+
+    def _print(self, messages):
+        if self.quiet is True:
+            return
+
+        for msg in messages:
+            print(msg)
+            self.printed += 1
+
+
+class SphinxWarningStream(object):
+    """
+    A file-like object for the ``warning`` stream of an in-process
+    :class:`sphinx.application.Sphinx` application, that passes complete
+    lines to ``output``, a :class:`SphinxOutputFilter`.
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.buffer = ''
+
+    def write(self, text):
+        if not isinstance(text, str):
+            text = text.decode('utf-8', 'replace')
+
+        lines = (self.buffer + text).split('\n')
+        self.buffer = lines.pop()
+
+        for ln in lines:
+            self.output.write(ln)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        if self.buffer:
+            self.output.write(self.buffer)
+            self.buffer = ''
+
+
+def output_sphinx_stream(out, conf, seen=None):
+    output = SphinxOutputFilter(conf, seen)
+
+    printable = []
+    for ln in out:
+        printable.extend(output.feed(ln))
+    printable.extend(output.flush())
+
+    m = 'sphinx builder has {0} lines of output, processed from {1}'
+    logger.info(m.format(len(printable), output.count))
+
+    if output.quiet is False:
+        print_build_messages(printable)
 
 
 def print_build_messages(messages):
@@ -200,35 +466,44 @@ def path_normalization(l, full_path, conf):
     return l
 
 
-def is_msg_worthy(l):
-    if l.startswith('WARNING: unknown mimetype'):
-        return False
-    elif len(l) == 0:
-        return False
-    elif l.startswith('WARNING: search index'):
-        return False
-    elif l.endswith('source/reference/sharding-commands.txt'):
-        return False
-    elif l.endswith('Duplicate ID: "cmdoption-h".'):
-        return False
-    elif l.endswith('"/opt args" or "+opt args"'):
-        return False
-    elif l.endswith('"--opt args" or "/opt args"'):
-        return False
-    elif 'nonlocal image URI found' in l:
-        return False
-    else:
-        return True
+# Builder Operation
 
 
-# Builder Operation
+SphinxBuildResult = collections.namedtuple('SphinxBuildResult',
+                                           ['return_code', 'messages', 'build_id'])
 
 
-def run_sphinx(builder, sconf, conf):
-    if safe_create_directory(sconf.fq_build_output):
-        m = 'created directory "{1}" for sphinx builder {0}'
-        logger.info(m.format(builder, sconf.fq_build_output))
+def compile_translations(sconf, conf):
+    """
+    Compiles the ``.po`` files for ``sconf.language`` into ``.mo`` files, when
+    the ``.mo`` file is missing or older than its source. Replaces ``sphinx-intl
+    build`` for the in-process driver.
+    """
+
+    import polib
+
+    locale_dir = os.path.join(conf.paths.projectroot, conf.paths.locale,
+                              sconf.language, 'LC_MESSAGES')
+    count = 0
 
+    for root, _, files in os.walk(locale_dir):
+        for fn in files:
+            if not fn.endswith('.po'):
+                continue
+
+            po_fn = os.path.join(root, fn)
+            mo_fn = po_fn[:-3] + '.mo'
+
+            if os.path.isfile(mo_fn) and os.stat(mo_fn).st_mtime >= os.stat(po_fn).st_mtime:
+                continue
+
+            polib.pofile(po_fn).save_as_mofile(mo_fn)
+            count += 1
+
+    logger.info('compiled {0} PO files for translated build.'.format(count))
+
+
+def run_sphinx_subprocess(builder, sconf, conf, output, jobs):
     if 'language' in sconf and sconf.language is not None:
         cmd_str = 'sphinx-intl build --language=' + sconf.language
         try:
@@ -238,27 +513,116 @@ def run_sphinx(builder, sconf, conf):
             logger.error('sphinx-intl encountered error: ' + str(e.returncode))
             logger.info(cmd_str)
 
-    logger.info('starting sphinx build {0}'.format(builder))
-
-    cmd = 'sphinx-build {0} -d {1}/doctrees-{2} {3} {4}'  # per-builder-doctree
+    cmd = 'sphinx-build {0} -d {1}/{2} {3} {4}'
 
-    sphinx_cmd = cmd.format(get_sphinx_args(sconf, conf),
+    sphinx_cmd = cmd.format(get_sphinx_args(sconf, conf, jobs),
                             os.path.join(conf.paths.projectroot, conf.paths.branch_output),
-                            sconf.build_output,
+                            get_doctree_name(sconf, conf),
                             os.path.join(conf.paths.projectroot, conf.paths.branch_source),
                             sconf.fq_build_output)
 
     logger.debug(sphinx_cmd)
+
+    # stream the output, printing messages as soon as sphinx reports them
+    # rather than holding the entire log in memory.
+    proc = subprocess.Popen(shlex.split(sphinx_cmd),
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    for ln in iter(proc.stdout.readline, b''):
+        output.write(ln)
+
+    proc.stdout.close()
+    return_code = proc.wait()
+    output.close()
+
+    if return_code != 0:
+        logger.info(sphinx_cmd)
+
+    return return_code
+
+
+def run_sphinx_inprocess(builder, sconf, conf, output, jobs):
+    """
+    Runs a sphinx build in the current process. Python caches the modules that
+    ``conf.py`` and the sphinx extensions import, so a worker process only pays
+    the import cost for its first build.
+    """
+
+    from sphinx.application import Sphinx
+
+    if 'language' in sconf and sconf.language is not None:
+        compile_translations(sconf, conf)
+        overrides = {'language': sconf.language}
+    else:
+        overrides = {}
+
+    warnings = SphinxWarningStream(output)
+
+    try:
+        app = Sphinx(srcdir=os.path.join(conf.paths.projectroot, conf.paths.branch_source),
+                     confdir=conf.paths.projectroot,
+                     outdir=sconf.fq_build_output,
+                     doctreedir=os.path.join(conf.paths.projectroot, conf.paths.branch_output,
+                                             get_doctree_name(sconf, conf)),
+                     buildername=builder,
+                     confoverrides=overrides,
+                     status=None,
+                     warning=warnings,
+                     freshenv=conf.runstate.warnings_diff is True,
+                     warningiserror=False,
+                     tags=get_tag_list(builder, sconf),
+                     parallel=jobs if jobs > 1 else 0)
+        app.build()
+        return_code = app.statuscode
+    except Exception as e:
+        logger.error('sphinx build {0} encountered error: {1}'.format(builder, e))
+        return_code = 1
+    finally:
+        warnings.close()
+        output.close()
+
+    return return_code
+
+
+def run_sphinx(builder, sconf, conf, seen=None, budget=None):
+    if safe_create_directory(sconf.fq_build_output):
+        m = 'created directory "{1}" for sphinx builder {0}'
+        logger.info(m.format(builder, sconf.fq_build_output))
+
+    if conf.runstate.sphinx_driver == 'inprocess' and conf.runstate.runner == 'process':
+        driver = run_sphinx_inprocess
+    else:
+        # sphinx changes global state (e.g. the docutils roles and the working
+        # directory), so it is only safe to run in-process in its own process.
+        driver = run_sphinx_subprocess
+
+    if driver is run_sphinx_inprocess and multiprocessing.current_process().daemon is True:
+        # daemonic pool workers cannot start sphinx's own worker processes, so
+        # the build runs serially: don't hold cores that it can't use.
+        limit = 1
+    else:
+        limit = None
+
+    logger.info('starting sphinx build {0}'.format(builder))
     m = "running sphinx build for: {0}, {1}, {2}"
 
-    with Timer(m.format(builder, sconf.language, sconf.edition)):
-        try:
-            output = subprocess.check_output(shlex.split(sphinx_cmd), stderr=subprocess.STDOUT)
-            return_code = 0
-        except subprocess.CalledProcessError as e:
-            output = e.output
-            return_code = e.returncode
-            logger.info(sphinx_cmd)
+    output = SphinxOutputFilter(conf, seen)
+
+    if budget is None:
+        jobs = get_sphinx_jobs(sconf, conf)
+        if limit is not None:
+            jobs = min(jobs, limit)
+    else:
+        jobs = budget.acquire(sconf.build_output, limit)
+
+    start = time.time()
+    try:
+        with Timer(m.format(builder, sconf.language, sconf.edition)):
+            return_code = driver(builder, sconf, conf, output, jobs)
+    finally:
+        if budget is not None:
+            budget.release(sconf.build_output, time.time() - start)
+
     try:
         os.utime(sconf.fq_build_output, None)
     except:
@@ -269,12 +633,21 @@ def run_sphinx(builder, sconf, conf):
     logger.info(m.format(builder, conf.project.name, conf.project.edition,
                          conf.git.branches.current, return_code))
 
-    return return_code, output
+    m = 'sphinx builder {0} printed {1} of {2} messages, processed from {3} lines of output'
+    logger.info(m.format(builder, output.printed, len(output.messages), output.count))
+
+    try:
+        build_id = record_build_warnings(builder, sconf, conf, return_code, output.messages)
+    except sqlite3.Error as e:
+        logger.warning('could not record warnings for {0} build: {1}'.format(builder, e))
+        build_id = None
+
+    return SphinxBuildResult(return_code, output.messages, build_id)
 
 # Application Logic
 
 
-def sphinx_tasks(sconf, conf):
+def sphinx_tasks(sconf, conf, seen=None, budget=None):
     # Projects that use the append functionality in extracts or similar content
     # generators will rebuild this task every time.
 
@@ -283,9 +656,45 @@ def sphinx_tasks(sconf, conf):
     deps.extend(expand_tree(os.path.join(conf.paths.projectroot, conf.paths.branch_source), 'txt'))
 
     return Task(job=run_sphinx,
-                args=(sconf.builder, sconf, conf),
+                args=(sconf.builder, sconf, conf, seen, budget),
                 target=os.path.join(conf.paths.projectroot,
                                     conf.paths.branch_output,
                                     sconf.builder),
                 dependency=deps,
                 description='building {0} with sphinx'.format(sconf.builder))
+
+
+def run_sphinx_group(jobs, seen=None, budget=None):
+    """
+    Runs the builders in ``jobs``, a list of ``(builder, sconf, conf)`` tuples,
+    one after the other, so that they can share a doctree directory: the first
+    builder reads the source, and the others reuse the pickled environment.
+    """
+
+    return [run_sphinx(builder, sconf, conf, seen, budget) for builder, sconf, conf in jobs]
+
+
+def sphinx_group_tasks(jobs, seen=None, budget=None):
+    """
+    :param list jobs: a list of ``(sconf, conf)`` pairs for builders that share
+       a doctree directory.
+
+    :returns: a task that runs all builders in ``jobs`` in sequence.
+    """
+
+    tasks = [sphinx_tasks(sconf, conf, seen, budget) for sconf, conf in jobs]
+
+    if len(tasks) == 1:
+        return tasks[0]
+
+    dependency = set()
+    for task in tasks:
+        dependency.update(task.dependency)
+
+    builders = ', '.join([sconf.builder for sconf, _ in jobs])
+
+    return Task(job=run_sphinx_group,
+                args=([(sconf.builder, sconf, conf) for sconf, conf in jobs], seen, budget),
+                target=[task.target for task in tasks],
+                dependency=list(dependency),
+                description='building {0} with sphinx, sharing doctrees'.format(builders))
@@ -0,0 +1,145 @@
+# Copyright 2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Divides a fixed number of cores between the ``sphinx-build`` processes that
+run at the same time, so that several builders running in parallel, each with
+``-j``, do not oversubscribe the machine.
+
+Each builder takes its share of the free cores when it starts, in proportion to
+how long it took in previous builds compared to the other builders that haven't
+started yet. Cores return to the budget when a builder finishes, so builders
+that start later get larger shares.
+"""
+
+import json
+import logging
+import os
+import threading
+
+from giza.tools.files import safe_create_directory
+
+logger = logging.getLogger('giza.content.sphinx_budget')
+
+#: The weight of the most recent build time in the stored estimate.
+TIMING_SMOOTHING = 0.5
+
+
+def load_build_timings(fn):
+    """:returns: a dictionary of builder names to the estimated build time in seconds."""
+
+    if not os.path.isfile(fn):
+        return {}
+
+    try:
+        with open(fn, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        logger.warning('could not read sphinx build timings from ' + fn)
+        return {}
+
+
+def dump_build_timings(fn, timings, durations):
+    """
+    Merges ``durations``, the build times from the current run, into
+    ``timings`` and writes the result to ``fn``.
+    """
+
+    for name, duration in durations.items():
+        if name in timings:
+            timings[name] = (TIMING_SMOOTHING * duration +
+                             (1 - TIMING_SMOOTHING) * timings[name])
+        else:
+            timings[name] = duration
+
+    safe_create_directory(os.path.dirname(fn))
+
+    tmp_fn = fn + '.tmp'
+    with open(tmp_fn, 'w') as f:
+        json.dump(timings, f, indent=2, sort_keys=True)
+    os.rename(tmp_fn, fn)
+
+    return timings
+
+
+class SphinxBudget(object):
+    """
+    Tracks the builders in a build and hands out ``-j`` values from a budget
+    of ``cores``.
+
+    ``state`` and ``lock`` must be shared by every process that runs a builder:
+    use a :class:`multiprocessing.Manager` dictionary and lock with the process
+    runner. ``state`` maps builder names to ``(status, share, duration)``
+    tuples.
+    """
+
+    def __init__(self, cores, timings, state=None, lock=None):
+        self.cores = max(cores, 1)
+        self.timings = timings
+
+        if state is None:
+            state = {}
+        if lock is None:
+            lock = threading.Lock()
+
+        self.state = state
+        self.lock = lock
+
+        if len(self.timings) == 0:
+            self.default_weight = 1.0
+        else:
+            self.default_weight = sum(self.timings.values()) / len(self.timings)
+
+    def weight(self, name):
+        return self.timings.get(name, self.default_weight) or self.default_weight
+
+    def add(self, name):
+        self.state[name] = ('pending', 0, None)
+
+    def acquire(self, name, limit=None):
+        """
+        :returns: the number of processes for the builder ``name``, which is at
+           most ``limit`` for builders that cannot use more processes.
+        """
+
+        with self.lock:
+            state = dict(self.state)
+
+            running = sum(share for status, share, _ in state.values() if status == 'running')
+            free = max(self.cores - running, 1)
+
+            pending = set(n for n, (status, _, _) in state.items() if status == 'pending')
+            pending.add(name)
+
+            total = sum(self.weight(n) for n in pending)
+            share = int(round(free * self.weight(name) / total))
+            share = max(1, min(free, share))
+            if limit is not None:
+                share = max(1, min(limit, share))
+
+            self.state[name] = ('running', share, None)
+
+        m = 'assigned {0} of {1} free cores to sphinx builder {2} ({3} builders waiting)'
+        logger.info(m.format(share, free, name, len(pending) - 1))
+
+        return share
+
+    def release(self, name, duration):
+        with self.lock:
+            self.state[name] = ('done', 0, duration)
+
+    def durations(self):
+        return dict((name, duration)
+                    for name, (status, _, duration) in dict(self.state).items()
+                    if status == 'done' and duration is not None)
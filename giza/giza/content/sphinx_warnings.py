@@ -0,0 +1,202 @@
+# Copyright 2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Stores the normalized warnings from every ``sphinx-build`` run in a SQLite
+database, keyed by branch, builder, edition, language and commit, so that
+``giza sphinx --warnings-diff`` can report only the warnings that are new or
+resolved since the previous build of the same builder.
+
+Sphinx only reports the warnings of the documents that it reads, so builds in
+``--warnings-diff`` mode read every document (see
+:func:`giza.content.sphinx.get_sphinx_args()`), and each build records the
+complete set of warnings.
+"""
+
+import logging
+import os
+import sqlite3
+import time
+
+from giza.tools.files import safe_create_directory
+
+logger = logging.getLogger('giza.content.sphinx_warnings')
+
+
+class WarningStore(object):
+    """Database of the warnings reported by each sphinx build."""
+
+    def __init__(self, db_path, builds_to_keep=10):
+        safe_create_directory(os.path.dirname(db_path))
+
+        # builders running in parallel processes may write at the same time.
+        self.conn = sqlite3.connect(db_path, timeout=60)
+        self.builds_to_keep = builds_to_keep
+        self.__init()
+
+    def __init(self):
+        cur = self.conn.cursor()
+        cur.execute('''CREATE TABLE IF NOT EXISTS builds(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            branch text NOT NULL,
+            builder text NOT NULL,
+            edition text NOT NULL,
+            language text NOT NULL,
+            git_commit text NOT NULL,
+            time int NOT NULL,
+            return_code int NOT NULL)''')
+        cur.execute('''CREATE INDEX IF NOT EXISTS build_key
+            ON builds(branch, builder, edition, language)''')
+        cur.execute('''CREATE TABLE IF NOT EXISTS warnings(
+            build int NOT NULL,
+            message text NOT NULL,
+            PRIMARY KEY(build, message))''')
+        self.conn.commit()
+
+    @staticmethod
+    def _key(branch, builder, edition, language):
+        # NULL never compares equal in SQL, so store missing values as ''.
+        return (branch, builder, edition or '', language or '')
+
+    def record(self, branch, builder, edition, language, commit, return_code, messages):
+        """Stores the ``messages`` of a build, and returns the id of the build."""
+        cur = self.conn.cursor()
+        key = self._key(branch, builder, edition, language)
+
+        cur.execute('''INSERT INTO builds(branch, builder, edition, language,
+                                          git_commit, time, return_code)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                    key + (commit, int(time.time()), return_code))
+        build_id = cur.lastrowid
+
+        cur.executemany('INSERT OR IGNORE INTO warnings VALUES (?, ?)',
+                        ((build_id, msg) for msg in messages))
+
+        self._prune(cur, key)
+        self.conn.commit()
+
+        return build_id
+
+    def _prune(self, cur, key):
+        cur.execute('''SELECT id FROM builds
+                       WHERE branch=? AND builder=? AND edition=? AND language=?
+                       ORDER BY id DESC LIMIT -1 OFFSET ?''',
+                    key + (self.builds_to_keep,))
+        old_builds = [(row[0],) for row in cur.fetchall()]
+
+        cur.executemany('DELETE FROM warnings WHERE build=?', old_builds)
+        cur.executemany('DELETE FROM builds WHERE id=?', old_builds)
+
+    def build(self, build_id):
+        cur = self.conn.cursor()
+        cur.execute('''SELECT branch, builder, edition, language, git_commit
+                       FROM builds WHERE id=?''', (build_id,))
+
+        return cur.fetchone()
+
+    def previous(self, build_id):
+        """Returns the id of the build of the same builder before ``build_id``."""
+        cur = self.conn.cursor()
+        cur.execute('''SELECT previous.id FROM builds AS current, builds AS previous
+                       WHERE current.id=?
+                         AND previous.branch=current.branch
+                         AND previous.builder=current.builder
+                         AND previous.edition=current.edition
+                         AND previous.language=current.language
+                         AND previous.id < current.id
+                       ORDER BY previous.id DESC LIMIT 1''', (build_id,))
+        row = cur.fetchone()
+
+        if row is None:
+            return None
+        else:
+            return row[0]
+
+    def diff(self, build_id):
+        """
+        :returns: a tuple of two sorted lists: the warnings in ``build_id``
+           that were not in the previous build, and the warnings of the previous
+           build that ``build_id`` no longer reports, or ``None`` when there's
+           no previous build to compare with.
+        """
+
+        previous_id = self.previous(build_id)
+        if previous_id is None:
+            return None
+
+        cur = self.conn.cursor()
+
+        query = '''SELECT message FROM warnings WHERE build=?
+                     EXCEPT
+                   SELECT message FROM warnings WHERE build=?
+                   ORDER BY message'''
+
+        cur.execute(query, (build_id, previous_id))
+        new = [row[0] for row in cur.fetchall()]
+
+        cur.execute(query, (previous_id, build_id))
+        resolved = [row[0] for row in cur.fetchall()]
+
+        return new, resolved
+
+    def close(self):
+        self.conn.close()
+
+
+def record_build_warnings(builder, sconf, conf, return_code, messages):
+    store = WarningStore(conf.paths.sphinx_warnings_database)
+    try:
+        return store.record(conf.git.branches.current, builder, sconf.edition, sconf.language,
+                            conf.git.commit, return_code, messages)
+    finally:
+        store.close()
+
+
+def print_warnings_diff(build_ids, conf):
+    """
+    Prints the new and resolved warnings for every build in ``build_ids``.
+
+    :returns: the number of new warnings.
+    """
+
+    store = WarningStore(conf.paths.sphinx_warnings_database)
+    total = 0
+
+    try:
+        for build_id in build_ids:
+            branch, builder, edition, language, commit = store.build(build_id)
+            name = '.'.join(i for i in (builder, edition, language) if i)
+
+            diff = store.diff(build_id)
+            if diff is None:
+                # without a baseline (e.g. a fresh checkout) there is nothing
+                # to compare with, and no warning counts as new.
+                m = '{0} ({1}, {2}): no previous build to compare warnings with'
+                logger.info(m.format(name, branch, commit[:10]))
+                continue
+
+            new, resolved = diff
+            total += len(new)
+
+            m = '{0} ({1}, {2}): {3} new warnings, {4} resolved warnings'
+            logger.info(m.format(name, branch, commit[:10], len(new), len(resolved)))
+
+            for msg in new:
+                print('+ ' + msg)
+            for msg in resolved:
+                print('- ' + msg)
+    finally:
+        store.close()
+
+    return total
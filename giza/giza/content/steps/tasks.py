@@ -20,6 +20,7 @@ from libgiza.task import Task
 from giza.content.steps.inheritance import StepDataCache
 from giza.content.steps.views import render_steps
 from giza.config.content import new_content_type
+from giza.content.helper import write_content
 
 logger = logging.getLogger('giza.content.steps.tasks')
 
@@ -34,8 +35,8 @@ def register_steps(conf):
 
 def write_steps(steps, fn, conf):
     content = render_steps(steps, conf)
-    content.write(fn)
-    logger.info('wrote steps to: ' + fn)
+    if write_content(content, fn):
+        logger.info('wrote steps to: ' + fn)
 
 
 def step_tasks(conf):
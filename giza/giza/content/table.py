@@ -27,6 +27,7 @@ import libgiza.task
 
 from rstcloth.table import TableBuilder, YamlTable, ListTable
 from giza.tools.files import expand_tree, verbose_remove, safe_create_directory
+from giza.content.helper import write_content
 
 logger = logging.getLogger('giza.content.table')
 
@@ -59,11 +60,11 @@ def _generate_tables(source, target, list_target):
     #     build_all = True
 
     list_table = TableBuilder(ListTable(table_data))
-    list_table.write(list_target)
-    logger.debug('rebuilt rendered table {0}'.format(list_target))
+    if write_content(list_table, list_target):
+        logger.debug('rebuilt rendered table {0}'.format(list_target))
 
-    list_table.write(target)
-    logger.debug('rebuilt rendered list table {0}'.format(target))
+    if write_content(list_table, target):
+        logger.debug('rebuilt rendered list table {0}'.format(target))
 
     # if build_all or table_data.format == 'list':
     #     list_table = TableBuilder(ListTable(table_data))
@@ -20,6 +20,7 @@ from libgiza.task import Task
 from giza.content.tocs.inheritance import TocDataCache
 from giza.content.tocs.views import render_toctree, render_dfn_list, render_toc_table
 from giza.config.content import new_content_type
+from giza.content.helper import write_content
 
 logger = logging.getLogger('giza.content.tocs.tasks')
 
@@ -35,20 +36,20 @@ def register_toc(conf):
 
 def write_toc_tree_output(fn, toc_items, is_ref):
     content = render_toctree(toc_items, is_ref)
-    content.write(fn)
-    logger.info("wrote toctree to: " + fn)
+    if write_content(content, fn):
+        logger.info("wrote toctree to: " + fn)
 
 
 def write_dfn_list_output(fn, toc_items):
     content = render_dfn_list(toc_items)
-    content.write(fn)
-    logger.info("wrote toc dfnlist to: " + fn)
+    if write_content(content, fn):
+        logger.info("wrote toc dfnlist to: " + fn)
 
 
 def write_toc_table(fn, toc_items):
     content = render_toc_table(toc_items)
-    content.write(fn)
-    logger.info("wrote toc table to: " + fn)
+    if write_content(content, fn):
+        logger.info("wrote toc table to: " + fn)
 
 
 def toc_tasks(conf):
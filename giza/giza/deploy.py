@@ -19,15 +19,43 @@ Given a deploy target, we need to compile the rsync commands to:
 - rsync all static files. (unless non-master and .htaccess)
 - create the rsync command.
 
+:meth:`Deploy.run()` records every host that received the tree in a manifest,
+kept per target and, for branched targets, per branch. The first deploy to a
+host, and every deploy with ``--force``, compares the whole tree by checksum
+(``rsync -c``). Later deploys use rsync's quick check, which compares sizes and
+modification times, rather than re-checksumming the whole tree on both ends.
+All static files go to a host in one transfer.
+
+Transfers to hosts run concurrently, ``fanout`` hosts at a time, and the files
+and bytes sent to and time spent on every host are logged and returned.
+
+A host that is an absolute path is a local directory that stands in for the
+root of a server's filesystem: the tree is synchronized to it with
+:func:`giza.tools.sync.sync_target()` rather than rsync. The local tree is
+walked and hashed once for all such hosts, with the manifest of
+:mod:`giza.tools.sync`.
 """
 
 import logging
 import os.path
+import re
+import shutil
 import subprocess
 import shlex
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from giza.tools.files import md5_file, safe_create_directory
+from giza.tools.sync import (scan_tree, hash_source_files, sync_target,
+                             load_manifest, dump_manifest)
 
 logger = logging.getLogger('giza.deploy')
 
+rsync_bytes_rx = re.compile(r'^Total bytes sent: ([\d,.]+)', re.MULTILINE)
+rsync_files_rx = re.compile(r'^Number of (?:regular )?files transferred: ([\d,.]+)',
+                            re.MULTILINE)
+
 
 class Deploy(object):
 
@@ -40,6 +68,7 @@ class Deploy(object):
         self.recursive = True
         self.env = None
         self.hosts = None
+        self.fanout = None
         self.static_files = []
         self.branched = False
 
@@ -66,12 +95,16 @@ class Deploy(object):
         self.deploy_env = getattr(self.conf.deploy, self.env)
 
         self.hosts = self.deploy_env.hosts
+        self.fanout = self.deploy_env.fanout
 
         if 'static' in pspec['paths']:
             self.static_files.extend(pspec['paths']['static'])
 
-    def _base_cmd(self):
-        base_cmd = ['rsync', '-cqltz']
+    def _base_cmd(self, checksum=True):
+        if checksum is True:
+            base_cmd = ['rsync', '-cltz', '--stats']
+        else:
+            base_cmd = ['rsync', '-ltz', '--stats']
 
         if self.delete is True:
             base_cmd.append('--delete')
@@ -84,43 +117,238 @@ class Deploy(object):
 
         return base_cmd
 
+    @property
+    def local_dir(self):
+        if self.branched is True:
+            return os.path.join(self.conf.paths.output, self.local_path,
+                                self.conf.git.branches.current)
+        else:
+            return os.path.join(self.conf.paths.output, self.local_path)
+
+    @property
+    def remote_dir(self):
+        if self.branched is True:
+            return os.path.join(self.remote_path, self.conf.git.branches.current)
+        else:
+            return self.remote_path
+
+    @property
+    def manifest_fn(self):
+        if self.branched is True:
+            fn = '-'.join((self.name, self.conf.git.branches.current)) + '.json'
+        else:
+            fn = self.name + '.json'
+
+        return os.path.join(self.conf.paths.deploy_manifests, fn)
+
+    def get_static_files(self):
+        static_files = []
+
+        for fn in self.static_files:
+            if self.conf.git.branches.current != 'master' and fn == '.htaccess':
+                logger.debug('skipping .htaccess files from non-master branch')
+                continue
+            else:
+                static_files.append(os.path.join(self.conf.paths.output, self.local_path, fn))
+
+        return static_files
+
     def deploy_commands(self):
-        base = self._base_cmd()
+        """
+        Yields the rsync commands that :meth:`run()` would run to transfer
+        the tree and the static files to every remote host.
+        """
+
+        manifest = load_manifest(self.manifest_fn)
+        static_files = self.get_static_files()
 
         for host in self.hosts:
-            if self.branched is True:
-                yield base + [os.path.join(self.conf.paths.output,
-                                           self.local_path,
-                                           self.conf.git.branches.current),
-                              host + ':' + self.remote_path]
-            else:
-                yield base + [os.path.join(self.conf.paths.output, self.local_path) + '/',
-                              host + ':' + self.remote_path]
+            if is_local_host(host):
+                continue
+
+            for cmd in self._remote_cmds(host, static_files, self._previous(manifest, host)):
+                yield cmd
+
+    def _previous(self, manifest, host):
+        if self.conf.runstate.force is True:
+            return None
+        else:
+            return manifest['targets'].get(host)
+
+    def _remote_cmds(self, host, static_files, previous):
+        # hosts that have received the tree before use the quick check, so
+        # that unchanged files are not checksummed on both ends.
+        base = self._base_cmd(checksum=previous is None)
 
-            for fn in self.static_files:
-                if self.conf.git.branches.current != 'master' and fn == '.htaccess':
-                    logger.debug('skipping .htaccess files from non-master branch')
-                    continue
-                else:
-                    yield base + [os.path.join(self.conf.paths.output,  self.local_path,  fn),
-                                  host + ':' + self.remote_path]
+        cmds = [base + [self.local_dir + '/', host + ':' + self.remote_dir]]
+        if len(static_files) > 0:
+            cmds.append(base + static_files + [host + ':' + self.remote_path])
+
+        return cmds
 
     def run(self):
-        map(deploy_target, self.deploy_commands())
+        """
+        Deploys the tree and the static files to all hosts.
 
+        :returns: a dictionary mapping every host to a dictionary of the
+           ``files`` and ``bytes`` sent, the ``seconds`` spent, and the
+           ``returncode``, which is non-zero for failed deploys.
+        """
+
+        manifest = load_manifest(self.manifest_fn)
+        static_files = [fn for fn in self.get_static_files() if os.path.isfile(fn)]
+
+        if any(is_local_host(host) for host in self.hosts):
+            files, dirs = scan_tree(self.local_dir, [])
+            hashes = hash_source_files(self.local_dir, files, manifest['source'],
+                                       self.conf.runstate.pool_size)
+            manifest['source'] = hashes
+
+        def deploy_host(host):
+            previous = self._previous(manifest, host)
+
+            start = time.time()
+            if is_local_host(host):
+                result = self._deploy_local(host, files, dirs, hashes, static_files, previous)
+            else:
+                result = self._deploy_remote(host, static_files, previous)
+            result['seconds'] = time.time() - start
+
+            return host, result
+
+        if len(self.hosts) <= 1 or self.fanout <= 1:
+            results = map(deploy_host, self.hosts)
+        else:
+            pool = ThreadPool(min(self.fanout, len(self.hosts)))
+            try:
+                results = pool.map(deploy_host, self.hosts)
+            finally:
+                pool.close()
+                pool.join()
+
+        report = {}
+        for host, result in results:
+            # failed hosts keep their previous manifest, so that the next
+            # deploy to a host that never received the whole tree compares
+            # it by checksum.
+            manifest_entry = result.pop('manifest')
+            if result['returncode'] == 0:
+                manifest['targets'][host] = manifest_entry
+
+            report[host] = result
+
+            m = 'deployed {0} to {1}: {2} files, {3} bytes in {4:.2f}s'
+            if result['returncode'] == 0:
+                logger.info(m.format(self.name, host, result['files'], result['bytes'],
+                                     result['seconds']))
+            else:
+                logger.error(m.format(self.name, host, result['files'], result['bytes'],
+                                      result['seconds']) + ' (failed)')
+
+        dump_manifest(manifest, self.manifest_fn)
+
+        return report
+
+    def _deploy_remote(self, host, static_files, previous):
+        result = {'files': 0, 'bytes': 0, 'returncode': 0,
+                  'manifest': {'deployed': time.time()}}
+
+        for cmd in self._remote_cmds(host, static_files, previous):
+            r, files, sent = run_rsync(cmd)
+            result['files'] += files
+            result['bytes'] += sent
+
+            if r != 0:
+                result['returncode'] = r
+                break
+
+        return result
+
+    def _deploy_local(self, host, files, dirs, hashes, static_files, previous):
+        target = os.path.join(host, self.remote_dir.lstrip('/'))
+
+        if previous is None:
+            previous = {'files': {}}
+
+        # the target's manifest only saves rehashing target files whose stat
+        # signature is unchanged: sync_target() checks every file.
+        stats, target_cache = sync_target(self.local_dir, target, files, dirs, hashes,
+                                          previous['files'], [], [], delete=self.delete)
+
+        result = {'files': stats['copied'] + stats['linked'] + stats['deleted'],
+                  'bytes': 0, 'returncode': 0,
+                  'manifest': {'files': target_cache}}
+
+        for fn, value in target_cache.items():
+            if previous['files'].get(fn, [None, None])[1] != value[1]:
+                result['bytes'] += os.path.getsize(os.path.join(self.local_dir, fn))
+
+        static_target = os.path.join(host, self.remote_path.lstrip('/'))
+        safe_create_directory(static_target)
+        for fn in static_files:
+            target_fn = os.path.join(static_target, os.path.basename(fn))
+
+            if not os.path.isfile(target_fn) or md5_file(target_fn) != md5_file(fn):
+                shutil.copyfile(fn, target_fn)
+                result['files'] += 1
+                result['bytes'] += os.path.getsize(fn)
+
+        return result
+
+
+def is_local_host(host):
+    return os.path.isabs(host)
+
+
+def deploy_hosts(deploy):
+    return deploy.run()
+
+
+def run_rsync(cmd):
+    """
+    Runs the rsync command ``cmd``.
+
+    :returns: a tuple of the return code, and the number of files and bytes
+       sent, from the output of ``--stats``.
+    """
 
-def deploy_target(cmd):
     with open(os.devnull, 'w') as f:
         logger.info(cmd)
-        r = subprocess.call(shlex.split(cmd), stderr=f, stdout=f)
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=f, universal_newlines=True)
+        out = p.communicate()[0]
 
-    if r == 0:
+    log_rsync_error(p.returncode)
+
+    files = parse_rsync_stat(rsync_files_rx, out)
+    sent = parse_rsync_stat(rsync_bytes_rx, out)
+
+    return p.returncode, files, sent
+
+
+def parse_rsync_stat(regex, out):
+    match = regex.search(out)
+    if match is None:
         return 0
+    else:
+        return int(match.group(1).replace(',', '').replace('.', ''))
+
+
+def log_rsync_error(r):
+    if r == 0:
+        return
     elif r == 23:
         logger.warning('permissions error on remote end, possibly timestamp related.')
     elif r == 12:
         logger.warning('connection closed by remote host. rsync operation failed.')
     else:
-        logger.error('"rsync" returned code {1}'.format(cmd, r))
+        logger.error('"rsync" returned code {0}'.format(r))
+
+
+def deploy_target(cmd):
+    with open(os.devnull, 'w') as f:
+        logger.info(cmd)
+        r = subprocess.call(shlex.split(cmd), stderr=f, stdout=f)
+
+    log_rsync_error(r)
 
     return r
@@ -12,54 +12,166 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import json
+import logging
 import os
 import re
-import itertools
-import operator
-import subprocess
-import shlex
 
 import yaml
 
-from giza.tools.files import expand_tree
+from giza.tools.files import expand_tree, safe_create_directory, stat_signature
+from giza.tools.serialization import load_yaml_all
+from giza.tools.timing import Timer
 
+logger = logging.getLogger('giza.includes')
 
-def include_files(conf, files=None):
-    if files is not None:
-        return files
-    else:
-        source_dir = os.path.join(conf.paths.projectroot, conf.paths.source)
-        cmd = shlex.split('grep -R ".. include:: /" {0}'.format(source_dir))
 
-        with open(os.devnull, 'w') as null:
+# Include Graph Index
+
+INDEX_VERSION = 1
+
+include_rx = re.compile(r'.*\.\. include:: (/.*)')
+
+
+def _scan_includes(data):
+    if b'include:: /' not in data:
+        return []
+
+    includes = set()
+    for line in data.decode('utf-8', 'replace').split('\n'):
+        m = include_rx.match(line)
+        if m is not None:
+            includes.add(m.group(1).rstrip())
+
+    return sorted(includes)
+
+
+def _scan_generated(data, fn):
+    deps = []
+
+    try:
+        for doc in load_yaml_all(data):
+            if isinstance(doc, dict) and 'source' in doc:
+                deps.append(doc['source']['file'])
+    except (yaml.YAMLError, KeyError, TypeError) as e:
+        logger.warning('could not read include dependencies from {0}: {1}'.format(fn, e))
+
+    return deps
+
+
+def load_include_index(conf):
+    fn = conf.system.include_cache
+
+    if os.path.isfile(fn):
+        with open(fn, 'r') as f:
             try:
-                grep = subprocess.check_output(args=cmd, stderr=null)
-            except subprocess.CalledProcessError as e:
-                grep = e.output
+                index = json.load(f)
+            except ValueError:
+                logger.warning('include index {0} is corrupt, rebuilding.'.format(fn))
+            else:
+                if index.get('version') == INDEX_VERSION:
+                    return index
+
+    return {'version': INDEX_VERSION, 'files': {}}
+
+
+def dump_include_index(index, conf):
+    fn = conf.system.include_cache
+    safe_create_directory(os.path.dirname(fn))
+
+    tmp_fn = fn + '.tmp-' + str(os.getpid())
+    with open(tmp_fn, 'w') as f:
+        json.dump(index, f)
+
+    os.rename(tmp_fn, fn)
+    logger.debug('wrote include index to: {0}'.format(fn))
+
+
+def update_include_index(conf, index=None):
+    """
+    Returns the include graph index for the ``source/`` directory of the
+    project. The index maps each source file, relative to ``source/``, to its
+    content hash, the files it includes, and (for YAML files in the includes
+    directory) the files that the generated content depends on.
+
+    Files whose size, mtime and inode match the copy of the index stored at
+    ``conf.system.include_cache`` are not read at all, and only files whose
+    hash differs are re-parsed. The index is written back to disk only if it
+    changed.
+    """
+
+    if index is None:
+        index = load_include_index(conf)
+
+    source_dir = os.path.join(conf.paths.projectroot, conf.paths.source)
+    includes_prefix = conf.paths.includes[len(conf.paths.source):] + '/'
+
+    old_files = index['files']
+    files = {}
+    changed = 0
+    dirty = False
 
-        rx = re.compile(source_dir + r'(.*):.*\.\. include:: (.*)')
+    with Timer('update include index'):
+        for fn in expand_tree(source_dir, None):
+            rel_fn = fn[len(source_dir):]
+            signature = stat_signature(fn)
 
-        s = [m.groups()
-             for m in [rx.match(d)
-                       for d in grep.split('\n')]
-             if m is not None
-             ]
+            if rel_fn in old_files and old_files[rel_fn].get('stat') == signature:
+                files[rel_fn] = old_files[rel_fn]
+                continue
 
-        def tuple_sort(k):
-            return k[1]
-        s.sort(key=tuple_sort)
+            dirty = True
+            with open(fn, 'rb') as f:
+                data = f.read()
+
+            digest = hashlib.md5(data).hexdigest()
+
+            if rel_fn in old_files and old_files[rel_fn]['hash'] == digest:
+                files[rel_fn] = old_files[rel_fn]
+                files[rel_fn]['stat'] = signature
+                continue
+
+            entry = {'hash': digest,
+                     'stat': signature,
+                     'includes': _scan_includes(data)}
+
+            if rel_fn.startswith(includes_prefix) and rel_fn.endswith('yaml'):
+                entry['generated'] = _scan_generated(data, fn)
+
+            files[rel_fn] = entry
+            changed += 1
+
+    if dirty or len(files) != len(old_files):
+        index['files'] = files
+        dump_include_index(index, conf)
+
+    logger.info('include index: re-read {0} of {1} files'.format(changed, len(files)))
+
+    return index
+
+
+def include_files(conf, files=None, index=None):
+    if files is not None:
+        return files
+    else:
+        if index is None:
+            index = update_include_index(conf)
 
         files = dict()
 
-        for i in itertools.groupby(s, operator.itemgetter(1)):
-            files[i[0]] = set()
-            for src in i[1]:
-                if not src[0].endswith('~') and not src[0].endswith('overview.rst'):
-                    files[i[0]].add(src[0])
-            files[i[0]] = list(files[i[0]])
-            files[i[0]].sort()
+        for src, entry in index['files'].items():
+            for included in entry['includes']:
+                if included not in files:
+                    files[included] = set()
+
+                if not src.endswith('~') and not src.endswith('overview.rst'):
+                    files[included].add(src)
 
-        for k, v in generated_includes(conf).items():
+        for included in files:
+            files[included] = sorted(files[included])
+
+        for k, v in generated_includes(conf, index).items():
             if k in files:
                 files[k].extend(v)
             else:
@@ -106,42 +218,30 @@ def includes_masked(mask, conf, inc_files=None):
     return results
 
 
-def generated_includes(conf):
-    step_files = []
+def generated_includes(conf, index=None):
+    if index is None:
+        index = update_include_index(conf)
+
     mapping = {}
 
     content_prefixes = []
     for _, prefixes in conf.system.content.content_prefixes:
         content_prefixes.extend(prefixes)
 
-    for fn in expand_tree(os.path.join(conf.paths.includes), input_extension='yaml'):
-        base = os.path.basename(fn)
+    path_prefix = conf.paths.includes[len(conf.paths.source):]
+
+    for fn, entry in index['files'].items():
+        if 'generated' not in entry or len(entry['generated']) == 0:
+            continue
 
         # example/toc-specs files, for the purpose of this have the same
         # structure as steps, so we can just use that
+        base = os.path.basename(fn)
         for prefix in content_prefixes:
             if base.startswith(prefix):
-                step_files.append(fn)
+                mapping[fn] = [os.path.join(path_prefix, i) for i in entry['generated']]
                 break
 
-    maskl = len(conf.paths.source)
-    path_prefix = conf.paths.includes[len(conf.paths.source):]
-
-    for step_def in step_files:
-        deps = []
-
-        with open(step_def, 'r') as f:
-            data = yaml.safe_load_all(f)
-
-            for step in data:
-                if 'source' in step:
-                    deps.append(step['source']['file'])
-
-        if len(deps) != 0:
-            deps = [os.path.join(path_prefix, i) for i in deps]
-
-            mapping[step_def[maskl:]] = deps
-
     return mapping
 
 
@@ -12,16 +12,45 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+"""
+Giza's versions of the :mod:`libgiza.inheritance` classes.
+
+:class:`DataCache` keeps the parsed and resolved content of every source file
+in a persistent :class:`ContentCache`, so that warm builds load unchanged
+files without parsing YAML or resolving inheritance. An entry is valid while
+the hashes of its file, and of every file that its content inherits from,
+directly or indirectly, are unchanged.
+"""
+
 import copy
+import hashlib
+import io
+import json
+import logging
 import os
+import zlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
+import libgiza
 import libgiza.inheritance
 import libgiza.config
 
+import giza
 import giza.content.helper
 
 import giza.tools.files
 
+from giza.tools.serialization import load_yaml_file
+
+logger = logging.getLogger('giza.inheritance')
+
+#: Increment to invalidate all content caches when the cached objects change.
+CONTENT_CACHE_VERSION = 1
+
 
 class InheritanceReference(libgiza.inheritance.InheritanceReference):
 
@@ -67,9 +96,263 @@ class DataContentBase(libgiza.inheritance.DataContentBase):
     content_class = InheritableContentBase
 
 
+def get_references(content):
+    """:returns: the set of files that ``content`` and its members inherit from directly."""
+
+    refs = set()
+
+    if isinstance(content, libgiza.inheritance.InheritableContentBase):
+        if content.source is not None and 'file' in content.source.state:
+            refs.add(content.source.state['file'])
+        values = list(content.state.values())
+    elif isinstance(content, libgiza.inheritance.DataContentBase):
+        values = list(content.content.values())
+    elif isinstance(content, (list, tuple)):
+        values = content
+    elif isinstance(content, dict):
+        values = list(content.values())
+    else:
+        return refs
+
+    for value in values:
+        refs.update(get_references(value))
+
+    return refs
+
+
+class ContentCache(object):
+    """
+    Stores the content objects of a :class:`DataCache` in a compressed pickle
+    file. The configuration object and the data cache, which the content
+    objects refer to, are not stored, but replaced with the current ones when
+    loading.
+
+    The file holds a dictionary with a ``settings`` digest, which covers the
+    parts of the configuration that change the content of all files; a
+    ``files`` dictionary of file names to ``[signature, hash]`` lists; and an
+    ``entries`` dictionary of source files to a dictionary of the hashes of
+    their dependencies, and their pickled content.
+    """
+
+    def __init__(self, fn, data, conf):
+        self.fn = fn
+        self.data = data
+        self.conf = conf
+        self.settings = self.get_settings()
+
+        self.files = {}
+        self.entries = {}
+        self.hashes = {}
+        self.changed = False
+
+        self.load()
+
+    def get_settings(self):
+        conf = self.conf
+
+        if 'replacement' in conf.system.files.data:
+            replacement = conf.system.files.data.replacement
+            if not isinstance(replacement, dict):
+                replacement = replacement.dict()
+        else:
+            replacement = {}
+
+        settings = [CONTENT_CACHE_VERSION, giza.__version__,
+                    getattr(libgiza, '__version__', None),
+                    type(self.data).__module__, type(self.data).__name__,
+                    conf.project.edition, replacement]
+
+        return hashlib.md5(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def load(self):
+        if not os.path.isfile(self.fn):
+            return
+
+        try:
+            with open(self.fn, 'rb') as f:
+                cache = pickle.loads(zlib.decompress(f.read()))
+        except Exception as e:
+            logger.warning('could not read content cache {0}: {1}'.format(self.fn, e))
+            return
+
+        if cache.get('settings') != self.settings:
+            logger.info('settings changed, ignoring content cache ' + self.fn)
+        else:
+            self.files = cache['files']
+            self.entries = cache['entries']
+
+    def file_hash(self, fn):
+        if fn not in self.hashes:
+            try:
+                sig = giza.tools.files.stat_signature(fn)
+            except OSError:
+                self.hashes[fn] = None
+                return None
+
+            if fn in self.files and self.files[fn][0] == sig:
+                self.hashes[fn] = self.files[fn][1]
+            else:
+                self.hashes[fn] = giza.tools.files.md5_file(fn)
+                self.files[fn] = [sig, self.hashes[fn]]
+                self.changed = True
+
+        return self.hashes[fn]
+
+    def _persistent_id(self, obj):
+        if obj is self.data:
+            return 'data'
+        elif type(obj) is type(self.conf):
+            return 'conf'
+        else:
+            return None
+
+    def _persistent_load(self, pid):
+        if pid == 'data':
+            return self.data
+        elif pid == 'conf':
+            return self.conf
+        else:
+            raise pickle.UnpicklingError('unknown persistent id ' + pid)
+
+    def get(self, fn):
+        """:returns: the cached content of ``fn``, or ``None`` if it is not current."""
+
+        if fn not in self.entries:
+            return None
+
+        deps, content = self.entries[fn]
+        for dep, digest in deps.items():
+            if self.file_hash(dep) != digest:
+                return None
+
+        unpickler = pickle.Unpickler(io.BytesIO(content))
+        unpickler.persistent_load = self._persistent_load
+
+        try:
+            return unpickler.load()
+        except Exception as e:
+            logger.warning('could not load cached content for {0}: {1}'.format(fn, e))
+            return None
+
+    def put(self, fn, content, deps):
+        buf = io.BytesIO()
+        pickler = pickle.Pickler(buf, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = self._persistent_id
+
+        try:
+            pickler.dump(content)
+        except Exception as e:
+            logger.warning('could not cache content for {0}: {1}'.format(fn, e))
+            return
+
+        self.entries[fn] = (dict((dep, self.file_hash(dep)) for dep in deps), buf.getvalue())
+        self.changed = True
+
+    def prune(self, fns):
+        for fn in list(self.entries.keys()):
+            if fn not in fns:
+                del self.entries[fn]
+                self.changed = True
+
+        used = set()
+        for deps, _ in self.entries.values():
+            used.update(deps.keys())
+
+        for fn in list(self.files.keys()):
+            if fn not in used:
+                del self.files[fn]
+
+    def save(self):
+        if self.changed is False:
+            return
+
+        giza.tools.files.safe_create_directory(os.path.dirname(self.fn))
+
+        cache = {'settings': self.settings, 'files': self.files, 'entries': self.entries}
+
+        tmp_fn = self.fn + '.tmp'
+        with open(tmp_fn, 'wb') as f:
+            f.write(zlib.compress(pickle.dumps(cache, pickle.HIGHEST_PROTOCOL), 1))
+        os.rename(tmp_fn, self.fn)
+
+        self.changed = False
+        logger.debug('wrote {0} entries to content cache {1}'.format(len(self.entries), self.fn))
+
+
 class DataCache(libgiza.inheritance.DataCache):
     content_class = DataContentBase
 
+    def __init__(self, files, conf):
+        self._content_cache = None
+        self._parsed = set()
+
+        # only cache content types that the build registered, and never when
+        # forcing a rebuild.
+        if (self.content_type is not None and
+                self.content_type in conf.system.content and
+                conf.runstate.force is False):
+            fn = os.path.join(conf.system.content_cache, self.content_type + '.pickle')
+            self._content_cache = ContentCache(fn, self, conf)
+
+        super(DataCache, self).__init__(files, conf)
+
+    def ingest(self, files):
+        super(DataCache, self).ingest(files)
+
+        if self._content_cache is not None:
+            self.update_content_cache()
+
+    def parse_file(self, fn):
+        self.cache[fn] = self.content_class(load_yaml_file(fn), self, self.conf)
+
+    def add_file(self, fn):
+        if fn in self.cache and self.cache[fn] != []:
+            logger.debug('populated file {0} exists in the cache'.format(fn))
+            return
+        elif self._content_cache is None:
+            return self.parse_file(fn)
+
+        content = self._content_cache.get(fn)
+
+        if content is None:
+            self.parse_file(fn)
+            self._parsed.add(fn)
+        else:
+            self.cache[fn] = content
+            logger.debug('loaded {0} from the content cache'.format(fn))
+
+    def get_dependencies(self, fn, refs):
+        deps = set([fn])
+        queue = [fn]
+
+        while len(queue) > 0:
+            for ref in refs.get(queue.pop(), []):
+                if ref not in deps:
+                    deps.add(ref)
+                    queue.append(ref)
+
+        return deps
+
+    def update_content_cache(self):
+        refs = dict((fn, get_references(content)) for fn, content in self.cache.items()
+                    if fn in self._parsed)
+
+        # the references of cached files are the dependencies of their entries.
+        for fn, content in self.cache.items():
+            if fn not in refs and fn in self._content_cache.entries:
+                refs[fn] = set(self._content_cache.entries[fn][0].keys())
+
+        for fn in self._parsed:
+            self._content_cache.put(fn, self.cache[fn], self.get_dependencies(fn, refs))
+
+        if len(self._parsed) > 0:
+            m = 'parsed {0} of {1} {2} files, loaded the rest from the content cache'
+            logger.info(m.format(len(self._parsed), len(self.cache), self.content_type))
+
+        self._parsed = set()
+        self._content_cache.prune(self.cache)
+        self._content_cache.save()
+
     def create_output_dir(self):
         dirname = self.conf.system.content.get(self.content_type).output_dir
         if (self.content_type is not None and
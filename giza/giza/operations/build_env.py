@@ -28,6 +28,7 @@ from sphinx.builders.html import get_stable_hash
 
 from giza.config.helper import fetch_config, get_builder_jobs
 from giza.config.sphinx_config import avalible_sphinx_builders
+from giza.content.sphinx import get_doctree_name
 from giza.operations.packaging import fetch_package
 from giza.tools.files import safe_create_directory, FileNotFoundError
 
@@ -101,8 +102,9 @@ def package_build_env(builders, editions, languages, conf):
             files_to_archive.add(os.path.join(rconf.paths.branch_output,
                                               sconf.build_output))
             files_to_archive.add(os.path.join(rconf.paths.branch_output,
-                                              '-'.join(('doctrees', sconf.build_output))))
+                                              get_doctree_name(sconf, rconf)))
             files_to_archive.add(rconf.system.dependency_cache_fn)
+            files_to_archive.add(rconf.system.include_cache_fn)
 
         files_to_archive = list(files_to_archive)
         logger.info('prepped build cache archive. writing file now.')
@@ -23,7 +23,7 @@ import onetimepass as otp
 
 from giza.config.helper import fetch_config, new_credentials_config
 from libgiza.app import BuildApp
-from giza.deploy import Deploy, deploy_target
+from giza.deploy import Deploy, deploy_hosts
 from giza.operations.sphinx_cmds import sphinx_publication
 
 logger = logging.getLogger('giza.operations.deploy')
@@ -80,12 +80,12 @@ def publish_and_deploy(args):
 
 def deploy_tasks(c, app):
     """
-    Deploys the build. The logic for generating the rsync commands is
-    in ``giza.deploy``, and the configuration data is typically in
+    Deploys the build. The logic for transferring the build to the hosts is in
+    ``giza.deploy``, and the configuration data is typically in
     ``config/push``.
 
-    This function glues the config with the rsync command creation and then
-    runs the commands.
+    This function glues the config with the deploy engine, and adds one task
+    for every push target.
     """
     pconf = dict((item['target'], item) for item in c.system.files.data.push)
 
@@ -99,12 +99,15 @@ def deploy_tasks(c, app):
 
         d.load(target_pconf)
 
-        for cmd in d.deploy_commands():
-            task = app.add('task')
-            task.args = ' '.join(cmd)
-            task.job = deploy_target
+        # one task per target: the deploy engine runs the transfers to all
+        # hosts concurrently, and hashes the local tree once for all of them.
+        task = app.add('task')
+        task.args = [d]
+        task.job = deploy_hosts
+        task.description = 'deploying {0} to {1} hosts'.format(target, len(d.hosts))
 
-            if c.runstate.dry_run is True:
+        if c.runstate.dry_run is True:
+            for cmd in d.deploy_commands():
                 logger.info('dry run: {0}'.format(' '.join(cmd)))
 
     logger.info('completed deploy for: {0}'.format(' '.join(c.runstate.push_targets)))
@@ -226,6 +226,8 @@ def redirects(args):
 
 @argh.arg('--edition', '-e', nargs='*', dest='editions_to_build')
 @argh.arg('--language', '-l', nargs='*', dest='languages_to_build')
+@argh.arg('--source_copy', choices=['copy', 'hardlink', 'reflink'], default=None,
+          dest='source_copy_mode')
 @argh.expects_obj
 def source(args):
     args.builder = 'html'
@@ -27,6 +27,7 @@ import json
 import argh
 
 from giza.config.helper import fetch_config
+from giza.content.dependencies import dependency_report
 
 from giza.includes import (included_once, included_recusively,
                            includes_masked, include_files,
@@ -106,3 +107,10 @@ def clean(args):
             logger.info("removed {0}, which was an unused include file.".format(fn))
         else:
             logger.error('{0} does not exist'.format(fn))
+
+
+@argh.expects_obj
+def stale(args):
+    c = fetch_config(args)
+
+    render_for_console(dependency_report(conf=c))
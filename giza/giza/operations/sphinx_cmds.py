@@ -16,8 +16,10 @@
 Main controlling operations for running Sphinx builds.
 """
 
-import itertools
+import collections
 import logging
+import multiprocessing
+import os
 import argh
 
 from giza.config.helper import fetch_config, get_builder_jobs, get_restricted_builder_jobs
@@ -29,10 +31,14 @@ from giza.content.includes import includes_tasks
 from giza.content.images.tasks import image_tasks
 from giza.content.intersphinx import intersphinx_tasks
 from giza.content.table import table_tasks
+from giza.content.rendering import render_content_tasks
 from giza.content.hash import hash_tasks
-from giza.content.source import source_tasks, latex_image_transfer_tasks
+from giza.content.source import source_sync_tasks, latex_image_transfer_tasks
 from giza.content.dependencies import refresh_dependency_tasks, dump_file_hash_tasks
-from giza.content.sphinx import sphinx_tasks, output_sphinx_stream
+from giza.content.sphinx import (sphinx_group_tasks, get_doctree_name, get_sphinx_budget,
+                                 SphinxBuildResult, SeenMessages)
+from giza.content.sphinx_budget import dump_build_timings
+from giza.content.sphinx_warnings import print_warnings_diff
 from giza.content.post.sphinx import finalize_sphinx_build
 from giza.content.redirects import redirect_tasks
 from giza.content.migrations import migration_tasks
@@ -47,6 +53,16 @@ logger = logging.getLogger('giza.operations.sphinx')
 @argh.arg('--language', '-l', nargs='*', dest='languages_to_build')
 @argh.arg('--builder', '-b', nargs='*', default='html')
 @argh.arg('--serial_sphinx', action='store_true')
+@argh.arg('--warnings-diff', action='store_true', dest='warnings_diff',
+          help=('only show warnings that are new or resolved since the previous build, '
+                'and fail if there are new warnings. Reads every document.'))
+@argh.arg('--shared-doctrees', action='store_true', dest='shared_doctrees',
+          help='run builders with the same edition, language and tags on one doctree')
+@argh.arg('--source_copy', choices=['copy', 'hardlink', 'reflink'], default=None,
+          dest='source_copy_mode')
+@argh.arg('--sphinx-driver', choices=['subprocess', 'inprocess'], default=None,
+          dest='sphinx_driver',
+          help='run sphinx in giza worker processes rather than with sphinx-build')
 @argh.named('sphinx')
 @argh.expects_obj
 def main(args):
@@ -115,44 +131,86 @@ def sphinx_publication(conf, app):
 
 
 def sphinx_builder_tasks(app, conf):
+    # messages are deduplicated across all builders as they run. Builders in a
+    # process pool need a dictionary and lock shared through a manager process.
+    if conf.runstate.runner == 'process':
+        manager = multiprocessing.Manager()
+    else:
+        manager = None
+    seen = SeenMessages(manager)
+
+    # builders that run at the same time share pool_size cores for their sphinx
+    # processes, rather than each running with "-j pool_size".
+    budget = get_sphinx_budget(conf, manager)
+
+    # builders that use the same doctree directory (see the shared_doctrees
+    # option) must run in sequence, so each group becomes a single task.
+    groups = collections.OrderedDict()
     for ((edition, language, builder), (build_config, sconf)) in get_builder_jobs(conf):
-        sphinx_job = sphinx_tasks(sconf, build_config)
-        sphinx_job.finalizers = finalize_sphinx_build(sconf, build_config)
+        doctree = get_doctree_name(sconf, build_config)
+        groups.setdefault(doctree, []).append((sconf, build_config))
+        logger.info("adding builder job for {0} ({1}, {2})".format(builder, language, edition))
+
+    for jobs in groups.values():
+        finalizers = []
+        for sconf, build_config in jobs:
+            finalizers.extend(finalize_sphinx_build(sconf, build_config))
+
+        sphinx_job = sphinx_group_tasks(jobs, seen, budget)
+        sphinx_job.finalizers = finalizers
 
         app.extend_queue(sphinx_job)
-        logger.info("adding builder job for {0} ({1}, {2})".format(builder, language, edition))
+
+        # the budget divides the cores between the builders that will run at
+        # the same time: one per group, since the builders of a group run in
+        # sequence, and none for groups that are up to date and won't run.
+        if budget is not None and sphinx_job.needs_rebuild is True:
+            budget.add(jobs[0][0].build_output)
 
     logger.info("sphinx build configured, running the build now.")
 
-    app.run()
-    logger.info("sphinx build complete.")
+    try:
+        app.run()
+
+        if budget is not None:
+            dump_build_timings(conf.paths.sphinx_build_timings,
+                               budget.timings, budget.durations())
+    finally:
+        if manager is not None:
+            manager.shutdown()
 
-    logger.info('builds finalized. sphinx output and errors to follow')
+    logger.info("sphinx build complete.")
 
-    # process the sphinx build. These oeprations allow us to de-duplicate
-    # messages between builds.
-    results = [o for o in app.results
-               if isinstance(o, tuple) and len(o) == 2]
+    # sphinx output is printed while the builders run; collect the return codes
+    # and message counts.
+    results = []
+    for o in app.results:
+        if isinstance(o, SphinxBuildResult):
+            results.append(o)
+        elif isinstance(o, list):
+            results.extend(r for r in o if isinstance(r, SphinxBuildResult))
 
     if len(results) == 0:
         # this happens (rarely) if the deps on the sphinx task do *not* trigger
         # sphinx-build to run.
-
-        output = []
         ret_code = 0
     else:
         # add all builders response codes. If they're all then we can return 0,
         # otherwise, exit.
         ret_code = sum([o[0] for o in results])
 
-        output = [o[1].split('\n') for o in results if o != '']
+        m = 'builds finalized. {0} sphinx builders reported {1} messages'
+        logger.info(m.format(len(results), sum([len(o.messages) for o in results])))
 
-        sphinx_output = list(reduce(itertools.chain, output))
-        try:
-            output_sphinx_stream(sphinx_output, conf)
-        except:
-            logger.error('problem parsing sphinx output, exiting')
-            raise SystemExit(1)
+        if conf.runstate.warnings_diff is True:
+            new_warnings = print_warnings_diff([o.build_id for o in results
+                                                if o.build_id is not None], conf)
+
+            # fail the build, so that CI can reject changes that add warnings.
+            if new_warnings > 0:
+                logger.error('sphinx builds have {0} new warnings'.format(new_warnings))
+                if ret_code == 0:
+                    ret_code = 1
 
         if ret_code != 0:
             raise SystemExit(ret_code)
@@ -171,9 +229,9 @@ def sphinx_content_preperation(app, conf):
 
     # Copy all source to the ``build/<branch>/source`` directory.
     with Timer('migrating source to build'):
-        with app.context(randomize=True) as source_app:
-            for (_, (build_config, sconf)) in get_restricted_builder_jobs(conf):
-                source_app.extend_queue(source_tasks(build_config, sconf))
+        with app.context() as source_app:
+            jobs = [job for _, job in get_restricted_builder_jobs(conf)]
+            source_app.extend_queue(source_sync_tasks(conf, jobs))
 
     # load all generated content and create tasks.
     with Timer('loading generated content'):
@@ -187,14 +245,31 @@ def sphinx_content_preperation(app, conf):
         results = app.run()
         app.reset()
 
+    # render all generated content, and tables, in one process pool.
+    with Timer('rendering generated content'):
+        render_tasks = []
         for task_group in results:
-            app.extend_queue(task_group)
+            # content types without a task generator return None, and some
+            # generators return a single task.
+            if task_group is None:
+                continue
+            elif isinstance(task_group, Task):
+                render_tasks.append(task_group)
+            else:
+                render_tasks.extend(task_group)
+
+        for (_, (build_config, sconf)) in get_restricted_builder_jobs(conf):
+            render_tasks.extend(table_tasks(build_config))
+
+        render_content_tasks(render_tasks, conf.runstate.pool_size,
+                             stamp_dir=os.path.join(conf.paths.projectroot,
+                                                    conf.paths.branch_output, 'content-stamps'))
 
     for ((edition, language, builder), (build_config, sconf)) in get_restricted_builder_jobs(conf):
         # these functions all return tasks
         app.extend_queue(image_tasks(build_config, sconf))
         for content_generator in (robots_txt_tasks, intersphinx_tasks, includes_tasks,
-                                  table_tasks, hash_tasks, redirect_tasks):
+                                  hash_tasks, redirect_tasks):
             app.extend_queue(content_generator(build_config))
 
         dependency_refresh_app = app.add('app')
@@ -16,20 +16,31 @@
 
 import binascii
 import collections
+import errno
 import functools
+import gzip
 import hashlib
 import logging
+import multiprocessing
 import os
 import os.path
+import shutil
+import socket
 import sqlite3
+import random
 import stat
+import tempfile
 import threading
+import time
+
+from multiprocessing.pool import ThreadPool
 
 import argh
 import boto.s3.connection
 import boto.s3.bucket
 import boto.s3.key
 import boto.s3.lifecycle
+import boto.s3.multipart
 
 from libgiza.git import GitRepo
 from giza.config.helper import fetch_config
@@ -39,11 +50,47 @@ try:
 except ImportError:
     import ConfigParser as configparser
 
+try:
+    import queue as Queue
+except ImportError:
+    import Queue
+
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+
 LOGGER = logging.getLogger('giza.operations.stage')
 
 FileUpdate = collections.namedtuple('FileUpdate', ['path', 'mtime',
                                                    'file_hash', 'is_new'])
 
+# S3 multi-object delete requests accept at most this many keys
+DELETE_CHUNK_SIZE = 1000
+
+# The cache/ prefix of a bucket is listed again once the recorded listing is
+# this many seconds old, since other users' runs also add to the cache
+CACHE_MANIFEST_MAX_AGE = 24 * 60 * 60
+
+# Local file errors with these errnos fail the same way on every upload
+# attempt, and are not retried
+PERMANENT_ERRNOS = frozenset([errno.ENOENT, errno.EACCES, errno.EPERM, errno.EISDIR,
+                              errno.ENOTDIR, errno.ENAMETOOLONG, errno.ELOOP])
+
+# Files at least this large are uploaded in parts of MULTIPART_CHUNK_SIZE
+# bytes, MULTIPART_WORKERS parts at a time. S3 parts must be at least 5 MiB.
+MULTIPART_THRESHOLD = 32 * 1024 * 1024
+MULTIPART_CHUNK_SIZE = 16 * 1024 * 1024
+MULTIPART_WORKERS = 4
+
+# Files with these extensions are gzipped before upload when compression
+# is enabled, and uploaded with these content types. The types are explicit
+# because mimetypes does not know .json on every platform.
+COMPRESSED_TYPES = {'.html': 'text/html',
+                    '.js': 'application/javascript',
+                    '.css': 'text/css',
+                    '.json': 'application/json'}
+
 CONFIG_PATH = '~/.config/giza-aws-authentication.conf'
 SAMPLE_CONFIG = '''[authentication]
 accesskey=<AWS access key>
@@ -62,11 +109,13 @@ class NoSuchEdition(StagingException):
 
 
 class SyncFileException(StagingException):
-    """An exception indicating an S3 deletion error."""
-    def __init__(self, path, reason):
+    """An exception indicating an S3 error syncing a path, with the HTTP
+       status of the failed request, if any."""
+    def __init__(self, path, reason, status=None):
         StagingException.__init__(self, 'Error syncing path: {0}'.format(path))
         self.reason = reason
         self.path = path
+        self.status = status
 
 
 class SyncException(StagingException):
@@ -76,81 +125,191 @@ class SyncException(StagingException):
         self.errors = errors
 
 
-class PoolWorker(threading.Thread):
-    """A threaded worker that works on a queue of functions."""
-    def __init__(self, **kwargs):
-        threading.Thread.__init__(self, **kwargs)
-
-        # Avoid needing to mutex-protect this queue by only ever appending to it
-        self.tasks = []
-        self.results = []
-        self.i = 0
+class UploadJob(object):
+    """A file to upload: upload() is called with no arguments, and may be
+       called again if it raises an exception."""
+    def __init__(self, path, size, upload):
+        self.path = path
+        self.size = size
+        self.upload = upload
+
+
+def is_transient_error(err):
+    """Return True if the given upload error may succeed on retry: network
+       and I/O errors, and S3 responses with a 5xx status. Errors such as
+       denied access or a missing file fail the same way on every attempt."""
+    if isinstance(err, httplib.HTTPException):
+        return True
+
+    # socket.error is OSError in python 3, so local file errors are told
+    # apart from network errors by their errno.
+    if isinstance(err, (socket.error, IOError, OSError)):
+        return getattr(err, 'errno', None) not in PERMANENT_ERRNOS
+
+    status = getattr(err, 'status', None)
+    return status is not None and status >= 500
+
+
+class UploadStats(object):
+    """Thread-safe throughput counters for an Uploader."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.files = 0
+        self.bytes = 0
+        self.retries = 0
+        self.failures = 0
+
+    def record(self, size):
+        with self.lock:
+            self.files += 1
+            self.bytes += size
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+
+    def rates(self):
+        """Return (files per second, MB per second) since the start."""
+        elapsed = max(time.time() - self.start, 0.001)
+        return self.files / elapsed, self.bytes / elapsed / 2 ** 20
+
+    def log(self, total):
+        files_rate, mb_rate = self.rates()
+        LOGGER.info('Uploaded %d/%d files, %.1f MB (%.1f files/s, %.2f MB/s, %d retries)',
+                    self.files, total, self.bytes / 2.0 ** 20, files_rate, mb_rate,
+                    self.retries)
+
+
+class Uploader(object):
+    """Runs UploadJobs in a bounded pool of threads.
+
+       Workers take jobs from one shared queue, so a worker that finishes
+       early takes the next job rather than waiting on a fixed assignment, and
+       jobs start largest first, so that large files don't all end up at the
+       end of the run. Each job that fails with a transient error is retried
+       on its own, with exponential backoff. Throughput is logged every report_interval seconds."""
+    def __init__(self, n_workers=16, max_attempts=5, backoff=0.5, max_backoff=30.0,
+                 report_interval=5.0):
+        self.n_workers = n_workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.report_interval = report_interval
+        self.stats = None
+
+    def get_delay(self, attempt):
+        """Return the number of seconds to wait before retrying after the
+           given failed attempt, with jitter so that retries spread out."""
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def run_job(self, job):
+        """Run a job, retrying it on transient errors. Return None on
+           success, or the last exception."""
+        for attempt in range(self.max_attempts):
+            try:
+                job.upload()
+                self.stats.record(job.size)
+                return None
+            except Exception as err:
+                if attempt + 1 == self.max_attempts or not is_transient_error(err):
+                    self.stats.record_failure()
+                    return err
 
-        self.semaphore = threading.Semaphore(0)
+                LOGGER.warning('Retrying %s after error: %s', job.path, err)
+                self.stats.record_retry()
+                time.sleep(self.get_delay(attempt))
 
-    def run(self):
+    def _work(self, jobs, errors):
         while True:
-            self.semaphore.acquire()
+            job = jobs.get()
+            try:
+                if job is None:
+                    return
 
-            next_task = self.tasks[self.i]
-            if next_task is None:
-                return
+                err = self.run_job(job)
+                if err is not None:
+                    errors.append((job, err))
+            finally:
+                jobs.task_done()
 
-            try:
-                result = next_task()
-                if result is not None:
-                    self.results.append((next_task, result))
-            except Exception as err:
-                self.results.append((next_task, err))
+    def run(self, jobs):
+        """Upload every job. Return a list of (job, exception) pairs for the
+           jobs that failed on every attempt."""
+        jobs = sorted(jobs, key=lambda job: job.size, reverse=True)
+        self.stats = UploadStats()
 
-            self.i += 1
+        if not jobs:
+            return []
 
-    def add_task(self, task):
-        """Adds a function to this work queue. The worker will exit if it
-           reaches a None value."""
-        self.tasks.append(task)
-        self.semaphore.release()
+        n_workers = min(self.n_workers, len(jobs))
 
+        # The queue holds a few jobs per worker: the rest wait in the sorted
+        # list, so the queue stays small however many files there are.
+        queue = Queue.Queue(maxsize=n_workers * 2)
+        errors = []
+        done = threading.Event()
 
-def run_pool(tasks, n_workers=50):
-    """Run a list of tasks using a pool of threads. Return non-None results or
-       exceptions as a list of (task, result) pairs in an arbitrary order."""
-    workers = []
-    for _ in range(n_workers):
-        worker = PoolWorker()
-        worker.start()
-        workers.append(worker)
+        workers = [threading.Thread(target=self._work, args=(queue, errors))
+                   for _ in range(n_workers)]
 
-    # Schedule tasks round-robin
-    for i in range(len(tasks)):
-        workers[i % n_workers].add_task(tasks[i])
+        def report():
+            while not done.wait(self.report_interval):
+                self.stats.log(len(jobs))
 
-    for worker in workers:
-        worker.add_task(None)
+        reporter = threading.Thread(target=report)
 
-    for worker in workers:
-        worker.join()
+        for thread in workers + [reporter]:
+            thread.daemon = True
+            thread.start()
 
-    results = []
-    for worker in workers:
-        results.extend(worker.results)
+        for job in jobs:
+            queue.put(job)
 
-    return results
+        for _ in workers:
+            queue.put(None)
+
+        for worker in workers:
+            worker.join()
+
+        done.set()
+        reporter.join()
+        self.stats.log(len(jobs))
+
+        return errors
 
 
 class FileCollector(object):
     """Database for detecting changed files."""
-    def __init__(self, namespace, db_path):
+    def __init__(self, namespace, db_path, pool_size=None):
         self.namespace = namespace
-        self.conn = sqlite3.connect(db_path)
+        # Upload threads record the state of multipart uploads
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
         self.__init()
 
+        if pool_size is None:
+            pool_size = multiprocessing.cpu_count()
+        self.pool_size = pool_size
+
         self.dirty_files = []
+        self.touched_files = []
         self.removed_files = []
 
     def __init(self):
         cur = self.conn.cursor()
+
+        # The write-ahead log makes the single write transaction in commit()
+        # cheap, and lets concurrent stage runs read while another one writes.
+        cur.execute('PRAGMA journal_mode=WAL')
+        cur.execute('PRAGMA synchronous=NORMAL')
+
         cur.execute('''CREATE TABLE IF NOT EXISTS files(
             namespace text NOT NULL,
             path text NOT NULL,
@@ -159,92 +318,111 @@ class FileCollector(object):
             PRIMARY KEY(namespace, path))''')
         cur.execute('''CREATE INDEX IF NOT EXISTS namespace ON files(namespace)''')
 
-        cur.execute('''CREATE TEMPORARY TABLE disk(
-            namespace text NOT NULL,
-            path text NOT NULL,
-            PRIMARY KEY(namespace, path))''')
+        # Hashes of the files in the cache/ prefix of each bucket
+        cur.execute('''CREATE TABLE IF NOT EXISTS cache(
+            bucket text NOT NULL,
+            hash blob NOT NULL,
+            PRIMARY KEY(bucket, hash))''')
+
+        # Whether the files of each namespace were uploaded compressed
+        cur.execute('''CREATE TABLE IF NOT EXISTS settings(
+            namespace text NOT NULL PRIMARY KEY,
+            compress integer NOT NULL)''')
+
+        # When the cache/ prefix of each bucket was last listed
+        cur.execute('''CREATE TABLE IF NOT EXISTS cache_listed(
+            bucket text NOT NULL PRIMARY KEY,
+            time real NOT NULL)''')
+
+        # Multipart uploads in progress, so that a failed upload can resume
+        cur.execute('''CREATE TABLE IF NOT EXISTS multipart(
+            bucket text NOT NULL,
+            key text NOT NULL,
+            hash blob NOT NULL,
+            upload_id text NOT NULL,
+            PRIMARY KEY(bucket, key))''')
+        self.conn.commit()
 
-    def collect(self, root):
-        """Yield each path underneath root. Only yield files that have changed
-           since the last run."""
+    def load(self):
+        """Return a dictionary of every path in this namespace to a
+           (mtime, hash) tuple, read from the database in one query."""
         cur = self.conn.cursor()
-        cur.execute('DELETE FROM disk')
-
-        for basedir, _, files in os.walk(root):
-            for filename in files:
-                path = os.path.join(basedir, filename)
+        cur.execute('SELECT path, mtime, hash FROM files WHERE namespace=?',
+                    (self.namespace,))
 
-                # Update our temporary list of on-disk files
-                cur.execute('INSERT INTO disk VALUES (?, ?)', (self.namespace, path))
+        return dict((row['path'], (row['mtime'], bytes(row['hash'])))
+                    for row in cur.fetchall())
 
-                update = self.has_changed(path)
-                if update is False:
-                    continue
+    def hash_all(self, paths):
+        """Return a dictionary of every path in paths to its hash, hashing the
+           files in a pool of threads."""
+        if self.pool_size <= 1 or len(paths) <= 1:
+            return dict((path, self.hash(path)) for path in paths)
 
-                self.dirty_files.append(update)
-                yield update
+        pool = ThreadPool(self.pool_size)
+        try:
+            chunksize = max(1, len(paths) // (self.pool_size * 4))
+            return dict(zip(paths, pool.map(self.hash, paths, chunksize)))
+        finally:
+            pool.close()
+            pool.join()
 
-        # Find files that have disappeared from the filesystem
-        cur.execute('''
-            SELECT path from files WHERE namespace=?
-                EXCEPT
-            SELECT path from disk WHERE namespace=?
-            ''', (self.namespace, self.namespace))
+    def collect(self, root):
+        """Yield a FileUpdate for each file underneath root that has changed
+           since the last run. All candidate files are stat'ed and hashed
+           before the first FileUpdate is yielded, so this does not stream."""
+        known = self.load()
+        on_disk = set()
+        candidates = []
 
-        removed_files = [entry[0] for entry in cur.fetchall()]
-        self.removed_files.extend(removed_files)
+        for basedir, _, files in os.walk(root):
+            for filename in files:
+                path = os.path.join(basedir, filename)
+                on_disk.add(path)
 
-    def has_changed(self, path):
-        """Returns a FileUpdate instance if the given path has changed since it
-           was last checked, or else False."""
-        path_stat = os.stat(path)
+                # Provide ms-level precision
+                mtime = int(os.stat(path).st_mtime * 1000)
 
-        # Provide ms-level precision
-        mtime = int(path_stat.st_mtime * 1000)
+                if path not in known or known[path][0] != mtime:
+                    candidates.append((path, mtime))
 
-        cur = self.conn.cursor()
-        cur.execute('SELECT * FROM files WHERE namespace=? AND path=?',
-                    (self.namespace, path,))
-        row = cur.fetchone()
+        hashes = self.hash_all([path for path, _ in candidates])
 
-        if row is None:
-            file_hash = self.hash(path)
-            update = FileUpdate(path, mtime, file_hash, True)
-            return update
+        for path, mtime in candidates:
+            if path not in known:
+                update = FileUpdate(path, mtime, hashes[path], True)
+            elif hashes[path] != known[path][1]:
+                update = FileUpdate(path, mtime, hashes[path], False)
+            else:
+                # Only the mtime changed: record it, so that the next run does
+                # not hash this file again, but don't upload it.
+                self.touched_files.append(FileUpdate(path, mtime, hashes[path], False))
+                continue
 
-        if row['mtime'] == mtime:
-            return False
+            self.dirty_files.append(update)
+            yield update
 
-        file_hash = self.hash(path)
-        if file_hash != bytes(row['hash']):
-            update = FileUpdate(path, mtime, file_hash, False)
-            return update
+        # Find files that have disappeared from the filesystem
+        self.removed_files.extend(sorted(set(known) - on_disk))
 
-        return False
+        LOGGER.info('%d of %d files changed, %d removed, %d hashed',
+                    len(self.dirty_files), len(on_disk), len(self.removed_files),
+                    len(candidates))
 
     def commit(self):
         """Commit to cache any file changes that collect() detected. You should
            call this only once syncing is successful."""
-        cur = self.conn.cursor()
-        for entry in self.dirty_files:
-            hash_binary_view = sqlite3.Binary(entry.file_hash)
-
-            if entry.is_new:
-                cur.execute('INSERT INTO files VALUES(?, ?, ?, ?)', (
-                    self.namespace, entry.path, entry.mtime, hash_binary_view))
-            else:
-                cur.execute('''UPDATE files SET mtime=?, hash=?
-                            WHERE namespace=? AND path=?''',
-                            (entry.mtime, hash_binary_view,
-                             self.namespace, entry.path))
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO files VALUES(?, ?, ?, ?)',
+                                  [(self.namespace, entry.path, entry.mtime,
+                                    sqlite3.Binary(entry.file_hash))
+                                   for entry in self.dirty_files + self.touched_files])
 
-        for path in self.removed_files:
-            cur.execute('DELETE FROM disk WHERE namespace=? AND path=?',
-                        (self.namespace, path))
-            cur.execute('DELETE FROM files WHERE namespace=? AND path=?',
-                        (self.namespace, path))
+            self.conn.executemany('DELETE FROM files WHERE namespace=? AND path=?',
+                                  [(self.namespace, path) for path in self.removed_files])
 
-        self.conn.commit()
+        self.dirty_files = []
+        self.touched_files = []
         self.removed_files = []
 
     def purge_now(self):
@@ -254,6 +432,97 @@ class FileCollector(object):
         cur.execute('DELETE FROM files WHERE namespace=?', (self.namespace,))
         self.conn.commit()
 
+    def set_compress(self, compress):
+        """Record whether the files of this namespace are uploaded compressed.
+           If this changed since the last run, forget the mtimes and hashes
+           of the namespace's files, so that collect() yields every file
+           again, while still detecting removed files."""
+        cur = self.conn.cursor()
+        cur.execute('SELECT compress FROM settings WHERE namespace=?', (self.namespace,))
+        row = cur.fetchone()
+
+        # Namespaces staged before the setting existed were not compressed
+        previous = False if row is None else bool(row['compress'])
+        if row is not None and previous == compress:
+            return
+
+        with self.conn:
+            if previous != compress:
+                LOGGER.info('Compression changed: uploading all files again')
+                self.conn.execute('UPDATE files SET mtime=-1, hash=? WHERE namespace=?',
+                                  (sqlite3.Binary(b''), self.namespace))
+
+            self.conn.execute('INSERT OR REPLACE INTO settings VALUES(?, ?)',
+                              (self.namespace, int(compress)))
+
+    def cached_hashes(self, bucket):
+        """Return the set of hashes known to be in the cache of the given
+           bucket."""
+        cur = self.conn.cursor()
+        cur.execute('SELECT hash FROM cache WHERE bucket=?', (bucket,))
+
+        return set(bytes(row['hash']) for row in cur.fetchall())
+
+    def add_cached_hashes(self, bucket, hashes, replace=False):
+        """Record that the cache of the given bucket has files with the given
+           hashes. If replace is True, the hashes are a complete listing of
+           the cache: forget all other hashes, and record the listing time."""
+        with self.conn:
+            if replace:
+                self.conn.execute('DELETE FROM cache WHERE bucket=?', (bucket,))
+                self.conn.execute('INSERT OR REPLACE INTO cache_listed VALUES(?, ?)',
+                                  (bucket, time.time()))
+
+            self.conn.executemany('INSERT OR IGNORE INTO cache VALUES(?, ?)',
+                                  [(bucket, sqlite3.Binary(file_hash)) for file_hash in hashes])
+
+    def cache_listed_time(self, bucket):
+        """Return the time at which the cache of the given bucket was last
+           listed, or None if it must be listed again."""
+        cur = self.conn.cursor()
+        cur.execute('SELECT time FROM cache_listed WHERE bucket=?', (bucket,))
+        row = cur.fetchone()
+
+        if row is None:
+            return None
+
+        return row['time']
+
+    def expire_cached_hashes(self, bucket):
+        """Mark the recorded cache listing of the given bucket as out of date,
+           so that the next run lists the cache again."""
+        with self.conn:
+            self.conn.execute('DELETE FROM cache_listed WHERE bucket=?', (bucket,))
+
+    def get_multipart(self, bucket, key):
+        """Return a (hash, upload_id) tuple for the multipart upload in
+           progress to the given key, or None."""
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute('SELECT hash, upload_id FROM multipart WHERE bucket=? AND key=?',
+                        (bucket, key))
+            row = cur.fetchone()
+
+        if row is None:
+            return None
+
+        return bytes(row['hash']), row['upload_id']
+
+    def set_multipart(self, bucket, key, file_hash, upload_id):
+        """Record a multipart upload of the file with the given hash to the
+           given key."""
+        with self.lock:
+            with self.conn:
+                self.conn.execute('INSERT OR REPLACE INTO multipart VALUES(?, ?, ?, ?)',
+                                  (bucket, key, sqlite3.Binary(file_hash), upload_id))
+
+    def remove_multipart(self, bucket, key):
+        """Forget the multipart upload to the given key."""
+        with self.lock:
+            with self.conn:
+                self.conn.execute('DELETE FROM multipart WHERE bucket=? AND key=?',
+                                  (bucket, key))
+
     @staticmethod
     def hash(path):
         """Return the SHA-256 hash of the given file path as a byte sequence."""
@@ -270,6 +539,18 @@ class FileCollector(object):
         return hasher.digest()
 
 
+def delete_keys(bucket, keys):
+    """Delete keys from the bucket with multi-object delete requests of at
+       most DELETE_CHUNK_SIZE keys each. Return a list of errors."""
+    errors = []
+
+    for i in range(0, len(keys), DELETE_CHUNK_SIZE):
+        result = bucket.delete_keys(keys[i:i + DELETE_CHUNK_SIZE])
+        errors.extend(result.errors)
+
+    return errors
+
+
 class Staging(object):
     # These files are always unique, and so there is no benefit in sharing them
     SHARED_CACHE_BLACKLIST = {'genindex.html', 'objects.inv', 'searchindex.js'}
@@ -277,12 +558,23 @@ class Staging(object):
     S3_OPTIONS = {'reduced_redundancy': True}
     RESERVED_BRANCHES = {'cache'}
 
-    def __init__(self, namespace, bucket, conf):
+    def __init__(self, namespace, bucket, conf, compress=False):
         # The S3 prefix for this staging site
         self.namespace = namespace
 
+        # Whether to gzip files in COMPRESSED_TYPES before uploading
+        self.compress = compress
+        self.compressed_dir = None
+
         self.bucket = bucket
         self.collector = FileCollector(self.namespace, conf.paths.file_changes_database)
+        self.uploader = Uploader()
+
+        # Hashes uploaded to the cache during this run, from worker threads
+        self.uploaded_hashes = []
+
+        # Set by worker threads when a file was missing from the cache
+        self.cache_is_stale = False
 
     @classmethod
     def compute_namespace(cls, username, branch, edition):
@@ -301,15 +593,129 @@ class Staging(object):
         self.collector.purge_now()
 
         keys = [k.key for k in self.bucket.list(prefix='/'.join((self.namespace, '')))]
-        result = self.bucket.delete_keys(keys)
-        if result.errors:
-            raise SyncException(result.errors)
+        errors = delete_keys(self.bucket, keys)
+        if errors:
+            raise SyncException(errors)
+
+    def load_cache_manifest(self):
+        """Return the set of hashes in the bucket's cache/ prefix. The hashes
+           are read from the FileCollector database, and the prefix is listed
+           again only if it has never been listed, if the listing is older
+           than CACHE_MANIFEST_MAX_AGE, or if a previous run found files
+           missing from the cache."""
+        listed_time = self.collector.cache_listed_time(self.bucket.name)
+        if listed_time is not None and time.time() - listed_time < CACHE_MANIFEST_MAX_AGE:
+            return self.collector.cached_hashes(self.bucket.name)
+
+        hashes = set()
+        for key in self.bucket.list(prefix='cache/'):
+            try:
+                hashes.add(binascii.a2b_hex(key.key[len('cache/'):]))
+            except (TypeError, ValueError, binascii.Error):
+                continue
+
+        LOGGER.info('Listed %d files in the cache of %s', len(hashes), self.bucket.name)
+        self.collector.add_cached_hashes(self.bucket.name, hashes, replace=True)
+
+        return hashes
+
+    def compress_file(self, path, file_hash):
+        """Gzip the given file into compressed_dir. Return the path and hash
+           of the gzipped file."""
+        compressed_path = os.path.join(self.compressed_dir, binascii.b2a_hex(file_hash))
+
+        with open(path, 'rb') as input_file:
+            # Without a timestamp, the same file always compresses to the
+            # same bytes
+            with open(compressed_path, 'wb') as output_file:
+                gz = gzip.GzipFile(filename='', fileobj=output_file, mode='wb', mtime=0)
+                shutil.copyfileobj(input_file, gz)
+                gz.close()
+
+        return compressed_path, FileCollector.hash(compressed_path)
+
+    def prepare_files(self, entries):
+        """Return a list of (FileUpdate, path, hash, headers) tuples describing
+           the content to upload for each of the given FileUpdates. When
+           compression is enabled, text files are gzipped into compressed_dir,
+           once per distinct file, in the FileCollector's pool of threads. The
+           hash is the hash of the gzipped file, so that compressed and
+           uncompressed copies of a file do not share a cache key."""
+        to_compress = collections.OrderedDict()
+        if self.compress:
+            for entry in entries:
+                if os.path.splitext(entry.path)[1] in COMPRESSED_TYPES:
+                    to_compress.setdefault(entry.file_hash, entry.path)
+
+        items = [(path, file_hash) for file_hash, path in to_compress.items()]
+        pool_size = self.collector.pool_size
+        if pool_size <= 1 or len(items) <= 1:
+            compressed = [self.compress_file(*item) for item in items]
+        else:
+            pool = ThreadPool(pool_size)
+            try:
+                compressed = pool.map(lambda item: self.compress_file(*item), items)
+            finally:
+                pool.close()
+                pool.join()
+
+        compressed = dict(zip(to_compress, compressed))
+
+        prepared = []
+        for entry in entries:
+            ext = os.path.splitext(entry.path)[1]
+            if self.compress and ext in COMPRESSED_TYPES:
+                src_path, file_hash = compressed[entry.file_hash]
+                headers = {'Content-Encoding': 'gzip', 'Content-Type': COMPRESSED_TYPES[ext]}
+                prepared.append((entry, src_path, file_hash, headers))
+            else:
+                prepared.append((entry, entry.path, entry.file_hash, {}))
+
+        return prepared
+
+    def get_jobs(self, root, entries):
+        """Return a list of UploadJobs for the given FileUpdates. Files with
+           the same content share one job, which copies the file from the
+           cache to every path, after uploading it to the cache if the cache
+           does not have it yet."""
+        cached = self.load_cache_manifest()
+        by_hash = collections.OrderedDict()
+        jobs = []
+
+        for entry, src_path, file_hash, headers in self.prepare_files(entries):
+            path = entry.path.replace(root, '', 1)
+
+            if path in self.SHARED_CACHE_BLACKLIST:
+                jobs.append(UploadJob(path, os.path.getsize(src_path), functools.partial(
+                    self.__upload_direct, path, src_path, file_hash, headers)))
+            else:
+                by_hash.setdefault(file_hash, []).append((path, src_path, headers))
+
+        n_copies = 0
+        for file_hash, paths in by_hash.items():
+            is_cached = file_hash in cached
+            src_path, headers = paths[0][1:]
+            local_paths = [path for path, _, _ in paths]
+
+            if is_cached:
+                # Copies are cheap server-side operations: run them after
+                # the uploads.
+                size = 0
+                n_copies += 1
+            else:
+                size = os.path.getsize(src_path)
+
+            jobs.append(UploadJob(local_paths[0], size, functools.partial(
+                self.__upload, local_paths, src_path, file_hash, headers, is_cached)))
+
+        LOGGER.info('%d files to copy from the cache, %d files to upload',
+                    n_copies, len(jobs) - n_copies)
+
+        return jobs
 
     def stage(self, root):
         """Synchronize the build directory with the staging bucket under
            the namespace [username]/[branch]/[edition]/"""
-        tasks = []
-
         # Ensure that the root ends with a trailing slash to make future
         # manipulations more predictable.
         if not root.endswith(os.path.sep):
@@ -318,20 +724,29 @@ class Staging(object):
         if not os.path.isdir(root):
             raise NoSuchEdition(root)
 
-        for entry in self.collector.collect(root):
-            # Run our actual staging operations in a thread pool. This would be
-            # better with async IO, but this will do for now.
-            path = entry.path.replace(root, '', 1)
-            tasks.append(functools.partial(
-                lambda path, file_hash: self.__upload(
-                    path,
-                    os.path.join(root, path),
-                    file_hash),
-                path, entry.file_hash))
+        self.collector.set_compress(self.compress)
+
+        if self.compress:
+            self.compressed_dir = tempfile.mkdtemp(prefix='giza-stage-')
+
+        try:
+            jobs = self.get_jobs(root, list(self.collector.collect(root)))
 
-        # Run our sync tasks, and retry any errors
-        errors = run_pool(tasks)
-        errors = run_pool([result[0] for result in errors])
+            # Run our sync tasks in a thread pool; each file is retried on its own
+            errors = self.uploader.run(jobs)
+        finally:
+            if self.compressed_dir is not None:
+                shutil.rmtree(self.compressed_dir)
+                self.compressed_dir = None
+
+        self.collector.add_cached_hashes(self.bucket.name, self.uploaded_hashes)
+        self.uploaded_hashes = []
+
+        if self.cache_is_stale:
+            # Files were removed from the cache since it was listed, so the
+            # listing may claim other files that are gone too.
+            self.collector.expire_cached_hashes(self.bucket.name)
+            self.cache_is_stale = False
 
         if errors:
             raise SyncException([result[1] for result in errors])
@@ -342,43 +757,119 @@ class Staging(object):
                        for path in self.collector.removed_files]
         if remove_keys:
             LOGGER.info('Removing %s', remove_keys)
-            remove_result = self.bucket.delete_keys(remove_keys)
-            if remove_result.errors:
-                raise SyncException(remove_result.errors)
+            remove_errors = delete_keys(self.bucket, remove_keys)
+            if remove_errors:
+                raise SyncException(remove_errors)
 
         self.collector.commit()
 
         return
 
-    def __upload(self, local_path, src_path, file_hash):
+    def __upload_direct(self, local_path, src_path, file_hash, headers):
         full_name = '/'.join((self.namespace, local_path))
         k = boto.s3.key.Key(self.bucket)
 
         try:
-            if local_path in self.SHARED_CACHE_BLACKLIST:
-                LOGGER.info('Uploading %s to %s', local_path, full_name)
-                k.key = full_name
-                k.set_contents_from_filename(src_path, **self.S3_OPTIONS)
-                return None
+            LOGGER.info('Uploading %s to %s', local_path, full_name)
+            k.key = full_name
+            self.__put(k, src_path, file_hash, headers)
+        except boto.exception.S3ResponseError as err:
+            raise SyncFileException(local_path, err.message, err.status)
+
+    def __upload_to_cache(self, k, src_path, file_hash, headers):
+        LOGGER.info('Uploading from %s to %s', src_path, k.key)
+        self.__put(k, src_path, file_hash, headers)
+        self.uploaded_hashes.append(file_hash)
+
+    def __put(self, k, src_path, file_hash, headers):
+        """Upload the given file to the given key, in parts if it is at least
+           MULTIPART_THRESHOLD bytes long."""
+        size = os.path.getsize(src_path)
+        if size < MULTIPART_THRESHOLD:
+            k.set_contents_from_filename(src_path, headers=headers, **self.S3_OPTIONS)
+            return
+
+        mp, uploaded = self.__resume_multipart(k.key, file_hash)
+        if mp is None:
+            mp = self.bucket.initiate_multipart_upload(k.key, headers=headers, **self.S3_OPTIONS)
+            self.collector.set_multipart(self.bucket.name, k.key, file_hash, mp.id)
+
+        parts = [(part_num, offset, min(MULTIPART_CHUNK_SIZE, size - offset))
+                 for part_num, offset in enumerate(range(0, size, MULTIPART_CHUNK_SIZE), 1)]
+        remaining = [part for part in parts if uploaded.get(part[0]) != part[2]]
+
+        LOGGER.info('Uploading %s in %d parts (%d already uploaded)', k.key,
+                    len(parts), len(parts) - len(remaining))
 
-            # Try to copy the file from the cache to its destination
-            file_hash = 'cache/' + binascii.b2a_hex(file_hash)
-            k.key = file_hash
+        def upload_part(part):
+            part_num, offset, part_size = part
+            with open(src_path, 'rb') as input_file:
+                input_file.seek(offset)
+                mp.upload_part_from_file(input_file, part_num, size=part_size)
 
+        if remaining:
+            pool = ThreadPool(min(MULTIPART_WORKERS, len(remaining)))
             try:
-                k.copy(self.bucket.name, full_name, **self.S3_OPTIONS)
-            except boto.exception.S3ResponseError as err:
-                if err.status == 404:
-                    # Not found in cache. Upload it to the cache
-                    LOGGER.info('Uploading from %s to %s (%s)', local_path, full_name, file_hash)
-                    k.set_contents_from_filename(src_path, **self.S3_OPTIONS)
-
-                    # And then copy it to its final destination
+                pool.map(upload_part, remaining)
+            finally:
+                pool.close()
+                pool.join()
+
+        mp.complete_upload()
+        self.collector.remove_multipart(self.bucket.name, k.key)
+
+    def __resume_multipart(self, key_name, file_hash):
+        """Return the multipart upload in progress to the given key, and a
+           dictionary of the sizes of its uploaded parts, or (None, {}) if
+           there is no upload of this file to resume."""
+        state = self.collector.get_multipart(self.bucket.name, key_name)
+        if state is None:
+            return None, {}
+
+        mp = boto.s3.multipart.MultiPartUpload(self.bucket)
+        mp.key_name = key_name
+        mp.id = state[1]
+
+        try:
+            if state[0] != file_hash:
+                # The file changed since the upload started
+                mp.cancel_upload()
+            else:
+                return mp, dict((part.part_number, part.size) for part in mp)
+        except boto.exception.S3ResponseError as err:
+            # A completed or aborted upload is gone
+            if err.status != 404:
+                raise err
+
+        self.collector.remove_multipart(self.bucket.name, key_name)
+        return None, {}
+
+    def __upload(self, local_paths, src_path, file_hash, headers, is_cached):
+        """Copy the file with the given hash from the cache to each of
+           local_paths, after uploading it to the cache unless is_cached."""
+        k = boto.s3.key.Key(self.bucket)
+        k.key = 'cache/' + binascii.b2a_hex(file_hash)
+
+        try:
+            if not is_cached:
+                self.__upload_to_cache(k, src_path, file_hash, headers)
+
+            for local_path in local_paths:
+                full_name = '/'.join((self.namespace, local_path))
+
+                try:
                     k.copy(self.bucket.name, full_name, **self.S3_OPTIONS)
-                else:
-                    raise err
+                except boto.exception.S3ResponseError as err:
+                    if err.status == 404 and is_cached:
+                        # The cache no longer has the file: upload it again
+                        self.cache_is_stale = True
+                        self.__upload_to_cache(k, src_path, file_hash, headers)
+                        is_cached = False
+                        k.copy(self.bucket.name, full_name, **self.S3_OPTIONS)
+                    else:
+                        raise err
         except boto.exception.S3ResponseError as err:
-            raise SyncFileException(local_path, err.message)
+            raise SyncFileException(local_paths[0], err.message, err.status)
 
 
 def do_stage(root, staging):
@@ -430,6 +921,8 @@ def print_stage_report(url, username, branch, editions):
 @argh.arg('--destage', default=False,
           dest='_destage', help='Delete the contents of the current staged render')
 @argh.arg('--builder', '-b', default='html')
+@argh.arg('--gzip', default=False, dest='_gzip',
+          help='Upload html, js, css, and json files with gzip content encoding')
 @argh.named('stage')
 @argh.expects_obj
 def main(args):
@@ -484,7 +977,7 @@ def main(args):
         bucket = conn.get_bucket(staging_config.bucket)
         for root, edition in zip(roots, editions):
             namespace = Staging.compute_namespace(username, branch, edition)
-            staging = Staging(namespace, bucket, conf)
+            staging = Staging(namespace, bucket, conf, compress=args._gzip)
 
             if args._destage:
                 staging.purge()
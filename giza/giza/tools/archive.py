@@ -0,0 +1,281 @@
+# Copyright 2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Builds ``.tar.gz`` archives of directory trees incrementally.
+
+A gzip file may consist of several gzip members, one after the other, which
+decompress to the concatenation of their contents. :func:`incremental_tarball()`
+divides the tar stream into chunks of members, compresses every chunk as a
+separate gzip member, in parallel, and caches the compressed chunks. Chunk
+boundaries depend only on the names of the files, so when a file changes only
+the chunk that contains it needs to be compressed again.
+
+A JSON manifest records the stat signature and hash of every file, and the
+chunks of the last archive. When no file changed, the archive is not rebuilt.
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import tarfile
+
+from multiprocessing.pool import ThreadPool
+
+from giza.tools.files import safe_create_directory, hash_files, stat_signature
+
+logger = logging.getLogger('giza.tools.archive')
+
+MANIFEST_VERSION = 1
+
+#: On average, one out of this many members starts a new chunk.
+CHUNK_MODULUS = 128
+
+#: Chunks end after the first member that brings them over this size.
+CHUNK_MAX_SIZE = 16 * 2 ** 20
+
+
+def scan_archive_members(path, arcroot):
+    """
+    :returns: a list of ``(arcname, path)`` pairs for ``path`` and every file,
+       directory, and link in ``path``, in a stable order.
+    """
+
+    members = [(arcroot, path)]
+
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        rel_root = os.path.relpath(root, path)
+
+        for fn in sorted(dirs + files):
+            if rel_root == '.':
+                rel = fn
+            else:
+                rel = os.path.join(rel_root, fn)
+
+            members.append((os.path.join(arcroot, rel), os.path.join(root, fn)))
+
+    return members
+
+
+def hash_members(members, previous, pool_size=None):
+    """
+    :returns: a dictionary of the paths of all members to ``[signature, hash]``
+       lists. Only files whose stat signature differs from the signature in
+       ``previous`` are hashed again.
+    """
+
+    result = {}
+    to_hash = []
+
+    for _, fn in members:
+        if os.path.islink(fn):
+            result[fn] = [None, 'link:' + os.readlink(fn)]
+        elif os.path.isdir(fn):
+            result[fn] = [None, None]
+        else:
+            sig = stat_signature(fn)
+            if fn in previous and previous[fn][0] == sig:
+                result[fn] = previous[fn]
+            else:
+                result[fn] = [sig, None]
+                to_hash.append(fn)
+
+    for fn, digest in hash_files(to_hash, pool_size).items():
+        result[fn][1] = digest
+
+    return result
+
+
+def split_chunks(members):
+    chunks = []
+    current = []
+    size = 0
+
+    for arcname, fn in members:
+        current.append((arcname, fn))
+        if not os.path.islink(fn) and os.path.isfile(fn):
+            size += os.path.getsize(fn)
+
+        boundary = int(hashlib.md5(arcname.encode('utf-8')).hexdigest()[:8], 16)
+        if boundary % CHUNK_MODULUS == 0 or size >= CHUNK_MAX_SIZE:
+            chunks.append(current)
+            current = []
+            size = 0
+
+    if len(current) > 0:
+        chunks.append(current)
+
+    return chunks
+
+
+def chunk_key(chunk, hashes):
+    """
+    :returns: a digest of all information in the tar headers and contents of
+       the members of ``chunk``.
+    """
+
+    h = hashlib.md5()
+    for arcname, fn in chunk:
+        st = os.lstat(fn)
+        h.update(repr((arcname, st.st_mode, st.st_uid, st.st_gid, int(st.st_mtime),
+                       hashes[fn][1])).encode('utf-8'))
+
+    return h.hexdigest()
+
+
+def _compress_chunk(job):
+    chunk, chunk_fn = job
+
+    raw = io.BytesIO()
+    t = tarfile.open(fileobj=raw, mode='w')
+    for arcname, fn in chunk:
+        t.add(name=fn, arcname=arcname, recursive=False)
+
+    # the tar file is not closed, so that the chunk does not end with the
+    # end-of-archive blocks.
+    data = raw.getvalue()
+
+    tmp_fn = chunk_fn + '.tmp'
+    with open(tmp_fn, 'wb') as f:
+        with gzip.GzipFile(fileobj=f, mode='wb', mtime=0) as gz:
+            gz.write(data)
+    os.rename(tmp_fn, chunk_fn)
+
+    return len(data)
+
+
+def _tar_trailer(length):
+    # two zero blocks end the archive, and tar pads archives to a full record.
+    length += tarfile.BLOCKSIZE * 2
+    padding = tarfile.BLOCKSIZE * 2
+
+    remainder = length % tarfile.RECORDSIZE
+    if remainder > 0:
+        padding += tarfile.RECORDSIZE - remainder
+
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', mtime=0) as gz:
+        gz.write(b'\0' * padding)
+
+    return out.getvalue()
+
+
+def load_manifest(fn):
+    if os.path.isfile(fn):
+        try:
+            with open(fn, 'r') as f:
+                manifest = json.load(f)
+
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest
+        except ValueError:
+            logger.warning('archive manifest {0} is corrupt, rebuilding'.format(fn))
+
+    return {'version': MANIFEST_VERSION, 'files': {}, 'chunks': [], 'digest': None}
+
+
+def dump_manifest(fn, manifest):
+    tmp_fn = fn + '.tmp'
+    with open(tmp_fn, 'w') as f:
+        json.dump(manifest, f)
+    os.rename(tmp_fn, fn)
+
+
+def incremental_tarball(name, path, cache_dir, newp=None, cdir=None, pool_size=None):
+    """
+    Creates a ``.tar.gz`` archive ``name`` of the directory ``path``, with the
+    same arguments as :func:`giza.tools.files.tarball()`. ``cache_dir`` holds
+    the manifest and the compressed chunks of the archive.
+
+    :returns: ``True`` if the archive was rebuilt, and ``False`` if no file
+       changed since the last archive.
+    """
+
+    if cdir is not None:
+        path = os.path.join(cdir, path)
+
+    if newp is not None:
+        arcroot = os.path.join(newp, os.path.basename(path))
+    else:
+        arcroot = path.lstrip(os.path.sep)
+
+    chunk_dir = os.path.join(cache_dir, os.path.basename(name) + '.chunks')
+    manifest_fn = os.path.join(cache_dir, os.path.basename(name) + '.json')
+    safe_create_directory(chunk_dir)
+    safe_create_directory(os.path.dirname(name))
+
+    manifest = load_manifest(manifest_fn)
+    members = scan_archive_members(path, arcroot)
+    hashes = hash_members(members, manifest['files'], pool_size)
+
+    chunks = [(chunk_key(chunk, hashes), chunk) for chunk in split_chunks(members)]
+    digest = hashlib.md5(''.join(key for key, _ in chunks).encode('utf-8')).hexdigest()
+
+    if digest == manifest['digest'] and os.path.isfile(name):
+        logger.info('no changes in {0}, not rebuilding tarball {1}'.format(path, name))
+        return False
+
+    lengths = dict((key, length) for key, length in manifest['chunks'])
+    to_compress = [(chunk, os.path.join(chunk_dir, key + '.gz'))
+                   for key, chunk in chunks
+                   if key not in lengths or
+                   not os.path.isfile(os.path.join(chunk_dir, key + '.gz'))]
+
+    if pool_size is None or pool_size <= 1 or len(to_compress) <= 1:
+        new_lengths = [_compress_chunk(job) for job in to_compress]
+    else:
+        pool = ThreadPool(pool_size)
+        try:
+            new_lengths = pool.map(_compress_chunk, to_compress)
+        finally:
+            pool.close()
+            pool.join()
+
+    for (_, chunk_fn), length in zip(to_compress, new_lengths):
+        lengths[os.path.basename(chunk_fn)[:-3]] = length
+
+    m = 'creating tarball {0}: compressed {1} of {2} chunks'
+    logger.debug(m.format(name, len(to_compress), len(chunks)))
+
+    tmp_name = name + '.tmp'
+    with open(tmp_name, 'wb') as out:
+        for key, _ in chunks:
+            with open(os.path.join(chunk_dir, key + '.gz'), 'rb') as f:
+                while True:
+                    data = f.read(2 ** 20)
+                    if not data:
+                        break
+                    out.write(data)
+
+        out.write(_tar_trailer(sum(lengths[key] for key, _ in chunks)))
+    os.rename(tmp_name, name)
+
+    # remove the chunks of previous archives.
+    current = set(key + '.gz' for key, _ in chunks)
+    for fn in os.listdir(chunk_dir):
+        if fn not in current:
+            os.remove(os.path.join(chunk_dir, fn))
+
+    dump_manifest(manifest_fn, {'version': MANIFEST_VERSION,
+                                'files': hashes,
+                                'chunks': [[key, lengths[key]] for key, _ in chunks],
+                                'digest': digest})
+
+    logger.info('created tarball: {0}'.format(name))
+
+    return True
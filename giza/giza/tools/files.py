@@ -18,6 +18,8 @@ import tarfile
 import logging
 import hashlib
 
+from multiprocessing.pool import ThreadPool
+
 logger = logging.getLogger('giza.files')
 
 
@@ -121,6 +123,54 @@ def md5_file(file, block_size=2 ** 20):
     return md5.hexdigest()
 
 
+def stat_signature(fn):
+    """
+    Returns a list of the size, modification time (in nanoseconds) and inode of
+    a file, suitable for storing in a JSON cache and comparing to detect
+    changed files without reading them.
+    """
+
+    st = os.stat(fn)
+    mtime_ns = getattr(st, 'st_mtime_ns', int(st.st_mtime * 1000000000))
+
+    return [st.st_size, mtime_ns, st.st_ino]
+
+
+def hash_files(file_list, pool_size=None):
+    """
+    Returns a dictionary mapping every file in ``file_list`` to its md5
+    digest. When ``pool_size`` is greater than 1, hashes files using a pool of
+    threads of that size.
+    """
+
+    if pool_size is None or pool_size <= 1 or len(file_list) <= 1:
+        return dict((fn, md5_file(fn)) for fn in file_list)
+
+    pool = ThreadPool(pool_size)
+    try:
+        chunksize = max(1, len(file_list) // (pool_size * 4))
+        hashes = pool.map(md5_file, file_list, chunksize)
+    finally:
+        pool.close()
+        pool.join()
+
+    return dict(zip(file_list, hashes))
+
+
+def break_hardlink(fn):
+    """
+    If ``fn`` has more than one hard link, replaces it with an independent copy
+    of the same content, so that writing to ``fn`` does not modify the other
+    links (e.g. proxy-source trees that share a canonical copy of the source.)
+    """
+
+    if os.path.isfile(fn) and not os.path.islink(fn) and os.stat(fn).st_nlink > 1:
+        tmp_fn = os.path.join(os.path.dirname(fn), '.' + os.path.basename(fn) + '.giza-unlink')
+        shutil.copy2(fn, tmp_fn)
+        os.rename(tmp_fn, fn)
+        logger.debug('broke hard link for {0}'.format(fn))
+
+
 def copy_if_needed(source_file, target_file, name='build'):
     if os.path.isfile(source_file) is False or os.path.isdir(source_file):
         msg = "{0}: Input file '{1}' does not exist.".format(name, source_file)
@@ -137,6 +187,7 @@ def copy_if_needed(source_file, target_file, name='build'):
             if name is not None:
                 logger.debug('{0}: "{1}" not changed.'.format(name, source_file))
         else:
+            break_hardlink(target_file)
             shutil.copyfile(source_file, target_file)
 
             if name is not None:
@@ -144,11 +195,33 @@ def copy_if_needed(source_file, target_file, name='build'):
                 logger.debug(m.format(name, source_file, target_file))
 
     try:
+        # the target may share an inode with other trees (see
+        # giza.tools.sync), which must keep their own mtime.
+        break_hardlink(target_file)
         os.utime(target_file, None)
     except:
         pass
 
 
+def replace_if_changed(tmp_fn, fn):
+    """
+    Renames ``tmp_fn`` to ``fn``, unless ``fn`` already holds the same content,
+    in which case ``tmp_fn`` is removed and ``fn`` keeps its ``mtime``.
+
+    :returns: ``True`` if ``fn`` was replaced, and ``False`` otherwise.
+    """
+
+    if (os.path.isfile(fn) and os.path.getsize(fn) == os.path.getsize(tmp_fn) and
+            md5_file(fn) == md5_file(tmp_fn)):
+        logger.debug('"{0}" not changed.'.format(fn))
+        os.remove(tmp_fn)
+        return False
+
+    os.rename(tmp_fn, fn)
+
+    return True
+
+
 def copy_always(source_file, target_file, name='build'):
     if os.path.isfile(source_file) is False:
         msg = "{0}: Input file '{1}' does not exist.".format(name, source_file)
@@ -156,6 +229,7 @@ def copy_always(source_file, target_file, name='build'):
         raise FileOperationError(msg)
     else:
         safe_create_directory(os.path.dirname(target_file))
+        break_hardlink(target_file)
         shutil.copyfile(source_file, target_file)
 
     logger.debug('{0}: copied {1} to {2}'.format(name, source_file, target_file))
@@ -0,0 +1,136 @@
+# Copyright 2015 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Reads YAML files for the configuration system.
+
+Uses the libyaml ``CSafeLoader`` when PyYAML has it, and memoizes the
+documents of every file by path, modification time and size, so that reading
+the same file again in the same process, for example when
+:func:`~giza.config.helper.fetch_config()` runs more than once, does not parse
+it again. Callers get a copy of the documents and may modify them.
+
+Records the number of parses, the number of memoized reads and the time spent
+parsing for every file: :func:`log_load_timings()` reports them.
+"""
+
+import copy
+import logging
+import os
+import threading
+import time
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+logger = logging.getLogger('giza.tools.serialization')
+
+_lock = threading.Lock()
+_documents = {}
+_timings = {}
+
+
+def load_yaml_all(data):
+    """:returns: a list of the YAML documents in the string or file ``data``."""
+
+    return list(yaml.load_all(data, Loader=SafeLoader))
+
+
+def _record(fn, parsed, duration):
+    with _lock:
+        if fn not in _timings:
+            _timings[fn] = {'parsed': 0, 'memoized': 0, 'seconds': 0.0}
+
+        if parsed is True:
+            _timings[fn]['parsed'] += 1
+        else:
+            _timings[fn]['memoized'] += 1
+
+        _timings[fn]['seconds'] += duration
+
+
+def load_yaml_file(fn):
+    """:returns: a list of the YAML documents in the file ``fn``."""
+
+    start = time.time()
+
+    st = os.stat(fn)
+    key = (st.st_mtime, st.st_size)
+
+    with _lock:
+        memo = _documents.get(fn)
+
+    if memo is not None and memo[0] == key:
+        docs = copy.deepcopy(memo[1])
+        _record(fn, False, time.time() - start)
+        return docs
+
+    with open(fn, 'r') as f:
+        docs = load_yaml_all(f)
+
+    with _lock:
+        _documents[fn] = (key, docs)
+
+    docs = copy.deepcopy(docs)
+    _record(fn, True, time.time() - start)
+
+    return docs
+
+
+def load_yaml(fn):
+    """:returns: the first YAML document in the file ``fn``, or ``None``."""
+
+    docs = load_yaml_file(fn)
+
+    if len(docs) == 0:
+        return None
+    else:
+        return docs[0]
+
+
+def get_load_timings():
+    """
+    :returns: a dictionary of file names to dictionaries with the number of
+       times the file was ``parsed``, the number of times it was ``memoized``,
+       and the total ``seconds`` spent reading it.
+    """
+
+    with _lock:
+        return copy.deepcopy(_timings)
+
+
+def log_load_timings():
+    timings = get_load_timings()
+
+    if len(timings) == 0:
+        return
+
+    for fn, timing in sorted(timings.items(), key=lambda item: -item[1]['seconds']):
+        m = 'yaml: read {0} in {1:.4f}s ({2} parsed, {3} memoized)'
+        logger.debug(m.format(fn, timing['seconds'], timing['parsed'], timing['memoized']))
+
+    m = 'yaml: read {0} files in {1:.4f}s with the {2}'
+    logger.info(m.format(len(timings),
+                         sum(timing['seconds'] for timing in timings.values()),
+                         SafeLoader.__name__))
+
+
+def clear_yaml_cache():
+    with _lock:
+        _documents.clear()
+        _timings.clear()
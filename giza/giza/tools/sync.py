@@ -0,0 +1,459 @@
+# Copyright 2014 MongoDB, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Synchronizes a source directory to one or more target directories, in the
+manner of ``rsync --links --checksum --recursive --delete``, without checksumming
+every file on both sides of every transfer.
+
+A JSON manifest records the stat signature and hash of every source file, and
+of every file written to each target. Files are only hashed when their stat
+signature has changed since the last sync, and files are only copied when their
+content differs, so the ``mtime`` of unchanged files in the target is
+preserved. The source tree is walked and hashed once regardless of the number of
+targets.
+
+Targets may also be populated with hard links to a single canonical copy of the
+source, or with reflinks (copy-on-write clones) on filesystems that support
+them, so that additional targets cost almost no I/O or disk space.
+"""
+
+import json
+import logging
+import os
+import re
+import shutil
+
+from giza.tools.files import (safe_create_directory, md5_file, hash_files,
+                              stat_signature)
+
+logger = logging.getLogger('giza.tools.sync')
+
+MANIFEST_VERSION = 1
+
+_patterns = {}
+
+
+def _compile_pattern(pattern):
+    """
+    Translates an rsync exclude pattern to a regular expression: ``*`` and
+    ``?`` do not match ``/``, while ``**`` does. A leading ``/`` anchors the
+    pattern at the root of the tree, and a trailing ``/`` is ignored.
+    """
+
+    if pattern in _patterns:
+        return _patterns[pattern]
+
+    anchored = pattern.startswith('/')
+    body = pattern.strip('/')
+
+    rx = []
+    idx = 0
+    while idx < len(body):
+        if body.startswith('**', idx):
+            rx.append('.*')
+            idx += 2
+        elif body[idx] == '*':
+            rx.append('[^/]*')
+            idx += 1
+        elif body[idx] == '?':
+            rx.append('[^/]')
+            idx += 1
+        elif body[idx] == '[' and ']' in body[idx + 1:]:
+            end = body.index(']', idx + 1)
+            chars = body[idx + 1:end].replace('\\', '\\\\')
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            rx.append('[' + chars + ']')
+            idx = end + 1
+        else:
+            rx.append(re.escape(body[idx]))
+            idx += 1
+
+    rx = ''.join(rx)
+
+    if anchored:
+        # matches the whole path from the root of the tree
+        rx = '^' + rx + '$'
+    else:
+        # matches the final components of the path: only the last one if the
+        # pattern has no "/" or "**"
+        rx = '(^|/)' + rx + '$'
+
+    _patterns[pattern] = re.compile(rx)
+
+    return _patterns[pattern]
+
+
+def is_excluded(fn, patterns):
+    """
+    :returns: ``True`` if ``fn``, a path relative to the root of the tree, or
+       any of its parent directories, is matched by any of the ``patterns``,
+       with the semantics of ``rsync --exclude``.
+    """
+
+    parts = fn.split('/')
+
+    for pattern in patterns:
+        rx = _compile_pattern(pattern)
+
+        for idx in range(1, len(parts) + 1):
+            if rx.search('/'.join(parts[:idx])) is not None:
+                return True
+
+    return False
+
+
+def is_redacted(fn, redactions):
+    """
+    :returns: ``True`` if ``fn`` is one of the ``redactions``, which are paths
+       relative to the root of the tree, or is in one of them.
+    """
+
+    for redaction in redactions:
+        if fn == redaction or fn.startswith(redaction + '/'):
+            return True
+
+    return False
+
+
+def scan_tree(path, exclusions):
+    """
+    :returns: a tuple of a dictionary mapping files in ``path`` (relative to
+       ``path``) to either ``'file'`` or ``'link'``, and a set of all
+       directories. Paths matched by ``exclusions`` are omitted.
+    """
+
+    files = {}
+    dirs = set()
+
+    for root, sub_folders, fns in os.walk(path):
+        rel_root = os.path.relpath(root, path)
+        if rel_root == '.':
+            rel_root = ''
+
+        for dirname in list(sub_folders):
+            rel_fn = os.path.join(rel_root, dirname)
+
+            if is_excluded(rel_fn, exclusions):
+                sub_folders.remove(dirname)
+            elif os.path.islink(os.path.join(root, dirname)):
+                sub_folders.remove(dirname)
+                files[rel_fn] = 'link'
+            else:
+                dirs.add(rel_fn)
+
+        for fn in fns:
+            rel_fn = os.path.join(rel_root, fn)
+
+            if is_excluded(rel_fn, exclusions):
+                continue
+            elif os.path.islink(os.path.join(root, fn)):
+                files[rel_fn] = 'link'
+            else:
+                files[rel_fn] = 'file'
+
+    return files, dirs
+
+
+def load_manifest(fn):
+    if fn is not None and os.path.isfile(fn):
+        with open(fn, 'r') as f:
+            try:
+                manifest = json.load(f)
+            except ValueError:
+                logger.warning('sync manifest {0} is corrupt, rehashing.'.format(fn))
+            else:
+                if manifest.get('version') == MANIFEST_VERSION:
+                    return manifest
+
+    return {'version': MANIFEST_VERSION, 'source': {}, 'targets': {}}
+
+
+def dump_manifest(manifest, fn):
+    safe_create_directory(os.path.dirname(fn))
+
+    tmp_fn = fn + '.tmp-' + str(os.getpid())
+    with open(tmp_fn, 'w') as f:
+        json.dump(manifest, f)
+
+    os.rename(tmp_fn, fn)
+
+
+def hash_source_files(source_dir, files, cache, pool_size=None):
+    """
+    Returns a mapping of every regular file in ``files`` to a list of its stat
+    signature and hash, reusing the hashes in ``cache`` for files whose stat
+    signature has not changed.
+    """
+
+    hashes = {}
+    to_hash = []
+
+    for fn, kind in files.items():
+        if kind != 'file':
+            continue
+
+        signature = stat_signature(os.path.join(source_dir, fn))
+        if fn in cache and cache[fn][0] == signature:
+            hashes[fn] = cache[fn]
+        else:
+            hashes[fn] = [signature, None]
+            to_hash.append(fn)
+
+    new_hashes = hash_files([os.path.join(source_dir, fn) for fn in to_hash], pool_size)
+    for fn in to_hash:
+        hashes[fn][1] = new_hashes[os.path.join(source_dir, fn)]
+
+    logger.debug('hashed {0} source files, {1} unchanged'.format(len(to_hash),
+                                                                 len(hashes) - len(to_hash)))
+
+    return hashes
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _reflink(source_fn, target_fn):
+    # FICLONE ioctl, from linux/fs.h. Raises IOError/OSError on filesystems
+    # without copy-on-write support, and ImportError where fcntl doesn't exist.
+    import fcntl
+
+    with open(source_fn, 'rb') as src:
+        with open(target_fn, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), 0x40049409, src.fileno())
+
+
+def _copy(source_fn, target_fn, mode='copy'):
+    """
+    Writes ``source_fn`` to ``target_fn`` by way of a temporary file in the same
+    directory and a rename, so that the target is never partially written, and
+    so that hard links to a previous version of the target are not modified.
+
+    :returns: the mode used, which is ``'copy'`` if the filesystem does not
+       support the requested ``'hardlink'`` or ``'reflink'`` mode.
+    """
+
+    dirname, basename = os.path.split(target_fn)
+    tmp_fn = os.path.join(dirname, '.' + basename + '.giza-sync')
+
+    if os.path.lexists(tmp_fn):
+        os.remove(tmp_fn)
+
+    try:
+        if mode == 'hardlink':
+            os.link(source_fn, tmp_fn)
+        elif mode == 'reflink':
+            _reflink(source_fn, tmp_fn)
+            shutil.copymode(source_fn, tmp_fn)
+    except (IOError, OSError, ImportError) as e:
+        logger.debug('cannot {0} {1}, copying instead: {2}'.format(mode, source_fn, e))
+        mode = 'copy'
+
+    if mode == 'copy':
+        shutil.copyfile(source_fn, tmp_fn)
+        shutil.copymode(source_fn, tmp_fn)
+
+    os.rename(tmp_fn, target_fn)
+
+    return mode
+
+
+def sync_target(source_dir, target, source_files, source_dirs, source_hashes,
+                target_cache, exclusions, redactions, mode='copy', link_source=None,
+                delete=True):
+    """
+    Brings ``target`` in line with ``source_dir``, given the result of
+    :func:`scan_tree()` and :func:`hash_source_files()` for the source. Files in
+    the target matched by ``exclusions`` are neither modified nor deleted;
+    files and directories in ``redactions`` are deleted from the target.
+
+    ``mode`` is one of ``'copy'``, ``'hardlink'`` or ``'reflink'``. In
+    ``'hardlink'`` mode, files in the target are hard links to the files in
+    ``link_source``, which must be a copy of ``source_dir``.
+
+    If ``delete`` is ``False``, files and directories in the target that are
+    not in the source remain in the target.
+
+    :returns: a tuple of a dictionary of counts of the ``copied``,
+       ``hardlinked``, ``linked`` (i.e. symbolic links), ``unchanged`` and
+       ``deleted`` files, and the new manifest for the target.
+    """
+
+    stats = {'copied': 0, 'hardlinked': 0, 'linked': 0, 'unchanged': 0, 'deleted': 0}
+    new_cache = {}
+
+    if mode == 'hardlink':
+        copy_source = link_source
+    else:
+        copy_source = source_dir
+
+    for fn in redactions:
+        if fn not in source_files and fn not in source_dirs:
+            logger.warning('cannot redact non-existing file: ' + os.path.join(source_dir, fn))
+
+    safe_create_directory(target)
+    target_files, target_dirs = scan_tree(target, exclusions)
+
+    for dirname in sorted(source_dirs):
+        if is_redacted(dirname, redactions):
+            continue
+
+        target_dir = os.path.join(target, dirname)
+        if os.path.lexists(target_dir) and not os.path.isdir(target_dir):
+            _remove(target_dir)
+            target_files.pop(dirname, None)
+
+        safe_create_directory(target_dir)
+
+    for fn, kind in source_files.items():
+        if is_redacted(fn, redactions):
+            continue
+
+        source_fn = os.path.join(copy_source, fn)
+        target_fn = os.path.join(target, fn)
+
+        if kind == 'link':
+            link = os.readlink(source_fn)
+            if target_files.get(fn) == 'link' and os.readlink(target_fn) == link:
+                stats['unchanged'] += 1
+            else:
+                _remove(target_fn)
+                os.symlink(link, target_fn)
+                stats['linked'] += 1
+            continue
+
+        signature, digest = source_hashes[fn]
+
+        if target_files.get(fn) == 'file':
+            target_signature = stat_signature(target_fn)
+
+            if mode == 'hardlink':
+                if os.path.samefile(source_fn, target_fn):
+                    new_cache[fn] = [target_signature, digest]
+                    stats['unchanged'] += 1
+                    continue
+            elif target_cache.get(fn) == [target_signature, digest]:
+                new_cache[fn] = target_cache[fn]
+                stats['unchanged'] += 1
+                continue
+            elif md5_file(target_fn) == digest:
+                new_cache[fn] = [target_signature, digest]
+                stats['unchanged'] += 1
+                continue
+        elif os.path.lexists(target_fn):
+            _remove(target_fn)
+
+        used_mode = _copy(source_fn, target_fn, mode)
+        new_cache[fn] = [stat_signature(target_fn), digest]
+
+        if used_mode == 'hardlink':
+            stats['hardlinked'] += 1
+        else:
+            stats['copied'] += 1
+
+            if mode != 'copy':
+                # the target is on a different device or the filesystem
+                # doesn't support hard links or reflinks: don't try for every
+                # file.
+                logger.warning('cannot {0} files into {1}, copying'.format(mode, target))
+                mode = 'copy'
+                copy_source = source_dir
+
+    for fn in target_files:
+        if is_redacted(fn, redactions) or (delete is True and fn not in source_files):
+            _remove(os.path.join(target, fn))
+            stats['deleted'] += 1
+
+    # remove directories that are no longer in the source, deepest first;
+    # directories that still hold excluded content are not empty and remain.
+    for dirname in sorted(target_dirs, key=len, reverse=True):
+        if is_redacted(dirname, redactions) or (delete is True and dirname not in source_dirs):
+            try:
+                os.rmdir(os.path.join(target, dirname))
+            except OSError:
+                pass
+
+    return stats, new_cache
+
+
+def sync_tree(source_dir, targets, exclusions=None, manifest_fn=None, pool_size=None,
+              mode='copy', canonical=None):
+    """
+    Synchronizes ``source_dir`` to every directory in ``targets``, which maps
+    target directories to lists of redactions (paths, relative to the root of
+    the tree, to remove from that target.) Walks and hashes the source tree
+    once for all targets.
+
+    :param list exclusions: patterns of files that are neither copied from the
+       source nor deleted from the targets.
+
+    :param string manifest_fn: path to the JSON manifest that stores hashes
+       between syncs. If ``None``, every file is hashed.
+
+    :param string mode: ``'copy'``, ``'hardlink'`` or ``'reflink'``. For
+       ``'hardlink'``, ``canonical`` is a directory that receives a copy of the
+       source, and files in the targets are hard links to this copy. Writing to
+       a file in a target in this mode requires
+       :func:`giza.tools.files.break_hardlink()`.
+
+    :returns: a dictionary mapping every target to the counts returned by
+       :func:`sync_target()`.
+    """
+
+    if exclusions is None:
+        exclusions = []
+
+    if mode not in ('copy', 'hardlink', 'reflink'):
+        raise TypeError('{0} is not a supported sync mode'.format(mode))
+    elif mode == 'hardlink' and canonical is None:
+        raise TypeError('hardlink sync requires a canonical copy of the source')
+
+    manifest = load_manifest(manifest_fn)
+
+    source_files, source_dirs = scan_tree(source_dir, exclusions)
+    source_hashes = hash_source_files(source_dir, source_files, manifest['source'], pool_size)
+    manifest['source'] = source_hashes
+
+    jobs = []
+    if mode == 'hardlink':
+        jobs.append((canonical, [], 'copy'))
+    jobs.extend((target, redactions, mode) for target, redactions in targets.items())
+
+    results = {}
+    for target, redactions, target_mode in jobs:
+        if redactions is None:
+            redactions = []
+
+        target_cache = manifest['targets'].get(target, {})
+        stats, manifest['targets'][target] = sync_target(source_dir, target,
+                                                         source_files, source_dirs,
+                                                         source_hashes, target_cache,
+                                                         exclusions, redactions,
+                                                         target_mode, canonical)
+        results[target] = stats
+
+        m = ('synced {0} to {1}: {2} copied, {3} hard links, {4} links, '
+             '{5} unchanged, {6} deleted')
+        logger.info(m.format(source_dir, target, stats['copied'], stats['hardlinked'],
+                             stats['linked'], stats['unchanged'], stats['deleted']))
+
+    if manifest_fn is not None:
+        dump_manifest(manifest, manifest_fn)
+
+    return results
@@ -12,11 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import io
 import logging
+import os
+import re
 
 import libgiza.task
 
-from giza.tools.files import copy_always, copy_if_needed
+from giza.tools.files import copy_always, copy_if_needed, break_hardlink
 
 logger = logging.getLogger('giza.transformation')
 
@@ -25,12 +28,73 @@ class ProcessingError(Exception):
     pass
 
 
+class Rewriter(object):
+    """
+    Applies a list of ``(regex, substitution)`` pairs to strings, in order, with
+    the same result as calling ``regex.sub()`` for each pair.
+
+    Rewriter also compiles all of the regular expressions into one alternation,
+    and tests each string against it once. Most lines of a page do not match
+    any expression, and are returned after a single scan rather than one scan
+    per expression. Strings that match apply every substitution in sequence,
+    because later substitutions operate on the output of earlier ones.
+    """
+
+    backreference = re.compile(r'\\[1-9]|\(\?P=')
+
+    def __init__(self, regexes):
+        if isinstance(regexes, tuple):
+            regexes = [regexes]
+
+        self.regexes = []
+        for regex, subst in regexes:
+            if not hasattr(regex, 'sub'):
+                regex = re.compile(regex)
+
+            self.regexes.append((regex, subst))
+
+        self.scanner = self._compile_scanner()
+
+    def _compile_scanner(self):
+        if len(self.regexes) <= 1:
+            return None
+
+        # patterns can only share a scanner if they have the same flags and
+        # don't refer to their own groups by number or name.
+        flags = set(regex.flags for regex, _ in self.regexes)
+        if len(flags) != 1:
+            return None
+
+        for regex, _ in self.regexes:
+            if self.backreference.search(regex.pattern) is not None:
+                return None
+
+        patterns = ['(?:{0})'.format(regex.pattern) for regex, _ in self.regexes]
+
+        try:
+            return re.compile('|'.join(patterns), flags.pop())
+        except (re.error, TypeError):
+            return None
+
+    def sub(self, content):
+        if self.scanner is not None and self.scanner.search(content) is None:
+            return content
+
+        for cregex, subst in self.regexes:
+            content = cregex.sub(subst, content)
+
+        return content
+
+    __call__ = sub
+
+
 def decode_lines_from_file(fn):
     with open(fn, 'r') as f:
         return [line.decode('utf-8').rstrip() for line in f.readlines()]
 
 
 def encode_lines_to_file(fn, lines):
+    break_hardlink(fn)
     with open(fn, 'w') as f:
         f.write('\n'.join(lines).encode('utf-8'))
         f.write('\n')
@@ -40,17 +104,31 @@ def munge_page(fn, regex, out_fn=None,  tag='build'):
     if out_fn is None:
         out_fn = fn
 
-    page_lines = [munge_content(ln, regex) for ln in decode_lines_from_file(fn)
-                  if ln is not None]
-
-    if len(page_lines) > 0:
-        encode_lines_to_file(out_fn, page_lines)
+    if not isinstance(regex, Rewriter):
+        regex = Rewriter(regex)
+
+    # stream the page through the rewriter, rather than holding all lines in
+    # memory; the rename also replaces hard links to the output file.
+    tmp_fn = out_fn + '.munge'
+    count = 0
+    with io.open(fn, 'r', encoding='utf-8') as source:
+        with io.open(tmp_fn, 'w', encoding='utf-8') as target:
+            for ln in source:
+                target.write(regex.sub(ln.rstrip()))
+                target.write(u'\n')
+                count += 1
+
+    if count > 0:
+        os.rename(tmp_fn, out_fn)
     else:
+        os.remove(tmp_fn)
         logger.warning('{0}: did not write {1}'.format(tag, out_fn))
 
 
 def munge_content(content, regex):
-    if isinstance(regex, list):
+    if isinstance(regex, Rewriter):
+        return regex.sub(content)
+    elif isinstance(regex, list):
         for cregex, subst in regex:
             content = cregex.sub(subst, content)
         return content
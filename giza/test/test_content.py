@@ -1,6 +1,7 @@
 from nose.tools import nottest, istest
 
 import os
+import re
 
 # this runs tests of the inheritance.py baseclasses, as is.
 from libgiza.test.test_inheritance import (TestDataCache, TestDataContentBase,
@@ -17,6 +18,7 @@ import libgiza.git
 
 import giza.inheritance
 import giza.config.git
+import giza.tools.transformation
 
 import giza.content.steps.inheritance
 import giza.content.steps.models
@@ -332,3 +334,51 @@ class TestExamplesInheritedContentResolution(GizaInheritedContentResolutionBase)
         self.short_name = 'examples'
         self.len_source_docs = 9
         self.num_docs = 2
+
+
+# Rewriter
+
+@istest
+class TestRewriter(object):
+    regexes = [
+        (re.compile(r'(index|bfcode)\{(.*)--(.*)\}'), r'\1\{\2-\{-\}\3\}'),
+        (re.compile(r'\\PYGZsq{}'), "'"),
+        (re.compile(r'\\code\{/(?!.*{}/|etc|usr|data|var|srv|data|bin|dev|opt|proc|24|private)'),
+         r'\\code{http://docs.example.net/manual/'),
+        (re.compile(r'<[^>]*>'), ''),
+        (re.compile(r'&gt;'), '>'),
+    ]
+
+    lines = [
+        'no substitutions in this line',
+        r'\index{mongod--config} and \code{/reference/method}',
+        r'\code{/etc/mongod.conf} \PYGZsq{}quoted\PYGZsq{}',
+        '<a class="headerlink">&gt;</a> <b>bold</b>',
+        '',
+    ]
+
+    def sequential(self, regexes, line):
+        for regex, subst in regexes:
+            line = regex.sub(subst, line)
+        return line
+
+    def test_matches_sequential_substitution(self):
+        rewriter = giza.tools.transformation.Rewriter(self.regexes)
+        assert rewriter.scanner is not None
+
+        for line in self.lines:
+            assert rewriter.sub(line) == self.sequential(self.regexes, line)
+
+    def test_order_of_substitutions(self):
+        regexes = [(re.compile('a'), 'b'), (re.compile('b'), 'c')]
+        rewriter = giza.tools.transformation.Rewriter(regexes)
+
+        assert rewriter.sub('a') == 'c'
+        assert rewriter.sub('x') == 'x'
+
+    def test_backreferences_are_not_fused(self):
+        regexes = [(re.compile(r'(a)\1'), 'b'), (re.compile('c'), 'd')]
+        rewriter = giza.tools.transformation.Rewriter(regexes)
+
+        assert rewriter.scanner is None
+        assert rewriter.sub('aac') == 'bd'
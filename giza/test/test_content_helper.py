@@ -0,0 +1,64 @@
+from nose.tools import istest
+
+import os
+import shutil
+import tempfile
+
+from rstcloth.rstcloth import RstCloth
+from rstcloth.table import TableData, ListTable, TableBuilder
+
+import giza.content.helper
+
+
+@istest
+class TestWriteContent(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_rstcloth(self):
+        r = RstCloth()
+        r.title('Title')
+        r.newline()
+        r.content('a paragraph of text, with enough words to wrap '
+                  'onto the next line of the document.', wrap=True)
+        r.newline()
+        r.directive('note', content='a note')
+
+        return r
+
+    def get_table(self):
+        table = TableData()
+        table.add_header(['one', 'two'])
+        table.add_row(['a', 'b'])
+        table.add_row(['c', 'd'])
+
+        return TableBuilder(ListTable(table))
+
+    def assert_matches_write(self, content):
+        old_fn = os.path.join(self.tmpdir, 'old.rst')
+        new_fn = os.path.join(self.tmpdir, 'sub', 'new.rst')
+
+        content.write(old_fn)
+        assert giza.content.helper.write_content(content, new_fn) is True
+
+        with open(old_fn, 'rb') as f:
+            old = f.read()
+        with open(new_fn, 'rb') as f:
+            new = f.read()
+
+        assert old == new
+
+        # writing the same content again leaves the file alone.
+        os.utime(new_fn, (1, 1))
+        assert giza.content.helper.write_content(content, new_fn) is False
+        assert os.stat(new_fn).st_mtime == 1
+        assert os.listdir(os.path.dirname(new_fn)) == ['new.rst']
+
+    def test_rstcloth_output_matches_write(self):
+        self.assert_matches_write(self.get_rstcloth())
+
+    def test_table_output_matches_write(self):
+        self.assert_matches_write(self.get_table())
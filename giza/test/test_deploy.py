@@ -0,0 +1,177 @@
+from nose.tools import istest
+
+import os
+import shutil
+import tempfile
+
+from giza.config.deploy import DeployConfig
+from giza.config.runtime import RuntimeStateConfig
+from giza.deploy import Deploy, deploy_hosts
+from giza.tools.sync import load_manifest, dump_manifest
+
+
+class Attributes(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def read_tree(path):
+    tree = {}
+
+    for root, _, fns in os.walk(path):
+        for fn in fns:
+            full_fn = os.path.join(root, fn)
+            with open(full_fn, 'r') as f:
+                tree[os.path.relpath(full_fn, path)] = f.read()
+
+    return tree
+
+
+@istest
+class TestDeploy(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.output = os.path.join(self.tmpdir, 'build')
+        self.hosts = [os.path.join(self.tmpdir, 'web1'), os.path.join(self.tmpdir, 'web2')]
+
+        self.conf = Attributes(
+            paths=Attributes(output=self.output,
+                             deploy_manifests=os.path.join(self.tmpdir, 'manifests')),
+            git=Attributes(branches=Attributes(current='master')),
+            deploy=DeployConfig({'testing': {'hosts': self.hosts + ['docs.example.net']}}),
+            runstate=RuntimeStateConfig())
+        self.conf.runstate.pool_size = 2
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_deploy(self, options, hosts=None):
+        self.conf.deploy.testing.hosts = hosts or self.hosts
+
+        d = Deploy(self.conf)
+        d.load({'target': 'public',
+                'env': 'testing',
+                'options': options,
+                'paths': {'local': 'public', 'remote': '/srv/docs', 'static': ['robots.txt']}})
+
+        return d
+
+    def write(self, fn, content):
+        fn = os.path.join(self.output, 'public', fn)
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+
+        with open(fn, 'w') as f:
+            f.write(content)
+
+    def remote_tree(self, host, branch=None):
+        path = os.path.join(host, 'srv', 'docs')
+        if branch is not None:
+            path = os.path.join(path, branch)
+
+        return read_tree(path)
+
+    def test_deploy_and_redeploy_with_delete(self):
+        self.write('index.html', 'index')
+        self.write('a/b.html', 'b')
+        self.write('robots.txt', 'robots')
+
+        report = deploy_hosts(self.get_deploy(['delete']))
+
+        assert sorted(report) == self.hosts
+        for host in self.hosts:
+            assert report[host]['returncode'] == 0
+            assert report[host]['files'] == 3
+            assert self.remote_tree(host) == read_tree(os.path.join(self.output, 'public'))
+
+        assert os.path.isfile(os.path.join(self.tmpdir, 'manifests', 'public.json'))
+
+        self.write('index.html', 'new index')
+        self.write('c.html', 'c')
+        shutil.rmtree(os.path.join(self.output, 'public', 'a'))
+
+        report = deploy_hosts(self.get_deploy(['delete']))
+
+        for host in self.hosts:
+            assert report[host]['files'] == 3
+            assert self.remote_tree(host) == {'index.html': 'new index', 'c.html': 'c',
+                                              'robots.txt': 'robots'}
+            assert not os.path.exists(os.path.join(host, 'srv', 'docs', 'a'))
+
+        # files that changed on the host, but not locally, are sent again.
+        os.remove(os.path.join(self.hosts[0], 'srv', 'docs', 'c.html'))
+        with open(os.path.join(self.hosts[1], 'srv', 'docs', 'index.html'), 'w') as f:
+            f.write('edited on the host')
+
+        report = deploy_hosts(self.get_deploy(['delete']))
+
+        for host in self.hosts:
+            assert report[host]['files'] == 1
+            assert self.remote_tree(host) == {'index.html': 'new index', 'c.html': 'c',
+                                              'robots.txt': 'robots'}
+
+    def test_redeploy_without_delete(self):
+        self.write('index.html', 'index')
+        self.write('a/b.html', 'b')
+
+        deploy_hosts(self.get_deploy([]))
+
+        self.write('index.html', 'new index')
+        shutil.rmtree(os.path.join(self.output, 'public', 'a'))
+
+        report = deploy_hosts(self.get_deploy([]))
+
+        for host in self.hosts:
+            assert report[host]['files'] == 1
+            assert self.remote_tree(host) == {'index.html': 'new index', 'a/b.html': 'b'}
+
+    def test_branched_targets(self):
+        self.write('master/index.html', 'master')
+        self.write('v1.0/index.html', 'v1.0')
+
+        deploy_hosts(self.get_deploy(['branched', 'delete']))
+
+        self.conf.git.branches.current = 'v1.0'
+        deploy_hosts(self.get_deploy(['branched', 'delete']))
+
+        for host in self.hosts:
+            assert self.remote_tree(host, 'master') == {'index.html': 'master'}
+            assert self.remote_tree(host, 'v1.0') == {'index.html': 'v1.0'}
+
+        manifests = os.path.join(self.tmpdir, 'manifests')
+        assert sorted(os.listdir(manifests)) == ['public-master.json', 'public-v1.0.json']
+
+        # each branch has its own record of the hosts, so a change on one
+        # branch is deployed whatever the other branch did since.
+        self.write('v1.0/index.html', 'v1.0.1')
+        self.conf.git.branches.current = 'master'
+        deploy_hosts(self.get_deploy(['branched', 'delete']))
+
+        self.conf.git.branches.current = 'v1.0'
+        report = deploy_hosts(self.get_deploy(['branched', 'delete']))
+
+        for host in self.hosts:
+            assert report[host]['files'] == 1
+            assert self.remote_tree(host, 'v1.0') == {'index.html': 'v1.0.1'}
+
+    def test_remote_hosts_use_checksums_only_for_the_first_deploy(self):
+        self.write('index.html', 'index')
+        self.write('robots.txt', 'robots')
+
+        d = self.get_deploy(['delete'], hosts=['docs.example.net'])
+
+        cmds = list(d.deploy_commands())
+        assert [cmd[:3] for cmd in cmds] == [['rsync', '-cltz', '--stats']] * 2
+        assert cmds[0][-2:] == [d.local_dir + '/', 'docs.example.net:/srv/docs']
+        assert '--delete' in cmds[0]
+
+        manifest = load_manifest(d.manifest_fn)
+        manifest['targets']['docs.example.net'] = {'deployed': 0}
+        dump_manifest(manifest, d.manifest_fn)
+
+        cmds = list(d.deploy_commands())
+        assert [cmd[:3] for cmd in cmds] == [['rsync', '-ltz', '--stats']] * 2
+        assert cmds[0][-2:] == [d.local_dir + '/', 'docs.example.net:/srv/docs']
+
+        self.conf.runstate.force = True
+        assert list(d.deploy_commands())[0][:2] == ['rsync', '-cltz']
@@ -0,0 +1,133 @@
+from nose.tools import istest
+
+import os
+import shutil
+import tempfile
+
+from giza.config.main import Configuration
+from giza.config.runtime import RuntimeStateConfig
+
+import giza.config.git
+
+from giza.content.extract.inheritance import ExtractDataCache
+from giza.content.extract.tasks import register_extracts
+from giza.inheritance import ContentCache
+
+
+class RecordingDataCache(ExtractDataCache):
+    parsed = None
+
+    def parse_file(self, fn):
+        self.parsed.append(os.path.basename(fn))
+        super(RecordingDataCache, self).parse_file(fn)
+
+    def ingest(self, files):
+        self.parsed = []
+        super(RecordingDataCache, self).ingest(files)
+
+
+@istest
+class TestContentCache(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.conf = self.get_conf()
+
+        self.write('base', 'ref: base\ntitle: Base\ncontent: base text\n')
+        self.write('middle', 'ref: middle\ninherit:\n  file: extracts-base.yaml\n  ref: base\n')
+        self.write('top', 'ref: top\ninherit:\n  file: extracts-middle.yaml\n  ref: middle\n')
+        self.write('other', 'ref: other\ntitle: Other\ncontent: other text\n')
+
+        self.fns = [self.get_fn(name) for name in ('base', 'middle', 'top', 'other')]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_conf(self, edition=None):
+        conf = Configuration()
+        conf.runstate = RuntimeStateConfig()
+        conf.project = {'name': 'test',
+                        'editions': [{'name': 'saas'}, {'name': 'hosted'}]}
+        if edition is not None:
+            conf.project.edition = edition
+
+        conf.state['git'] = giza.config.git.GitConfig({}, conf, os.getcwd())
+        conf.paths = {'includes': self.tmpdir,
+                      'source': self.tmpdir,
+                      'projectroot': self.tmpdir,
+                      'output': self.tmpdir}
+        conf.system.content_cache = os.path.join(self.tmpdir, 'content-cache')
+        register_extracts(conf)
+
+        return conf
+
+    def get_fn(self, name):
+        return os.path.join(self.tmpdir, 'extracts-' + name + '.yaml')
+
+    def write(self, name, content):
+        with open(self.get_fn(name), 'w') as f:
+            f.write(content)
+
+    def load(self, fns=None, conf=None):
+        return RecordingDataCache(fns or self.fns, conf or self.conf)
+
+    def test_warm_load_does_not_parse(self):
+        data = self.load()
+        assert sorted(data.parsed) == ['extracts-base.yaml', 'extracts-middle.yaml',
+                                       'extracts-other.yaml', 'extracts-top.yaml']
+
+        data = self.load()
+        assert data.parsed == []
+        assert data.cache[self.get_fn('top')].fetch('top').content == 'base text'
+
+    def test_changed_inherited_file_invalidates_dependents(self):
+        self.load()
+
+        self.write('base', 'ref: base\ntitle: Base\ncontent: new base text\n')
+        data = self.load()
+
+        # top inherits from base through middle.
+        assert sorted(data.parsed) == ['extracts-base.yaml', 'extracts-middle.yaml',
+                                       'extracts-top.yaml']
+        assert data.cache[self.get_fn('top')].fetch('top').content == 'new base text'
+
+        self.write('top', 'ref: top\ntitle: Top\ncontent: top text\n')
+        data = self.load()
+
+        assert data.parsed == ['extracts-top.yaml']
+        assert data.cache[self.get_fn('top')].fetch('top').content == 'top text'
+
+    def test_settings_depend_on_the_edition(self):
+        data = self.load()
+        settings = ContentCache(data._content_cache.fn, data, self.conf).settings
+
+        assert ContentCache(data._content_cache.fn, data, self.get_conf()).settings == settings
+        editions = [ContentCache(data._content_cache.fn, data,
+                                 self.get_conf(edition=edition)).settings
+                    for edition in ('saas', 'hosted')]
+        assert len(set([settings] + editions)) == 3
+
+        data = self.load(conf=self.get_conf(edition='saas'))
+        assert len(data.parsed) == 4
+
+    def test_prune_removes_unused_entries_and_files(self):
+        self.load()
+
+        data = self.load(fns=[self.get_fn('base'), self.get_fn('other')])
+        assert data.parsed == []
+
+        content_cache = ContentCache(data._content_cache.fn, data, self.conf)
+        assert sorted(content_cache.entries) == [self.get_fn('base'), self.get_fn('other')]
+        assert sorted(content_cache.files) == [self.get_fn('base'), self.get_fn('other')]
+
+    def test_corrupt_cache_is_ignored(self):
+        data = self.load()
+
+        with open(data._content_cache.fn, 'wb') as f:
+            f.write(b'not a content cache')
+
+        data = self.load()
+        assert len(data.parsed) == 4
+        assert data.cache[self.get_fn('top')].fetch('top').content == 'base text'
+
+        # the cache is written again.
+        assert self.load().parsed == []
@@ -0,0 +1,115 @@
+from nose.tools import istest
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+from giza.content.post.json_output import process_json_output
+from giza.tools.transformation import Rewriter
+
+
+class Attributes(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def read_tree(path):
+    return sorted(os.path.relpath(os.path.join(root, fn), path)
+                  for root, _, fns in os.walk(path) for fn in fns)
+
+
+@istest
+class TestProcessJsonOutput(object):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+
+        self.json_dir = os.path.join('build', 'master', 'json')
+        self.list_file = os.path.join('build', 'master', 'json-file-list')
+        self.conf = Attributes(paths=Attributes(projectroot=self.tmpdir,
+                                                branch_source=os.path.join('build', 'master',
+                                                                           'source')),
+                               project=Attributes(url='http://docs.example.net', basepath='',
+                                                  branched=False),
+                               runstate=Attributes(pool_size=1))
+
+        for docname in ('index', 'a/b'):
+            self.add_document(docname)
+
+        # pages and files of the builder without a source document
+        for fn in ('genindex.fjson', 'globalcontext.json', '_static/data.json'):
+            self.write(os.path.join(self.json_dir, fn), '{}')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, fn, content):
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+
+        with open(fn, 'w') as f:
+            f.write(content)
+
+    def add_document(self, docname):
+        self.write(os.path.join(self.conf.paths.branch_source, docname + '.txt'), docname)
+        self.write(os.path.join(self.json_dir, docname + '.fjson'),
+                   json.dumps({'current_page_name': docname}))
+
+    def process(self):
+        process_json_output(self.json_dir, self.list_file, Rewriter([]), self.conf)
+
+    def read_delta(self):
+        with gzip.open(os.path.join(self.json_dir, 'search-index-delta.ndjson.gz'), 'rb') as f:
+            return [json.loads(line.decode('utf-8')) for line in f]
+
+    def test_only_current_documents_are_processed(self):
+        # the output of a document removed before the first run
+        self.write(os.path.join(self.json_dir, 'old.fjson'), '{}')
+        self.write(os.path.join(self.json_dir, 'old.json'), '{}')
+
+        self.process()
+
+        assert read_tree(self.json_dir) == ['_static/data.json', 'a/b.fjson', 'a/b.json',
+                                            'genindex.fjson', 'globalcontext.json',
+                                            'index.fjson', 'index.json',
+                                            'search-index-delta.ndjson.gz',
+                                            'search-index-urls.json',
+                                            'search-index.ndjson.gz']
+
+        with open(self.list_file, 'r') as f:
+            assert f.read().split() == ['http://docs.example.net/json/a/b.json',
+                                        'http://docs.example.net/json/index.json']
+
+    def test_removed_documents_are_removed_from_the_output(self):
+        self.process()
+
+        # sphinx leaves the fjson file of a removed document in place.
+        os.remove(os.path.join(self.conf.paths.branch_source, 'a', 'b.txt'))
+        self.add_document('c')
+        self.process()
+
+        assert not os.path.exists(os.path.join(self.json_dir, 'a', 'b.fjson'))
+        assert not os.path.exists(os.path.join(self.json_dir, 'a', 'b.json'))
+        assert os.path.isfile(os.path.join(self.json_dir, 'c.json'))
+
+        delta = sorted((doc['action'], doc['url']) for doc in self.read_delta())
+        assert delta == [('delete', 'http://docs.example.net/a/b/'),
+                         ('index', 'http://docs.example.net/c/')]
+
+    def test_removed_documents_are_deleted_from_the_index_without_a_manifest(self):
+        self.process()
+
+        os.remove(self.json_dir + '-manifest.json')
+        os.remove(os.path.join(self.conf.paths.branch_source, 'a', 'b.txt'))
+        self.process()
+
+        delta = [(doc['action'], doc['url']) for doc in self.read_delta()]
+        assert ('delete', 'http://docs.example.net/a/b/') in delta
+
+        # a build without changes has an empty delta
+        self.process()
+        assert self.read_delta() == []
@@ -0,0 +1,42 @@
+from nose.tools import istest
+
+import os
+import shutil
+import tempfile
+
+from giza.content.post.latex import _cache_pdf
+
+
+@istest
+class TestPdfCache(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.pdf_fn = os.path.join(self.tmpdir, 'manual.pdf')
+
+        with open(self.pdf_fn, 'w') as f:
+            f.write('%PDF')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def cache(self, name, output_format, digest):
+        cache_fn = os.path.join(self.cache_dir, '-'.join((name, output_format, digest)) + '.pdf')
+        _cache_pdf(self.pdf_fn, self.cache_dir, cache_fn)
+
+    def test_formats_do_not_evict_each_other(self):
+        self.cache('manual', 'pdf', 'a' * 32)
+        self.cache('manual', 'dvi', 'b' * 32)
+        self.cache('manual-guide', 'pdf', 'c' * 32)
+
+        assert sorted(os.listdir(self.cache_dir)) == ['manual-dvi-' + 'b' * 32 + '.pdf',
+                                                      'manual-guide-pdf-' + 'c' * 32 + '.pdf',
+                                                      'manual-pdf-' + 'a' * 32 + '.pdf']
+
+    def test_new_versions_replace_old_ones(self):
+        self.cache('manual', 'pdf', 'a' * 32)
+        self.cache('manual', 'dvi', 'b' * 32)
+        self.cache('manual', 'pdf', 'd' * 32)
+
+        assert sorted(os.listdir(self.cache_dir)) == ['manual-dvi-' + 'b' * 32 + '.pdf',
+                                                      'manual-pdf-' + 'd' * 32 + '.pdf']
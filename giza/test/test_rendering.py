@@ -0,0 +1,76 @@
+from nose.tools import istest
+
+import os
+import shutil
+import tempfile
+import time
+
+from libgiza.task import Task
+
+from giza.content.rendering import render_content_tasks
+from giza.tools.files import replace_if_changed
+
+
+@istest
+class TestRenderContentTasks(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.stamp_dir = os.path.join(self.tmpdir, 'stamps')
+        self.source = os.path.join(self.tmpdir, 'source.yaml')
+        self.target = os.path.join(self.tmpdir, 'target.rst')
+        self.runs = []
+
+        with open(self.source, 'w') as f:
+            f.write('source')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def render(self, content):
+        self.runs.append(content)
+
+        tmp_fn = self.target + '.tmp'
+        with open(tmp_fn, 'w') as f:
+            f.write(content)
+
+        replace_if_changed(tmp_fn, self.target)
+
+    def get_tasks(self):
+        return [Task(job=self.render, args=['output'], target=self.target,
+                     dependency=self.source)]
+
+    def run(self, stamp_dir=None):
+        return render_content_tasks(self.get_tasks(), 1, stamp_dir=stamp_dir)
+
+    def test_unchanged_output_is_not_rendered_again(self):
+        assert self.run(self.stamp_dir) == 1
+
+        for fn in [self.target] + [os.path.join(self.stamp_dir, stamp)
+                                   for stamp in os.listdir(self.stamp_dir)]:
+            os.utime(fn, (1000, 1000))
+        os.utime(self.source, (2000, 2000))
+
+        # the output is the same, so the target keeps its mtime.
+        assert self.run(self.stamp_dir) == 1
+        assert os.stat(self.target).st_mtime == 1000
+
+        assert self.run(self.stamp_dir) == 0
+        assert len(self.runs) == 2
+
+        # a change to the source renders the target again.
+        os.utime(self.source, (time.time() + 10, time.time() + 10))
+        assert self.run(self.stamp_dir) == 1
+
+    def test_without_stamps(self):
+        self.run()
+        os.utime(self.target, (1000, 1000))
+
+        assert self.run() == 1
+        assert self.run() == 1
+
+    def test_removed_target_is_rendered_again(self):
+        self.run(self.stamp_dir)
+        os.remove(self.target)
+
+        assert self.run(self.stamp_dir) == 1
+        assert os.path.isfile(self.target)
@@ -0,0 +1,102 @@
+from nose.tools import istest
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+import giza.content.post.sitemap
+from giza.content.post.sitemap import generate_sitemap, get_stale_shards
+
+
+@istest
+class TestGenerateSitemap(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.build_output = os.path.join(self.tmpdir, 'dirhtml')
+        self.public = os.path.join(self.tmpdir, 'public')
+        self.store_into = os.path.join(self.tmpdir, 'sitemap.xml.gz')
+        self.config_fn = os.path.join(self.tmpdir, 'conf-sitemap.xml')
+
+        with open(self.config_fn, 'w') as f:
+            f.write('<site base_url="http://docs.example.net/" store_into="{0}">'
+                    '<directory url="http://docs.example.net/manual/"/>'
+                    '</site>'.format(self.store_into))
+
+        self.limit = giza.content.post.sitemap.SITEMAP_URL_LIMIT
+        self.target_size = giza.content.post.sitemap.SHARD_TARGET_SIZE
+        giza.content.post.sitemap.SITEMAP_URL_LIMIT = 6
+        giza.content.post.sitemap.SHARD_TARGET_SIZE = 3
+
+    def tearDown(self):
+        giza.content.post.sitemap.SITEMAP_URL_LIMIT = self.limit
+        giza.content.post.sitemap.SHARD_TARGET_SIZE = self.target_size
+        shutil.rmtree(self.tmpdir)
+
+    def build(self, docnames):
+        shutil.rmtree(self.build_output, ignore_errors=True)
+
+        for docname in docnames:
+            path = os.path.join(self.build_output, docname.rsplit('index', 1)[0]
+                                if docname.endswith('index') else docname)
+            os.makedirs(path)
+            with open(os.path.join(path, 'index.html'), 'w') as f:
+                f.write(docname)
+
+        with open(os.path.join(self.build_output, 'searchindex.js'), 'w') as f:
+            f.write('Search.setIndex({filenames:' + json.dumps(docnames) + ',titles:[]})')
+
+    def read_urls(self, fns):
+        urls = []
+        for fn in fns:
+            with gzip.open(fn, 'rb') as f:
+                content = f.read().decode('utf-8')
+
+            urls.extend(line.strip()[5:-6] for line in content.split('\n')
+                        if line.strip().startswith('<loc>'))
+
+        return sorted(urls)
+
+    def test_single_sitemap(self):
+        self.build(['index', 'a'])
+
+        assert generate_sitemap(self.config_fn, self.build_output) == [self.store_into]
+        assert self.read_urls([self.store_into]) == ['http://docs.example.net/manual/',
+                                                     'http://docs.example.net/manual/a/']
+
+    def test_only_changed_shards_are_written(self):
+        docnames = ['index'] + ['page{0}'.format(idx) for idx in range(7)]
+        self.build(docnames)
+
+        fns = generate_sitemap(self.config_fn, self.build_output)
+        shard_fns = fns[1:]
+
+        assert fns[0] == self.store_into
+        assert len(shard_fns) == 3
+        assert len(self.read_urls(shard_fns)) == 8
+
+        for fn in shard_fns:
+            os.utime(fn, (1000, 1000))
+
+        self.build(docnames + ['page7'])
+        assert generate_sitemap(self.config_fn, self.build_output) == fns
+        assert len(self.read_urls(shard_fns)) == 9
+
+        # only the shard of the new page is written again
+        assert sum(1 for fn in shard_fns if os.stat(fn).st_mtime != 1000) == 1
+
+    def test_stale_shards(self):
+        os.makedirs(self.public)
+        for fn in ('sitemap.xml.gz', 'sitemap-0.xml.gz', 'sitemap-1.xml.gz',
+                   'sitemap-2.xml.gz', 'sitemap-a.xml.gz', 'sitemap-3.xml'):
+            with open(os.path.join(self.public, fn), 'w') as f:
+                f.write(fn)
+
+        fns = [self.store_into, os.path.join(self.tmpdir, 'sitemap-0.xml.gz'),
+               os.path.join(self.tmpdir, 'sitemap-1.xml.gz')]
+
+        assert get_stale_shards(self.public, fns) == [os.path.join(self.public,
+                                                                   'sitemap-2.xml.gz')]
+        assert get_stale_shards(self.public, [self.store_into]) == [
+            os.path.join(self.public, 'sitemap-{0}.xml.gz'.format(idx)) for idx in range(3)]
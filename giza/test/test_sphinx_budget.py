@@ -0,0 +1,36 @@
+from nose.tools import istest
+
+from giza.content.sphinx_budget import SphinxBudget
+
+
+@istest
+class TestSphinxBudget(object):
+    def test_cores_are_shared_by_weight(self):
+        budget = SphinxBudget(8, {'html': 30.0, 'latex': 10.0})
+        budget.add('html')
+        budget.add('latex')
+
+        assert budget.acquire('html') == 6
+        assert budget.acquire('latex') == 2
+
+        budget.release('html', 25.0)
+        assert budget.durations() == {'html': 25.0}
+
+    def test_released_cores_go_to_later_builders(self):
+        budget = SphinxBudget(8, {})
+        budget.add('html')
+        budget.add('dirhtml')
+
+        assert budget.acquire('html') == 4
+        budget.release('html', 1.0)
+
+        assert budget.acquire('dirhtml') == 8
+
+    def test_limit(self):
+        budget = SphinxBudget(8, {})
+        budget.add('html')
+        budget.add('dirhtml')
+
+        # a builder that can only use one core leaves the rest to the others
+        assert budget.acquire('html', limit=1) == 1
+        assert budget.acquire('dirhtml') == 7
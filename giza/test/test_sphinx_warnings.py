@@ -0,0 +1,57 @@
+from nose.tools import istest
+
+import os
+import shutil
+import tempfile
+
+from giza.content.sphinx_warnings import WarningStore, print_warnings_diff
+
+
+class Attributes(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+@istest
+class TestWarningStore(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, 'warnings.db')
+        self.store = WarningStore(self.db_path, builds_to_keep=2)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tmpdir)
+
+    def record(self, messages, builder='html', edition=None):
+        return self.store.record('master', builder, edition, None, 'abcdef', 0, messages)
+
+    def test_first_build_has_no_baseline(self):
+        build_id = self.record(['a.txt:1: WARNING: one'])
+
+        assert self.store.diff(build_id) is None
+
+    def test_diff_against_previous_build_of_the_same_builder(self):
+        self.record(['a.txt:1: WARNING: one', 'b.txt:2: WARNING: two'])
+        self.record(['c.txt:3: WARNING: other builder'], builder='dirhtml')
+        build_id = self.record(['b.txt:2: WARNING: two', 'c.txt:3: WARNING: three'])
+
+        assert self.store.diff(build_id) == (['c.txt:3: WARNING: three'],
+                                             ['a.txt:1: WARNING: one'])
+
+    def test_old_builds_are_pruned(self):
+        first = self.record(['one'])
+        self.record(['two'])
+        third = self.record(['three'])
+
+        assert self.store.build(first) is None
+        assert self.store.diff(third) == (['three'], ['two'])
+
+    def test_only_new_warnings_with_a_baseline_count(self):
+        conf = Attributes(paths=Attributes(sphinx_warnings_database=self.db_path))
+
+        first = self.record(['one', 'two'])
+        assert print_warnings_diff([first], conf) == 0
+
+        second = self.record(['two', 'three', 'four'])
+        assert print_warnings_diff([second], conf) == 2
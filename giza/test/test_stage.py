@@ -0,0 +1,428 @@
+from nose.tools import istest
+
+import binascii
+import collections
+import errno
+import gzip
+import hashlib
+import os
+import shutil
+import socket
+import tempfile
+
+import boto.exception
+
+import giza.operations.stage
+
+FakeKey = collections.namedtuple('FakeKey', ['key'])
+FakeDeleteResult = collections.namedtuple('FakeDeleteResult', ['errors'])
+FakePart = collections.namedtuple('FakePart', ['part_number', 'size'])
+
+
+class FakeBucket(object):
+    """Stands in for a boto bucket in the listing and deletion calls."""
+    def __init__(self, name, keys=()):
+        self.name = name
+        self.keys = list(keys)
+        self.n_listed = 0
+        self.deleted = []
+        self.contents = {}
+        self.uploads = {}
+        self.failing_part = None
+
+    def list(self, prefix=''):
+        self.n_listed += 1
+        return [FakeKey(key) for key in self.keys if key.startswith(prefix)]
+
+    def delete_keys(self, keys):
+        self.deleted.append(keys)
+        return FakeDeleteResult([key for key in keys if key.endswith('bad')])
+
+    def initiate_multipart_upload(self, key_name, headers=None, **kwargs):
+        mp = FakeMultiPartUpload(self)
+        mp.key_name = key_name
+        mp.id = 'upload-{0}'.format(len(self.uploads))
+        self.uploads[mp.id] = {}
+
+        return mp
+
+
+class FakeMultiPartUpload(object):
+    """Stands in for boto's MultiPartUpload, keeping the parts in the
+       uploads of a FakeBucket."""
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.key_name = None
+        self.id = None
+
+    def __iter__(self):
+        if self.id not in self.bucket.uploads:
+            raise boto.exception.S3ResponseError(404, 'Not Found')
+
+        parts = self.bucket.uploads[self.id]
+        return iter([FakePart(part_num, len(parts[part_num])) for part_num in sorted(parts)])
+
+    def upload_part_from_file(self, fp, part_num, size):
+        if part_num == self.bucket.failing_part:
+            raise IOError('connection reset')
+
+        self.bucket.uploads[self.id][part_num] = fp.read(size)
+
+    def complete_upload(self):
+        parts = self.bucket.uploads.pop(self.id)
+        self.bucket.contents[self.key_name] = b''.join(parts[i] for i in sorted(parts))
+
+    def cancel_upload(self):
+        del self.bucket.uploads[self.id]
+
+
+class FakeConfig(object):
+    def __init__(self, db_path):
+        self.paths = collections.namedtuple('FakePaths', ['file_changes_database'])(db_path)
+
+
+@istest
+class TestFileCollector(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, 'html')
+        os.mkdir(self.root)
+        self.db_path = os.path.join(self.tmpdir, 'stage-cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_collector(self):
+        return giza.operations.stage.FileCollector('user/branch', self.db_path, pool_size=2)
+
+    def write(self, fn, content, mtime):
+        path = os.path.join(self.root, fn)
+        with open(path, 'w') as f:
+            f.write(content)
+        os.utime(path, (mtime, mtime))
+
+        return path
+
+    def test_new_files_are_committed_in_bulk(self):
+        paths = [self.write(fn, fn, 1000) for fn in ('a.html', 'b.html', 'c.html')]
+
+        collector = self.get_collector()
+        updates = list(collector.collect(self.root))
+
+        assert sorted(update.path for update in updates) == sorted(paths)
+        assert all(update.is_new for update in updates)
+
+        collector.commit()
+        assert collector.dirty_files == []
+
+        known = self.get_collector().load()
+        assert sorted(known) == sorted(paths)
+        assert known[paths[0]] == (1000000, giza.operations.stage.FileCollector.hash(paths[0]))
+
+        assert list(self.get_collector().collect(self.root)) == []
+
+    def test_changing_compression_yields_every_file_again(self):
+        paths = [self.write(fn, fn, 1000) for fn in ('a.html', 'b.html')]
+
+        collector = self.get_collector()
+        collector.set_compress(False)
+        list(collector.collect(self.root))
+        collector.commit()
+
+        collector = self.get_collector()
+        collector.set_compress(False)
+        assert list(collector.collect(self.root)) == []
+
+        os.remove(paths[1])
+
+        collector = self.get_collector()
+        collector.set_compress(True)
+        updates = list(collector.collect(self.root))
+        assert [(update.path, update.is_new) for update in updates] == [(paths[0], False)]
+        assert collector.removed_files == [paths[1]]
+        collector.commit()
+
+        collector = self.get_collector()
+        collector.set_compress(True)
+        assert list(collector.collect(self.root)) == []
+
+    def test_changed_touched_and_removed_files(self):
+        changed = self.write('changed.html', 'old', 1000)
+        touched = self.write('touched.html', 'same', 1000)
+        removed = self.write('removed.html', 'gone', 1000)
+
+        collector = self.get_collector()
+        list(collector.collect(self.root))
+        collector.commit()
+
+        self.write('changed.html', 'new', 2000)
+        self.write('touched.html', 'same', 2000)
+        os.remove(removed)
+
+        collector = self.get_collector()
+        updates = list(collector.collect(self.root))
+
+        assert [(update.path, update.is_new) for update in updates] == [(changed, False)]
+        assert [update.path for update in collector.touched_files] == [touched]
+        assert collector.removed_files == [removed]
+
+        collector.commit()
+
+        # the new mtime of the touched file is recorded, so that it is not
+        # hashed again.
+        known = self.get_collector().load()
+        assert sorted(known) == sorted([changed, touched])
+        assert known[touched][0] == 2000000
+
+        collector = self.get_collector()
+        collector.hash_all = lambda paths: self.fail_if_hashed(paths)
+        assert list(collector.collect(self.root)) == []
+
+    def fail_if_hashed(self, paths):
+        assert paths == []
+        return {}
+
+
+@istest
+class TestUploader(object):
+    def make_job(self, path, size, failures, log, error=None):
+        attempts = []
+
+        def upload():
+            attempts.append(path)
+            if len(attempts) <= failures:
+                if error is None:
+                    raise IOError('transient error uploading ' + path)
+                raise error
+            log.append(path)
+
+        return giza.operations.stage.UploadJob(path, size, upload)
+
+    def test_uploads_every_job_largest_first(self):
+        log = []
+        jobs = [self.make_job(str(size), size, 0, log) for size in (1, 300, 20, 4000)]
+
+        uploader = giza.operations.stage.Uploader(n_workers=1)
+        assert uploader.run(jobs) == []
+        assert log == ['4000', '300', '20', '1']
+        assert uploader.stats.files == 4
+        assert uploader.stats.bytes == 4321
+
+    def test_retries_each_job_with_backoff(self):
+        log = []
+        jobs = [self.make_job('flaky', 10, 2, log), self.make_job('broken', 10, 5, log)]
+
+        uploader = giza.operations.stage.Uploader(n_workers=2, max_attempts=3, backoff=0.001)
+        errors = uploader.run(jobs)
+
+        assert log == ['flaky']
+        assert [job.path for job, _ in errors] == ['broken']
+        assert isinstance(errors[0][1], IOError)
+        assert uploader.stats.retries == 4
+        assert uploader.stats.failures == 1
+
+    def test_retries_only_transient_errors(self):
+        log = []
+        unavailable = giza.operations.stage.SyncFileException('busy', 'Service Unavailable', 503)
+        denied = giza.operations.stage.SyncFileException('denied', 'Access Denied', 403)
+        jobs = [self.make_job('busy', 20, 2, log, unavailable),
+                self.make_job('denied', 10, 1, log, denied)]
+
+        uploader = giza.operations.stage.Uploader(n_workers=1, max_attempts=3, backoff=0.001)
+        errors = uploader.run(jobs)
+
+        assert log == ['busy']
+        assert errors == [(jobs[1], denied)]
+        assert uploader.stats.retries == 2
+        assert uploader.stats.failures == 1
+
+    def test_is_transient_error(self):
+        is_transient_error = giza.operations.stage.is_transient_error
+
+        assert is_transient_error(socket.timeout('timed out'))
+        assert is_transient_error(IOError('connection reset'))
+        assert is_transient_error(socket.error(errno.ECONNRESET, 'Connection reset by peer'))
+        assert is_transient_error(IOError(errno.EIO, 'Input/output error'))
+        assert not is_transient_error(IOError(errno.ENOENT, 'No such file or directory'))
+        assert not is_transient_error(OSError(errno.EACCES, 'Permission denied'))
+        assert not is_transient_error(IOError(errno.EISDIR, 'Is a directory'))
+        assert is_transient_error(giza.operations.stage.SyncFileException('a', 'error', 500))
+        assert not is_transient_error(giza.operations.stage.SyncFileException('a', 'error', 404))
+        assert not is_transient_error(giza.operations.stage.SyncFileException('a', 'error'))
+        assert not is_transient_error(ValueError('bad value'))
+
+
+@istest
+class TestStaging(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, 'html') + os.path.sep
+        os.mkdir(self.root)
+        self.conf = FakeConfig(os.path.join(self.tmpdir, 'stage-cache.db'))
+
+        self.multipart = (giza.operations.stage.MULTIPART_THRESHOLD,
+                          giza.operations.stage.MULTIPART_CHUNK_SIZE,
+                          giza.operations.stage.boto.s3.multipart.MultiPartUpload)
+
+    def tearDown(self):
+        (giza.operations.stage.MULTIPART_THRESHOLD,
+         giza.operations.stage.MULTIPART_CHUNK_SIZE,
+         giza.operations.stage.boto.s3.multipart.MultiPartUpload) = self.multipart
+
+        shutil.rmtree(self.tmpdir)
+
+    def get_staging(self, bucket):
+        return giza.operations.stage.Staging('user/branch', bucket, self.conf)
+
+    def write(self, fn, content):
+        path = os.path.join(self.root, fn)
+        with open(path, 'w') as f:
+            f.write(content)
+
+        return path
+
+    def test_delete_keys_in_chunks(self):
+        bucket = FakeBucket('docs')
+        keys = ['key{0}'.format(i) for i in range(2499)] + ['bad']
+
+        errors = giza.operations.stage.delete_keys(bucket, keys)
+
+        assert [len(chunk) for chunk in bucket.deleted] == [1000, 1000, 500]
+        assert sum(bucket.deleted, []) == keys
+        assert errors == ['bad']
+        assert giza.operations.stage.delete_keys(bucket, []) == []
+        assert len(bucket.deleted) == 3
+
+    def test_cache_manifest_is_listed_again(self):
+        file_hash = hashlib.sha256(b'content').digest()
+        bucket = FakeBucket('docs', ['cache/' + binascii.b2a_hex(file_hash), 'cache/not-a-hash',
+                                     'user/branch/index.html'])
+        staging = self.get_staging(bucket)
+
+        assert staging.load_cache_manifest() == {file_hash}
+        assert staging.load_cache_manifest() == {file_hash}
+        assert bucket.n_listed == 1
+
+        # a file found missing from the cache expires the listing
+        staging.collector.expire_cached_hashes('docs')
+        assert staging.load_cache_manifest() == {file_hash}
+        assert bucket.n_listed == 2
+
+        # as does age
+        with staging.collector.conn:
+            staging.collector.conn.execute('UPDATE cache_listed SET time=0')
+        bucket.keys = []
+        assert staging.load_cache_manifest() == set()
+        assert bucket.n_listed == 3
+
+    def test_get_jobs_partitions_copies_and_uploads(self):
+        self.write('cached.html', 'cached')
+        self.write('new.html', 'new')
+        self.write('copy-of-new.html', 'new')
+        self.write('genindex.html', 'cached')
+
+        cached_hash = hashlib.sha256(b'cached').digest()
+        staging = self.get_staging(FakeBucket('docs', ['cache/' + binascii.b2a_hex(cached_hash)]))
+
+        entries = sorted(staging.collector.collect(self.root))
+        jobs = dict((job.path, job) for job in staging.get_jobs(self.root, entries))
+
+        assert sorted(jobs) == ['cached.html', 'copy-of-new.html', 'genindex.html']
+
+        # cached files are only copied, and are queued after the uploads
+        assert jobs['cached.html'].size == 0
+        assert jobs['cached.html'].upload.args[0] == ['cached.html']
+        assert jobs['cached.html'].upload.args[-1] is True
+
+        # files with the same content are uploaded once, and copied to both paths
+        assert jobs['copy-of-new.html'].size == 3
+        assert jobs['copy-of-new.html'].upload.args[0] == ['copy-of-new.html', 'new.html']
+        assert jobs['copy-of-new.html'].upload.args[-1] is False
+
+        # blacklisted files are uploaded directly, whether or not they are cached
+        assert jobs['genindex.html'].size == 6
+        assert jobs['genindex.html'].upload.args[0] == 'genindex.html'
+
+    def test_compressed_files_are_gzipped_once_with_content_types(self):
+        self.write('a.html', '<p>text</p>')
+        self.write('b.html', '<p>text</p>')
+        self.write('data.json', '{}')
+        self.write('image.png', 'png')
+
+        staging = self.get_staging(FakeBucket('docs'))
+        staging.compress = True
+        staging.compressed_dir = os.path.join(self.tmpdir, 'compressed')
+        os.mkdir(staging.compressed_dir)
+
+        entries = sorted(staging.collector.collect(self.root))
+        prepared = dict((entry.path.replace(self.root, '', 1), (src_path, file_hash, headers))
+                        for entry, src_path, file_hash, headers in staging.prepare_files(entries))
+
+        assert len(os.listdir(staging.compressed_dir)) == 2
+        assert prepared['a.html'] == prepared['b.html']
+
+        src_path, file_hash, headers = prepared['a.html']
+        assert headers == {'Content-Encoding': 'gzip', 'Content-Type': 'text/html'}
+        assert file_hash == giza.operations.stage.FileCollector.hash(src_path)
+        with open(src_path, 'rb') as f:
+            assert gzip.GzipFile(fileobj=f).read() == b'<p>text</p>'
+
+        assert prepared['data.json'][2]['Content-Type'] == 'application/json'
+        assert prepared['image.png'] == (os.path.join(self.root, 'image.png'),
+                                         hashlib.sha256(b'png').digest(), {})
+
+    def test_multipart_upload_resumes(self):
+        giza.operations.stage.MULTIPART_THRESHOLD = 10
+        giza.operations.stage.MULTIPART_CHUNK_SIZE = 40
+        giza.operations.stage.boto.s3.multipart.MultiPartUpload = FakeMultiPartUpload
+
+        content = ''.join(chr(ord('a') + i % 26) for i in range(100))
+        path = self.write('big.tar', content)
+        file_hash = giza.operations.stage.FileCollector.hash(path)
+
+        bucket = FakeBucket('docs')
+        staging = self.get_staging(bucket)
+        key = FakeKey('cache/big')
+
+        bucket.failing_part = 3
+        try:
+            staging._Staging__put(key, path, file_hash, {})
+        except IOError:
+            pass
+        else:
+            assert False, 'expected the upload of part 3 to fail'
+
+        upload_id = staging.collector.get_multipart('docs', 'cache/big')[1]
+        assert sorted(bucket.uploads[upload_id]) == [1, 2]
+
+        # the second attempt uploads only the missing part, and keeps the
+        # others as they are
+        bucket.failing_part = None
+        bucket.uploads[upload_id][1] = b'-' * 40
+        staging._Staging__put(key, path, file_hash, {})
+
+        assert bucket.contents['cache/big'] == b'-' * 40 + content[40:].encode('ascii')
+        assert bucket.uploads == {}
+        assert staging.collector.get_multipart('docs', 'cache/big') is None
+
+    def test_multipart_upload_restarts_when_the_file_changed(self):
+        giza.operations.stage.MULTIPART_THRESHOLD = 10
+        giza.operations.stage.MULTIPART_CHUNK_SIZE = 40
+        giza.operations.stage.boto.s3.multipart.MultiPartUpload = FakeMultiPartUpload
+
+        bucket = FakeBucket('docs')
+        staging = self.get_staging(bucket)
+        key = FakeKey('cache/big')
+
+        path = self.write('big.tar', 'a' * 100)
+        bucket.failing_part = 2
+        try:
+            staging._Staging__put(key, path, hashlib.sha256(b'old').digest(), {})
+        except IOError:
+            pass
+
+        bucket.failing_part = None
+        staging._Staging__put(key, path, hashlib.sha256(b'new').digest(), {})
+
+        assert bucket.contents['cache/big'] == b'a' * 100
+        assert bucket.uploads == {}
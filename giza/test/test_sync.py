@@ -0,0 +1,231 @@
+from nose.tools import istest
+
+import logging
+import os
+import shutil
+import tempfile
+
+import giza.tools.sync
+from giza.tools.files import copy_if_needed
+from giza.tools.sync import is_excluded, sync_tree
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def read_tree(path):
+    tree = {}
+
+    for root, dirs, fns in os.walk(path):
+        for fn in fns + dirs:
+            full_fn = os.path.join(root, fn)
+            rel_fn = os.path.relpath(full_fn, path)
+
+            if os.path.islink(full_fn):
+                tree[rel_fn] = 'link:' + os.readlink(full_fn)
+            elif os.path.isdir(full_fn):
+                tree[rel_fn] = 'dir'
+            else:
+                with open(full_fn, 'r') as f:
+                    tree[rel_fn] = f.read()
+
+    return tree
+
+
+@istest
+class TestExclusions(object):
+    def test_wildcards_do_not_cross_directories(self):
+        assert is_excluded('a.pyc', ['*.pyc'])
+        assert is_excluded('a/b/c.pyc', ['*.pyc'])
+        assert is_excluded('a/b.txt', ['a/?.txt'])
+        assert not is_excluded('a/b/c.txt', ['a/*.txt'])
+        assert not is_excluded('ab/c.txt', ['a?c.txt'])
+
+    def test_double_star_crosses_directories(self):
+        assert is_excluded('a/b/c.txt', ['a/**.txt'])
+        assert is_excluded('a/b/c.txt', ['a/**'])
+        assert not is_excluded('b/c.txt', ['a/**'])
+
+    def test_anchored_patterns(self):
+        assert is_excluded('build/a.html', ['/build'])
+        assert not is_excluded('source/build/a.html', ['/build'])
+        assert is_excluded('source/build/a.html', ['build/'])
+
+    def test_character_classes(self):
+        assert is_excluded('a1', ['a[0-9]'])
+        assert not is_excluded('ab', ['a[0-9]'])
+        assert is_excluded('ab', ['a[!0-9]'])
+
+    def test_parent_directories_are_matched(self):
+        assert is_excluded('drafts/a/b.txt', ['drafts'])
+        assert not is_excluded('old-drafts/a.txt', ['drafts'])
+
+
+@istest
+class TestSyncTree(object):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmpdir, 'source')
+        self.target = os.path.join(self.tmpdir, 'target')
+        self.manifest_fn = os.path.join(self.tmpdir, 'manifest.json')
+
+        self.write('index.txt', 'index')
+        self.write('a/b.txt', 'b')
+        self.write('a/c/d.txt', 'd')
+        self.write('secret/e.txt', 'e')
+        self.write('scratch.tmp', 'tmp')
+        os.symlink('index.txt', os.path.join(self.source, 'link.txt'))
+
+        self.handler = RecordingHandler()
+        logging.getLogger('giza.tools.sync').addHandler(self.handler)
+
+        self.hash_files = giza.tools.sync.hash_files
+        self.md5_file = giza.tools.sync.md5_file
+        self.reflink = giza.tools.sync._reflink
+
+    def tearDown(self):
+        logging.getLogger('giza.tools.sync').removeHandler(self.handler)
+        giza.tools.sync.hash_files = self.hash_files
+        giza.tools.sync.md5_file = self.md5_file
+        giza.tools.sync._reflink = self.reflink
+
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, fn, content, base=None):
+        fn = os.path.join(base or self.source, fn)
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+
+        with open(fn, 'w') as f:
+            f.write(content)
+
+    def sync(self, redactions=None):
+        return sync_tree(self.source, {self.target: redactions or []},
+                         exclusions=['*.tmp'], manifest_fn=self.manifest_fn)[self.target]
+
+    def test_sync_copies_tree(self):
+        stats = self.sync()
+
+        assert read_tree(self.target) == {'index.txt': 'index', 'a': 'dir', 'a/b.txt': 'b',
+                                          'a/c': 'dir', 'a/c/d.txt': 'd', 'secret': 'dir',
+                                          'secret/e.txt': 'e', 'link.txt': 'link:index.txt'}
+        assert stats['copied'] == 4
+        assert stats['linked'] == 1
+
+    def test_redactions(self):
+        self.sync(redactions=['secret', 'missing.txt'])
+
+        assert not os.path.exists(os.path.join(self.target, 'secret'))
+        assert os.path.isfile(os.path.join(self.target, 'index.txt'))
+
+        missing = os.path.join(self.source, 'missing.txt')
+        assert self.handler.messages == ['cannot redact non-existing file: ' + missing]
+
+    def test_removed_files_and_directories_are_deleted(self):
+        self.sync()
+
+        shutil.rmtree(os.path.join(self.source, 'a', 'c'))
+        os.remove(os.path.join(self.source, 'a', 'b.txt'))
+        os.remove(os.path.join(self.source, 'link.txt'))
+
+        # excluded files in the target are neither modified nor deleted
+        self.write('kept.tmp', 'kept', base=self.target)
+
+        stats = self.sync()
+
+        assert stats['deleted'] == 3
+        assert read_tree(self.target) == {'index.txt': 'index', 'a': 'dir', 'secret': 'dir',
+                                          'secret/e.txt': 'e', 'kept.tmp': 'kept'}
+
+    def test_unchanged_files_keep_their_mtime(self):
+        self.sync()
+
+        target_fn = os.path.join(self.target, 'index.txt')
+        os.utime(target_fn, (1000, 1000))
+
+        # a new mtime in the source, without a change in content
+        os.utime(os.path.join(self.source, 'index.txt'), None)
+        self.write('a/b.txt', 'new b')
+
+        stats = self.sync()
+
+        assert os.stat(target_fn).st_mtime == 1000
+        assert stats['copied'] == 1
+        assert read_tree(self.target)['a/b.txt'] == 'new b'
+
+    def test_symlinks_are_replaced_when_they_change(self):
+        self.sync()
+
+        os.remove(os.path.join(self.source, 'link.txt'))
+        os.symlink('a/b.txt', os.path.join(self.source, 'link.txt'))
+
+        stats = self.sync()
+
+        assert stats['linked'] == 1
+        assert os.readlink(os.path.join(self.target, 'link.txt')) == 'a/b.txt'
+
+    def test_manifest_skips_hashing_unchanged_files(self):
+        self.sync()
+
+        hashed = []
+
+        def hash_files(file_list, pool_size=None):
+            hashed.extend(file_list)
+            return self.hash_files(file_list, pool_size)
+
+        def md5_file(fn):
+            raise AssertionError('hashed ' + fn)
+
+        giza.tools.sync.hash_files = hash_files
+        giza.tools.sync.md5_file = md5_file
+
+        stats = self.sync()
+
+        assert hashed == []
+        assert stats['unchanged'] == 5
+        assert stats['copied'] == 0
+
+        # without the manifest, the source is hashed again
+        os.remove(self.manifest_fn)
+        giza.tools.sync.md5_file = self.md5_file
+        self.sync()
+
+        assert len(hashed) == 4
+
+    def test_reflink_falls_back_to_copying_once(self):
+        attempts = []
+
+        def reflink(source_fn, target_fn):
+            attempts.append(source_fn)
+            raise IOError('Operation not supported')
+
+        giza.tools.sync._reflink = reflink
+
+        stats = sync_tree(self.source, {self.target: []}, exclusions=['*.tmp'],
+                          mode='reflink')[self.target]
+
+        assert len(attempts) == 1
+        assert stats['copied'] == 4
+        assert read_tree(self.target)['a/c/d.txt'] == 'd'
+
+    def test_touching_a_hard_linked_copy_leaves_the_other_links(self):
+        canonical = os.path.join(self.tmpdir, 'canonical')
+        sync_tree(self.source, {self.target: []}, exclusions=['*.tmp'],
+                  mode='hardlink', canonical=canonical)
+
+        canonical_fn = os.path.join(canonical, 'index.txt')
+        target_fn = os.path.join(self.target, 'index.txt')
+        assert os.path.samefile(canonical_fn, target_fn)
+        os.utime(canonical_fn, (1000, 1000))
+
+        copy_if_needed(os.path.join(self.source, 'index.txt'), target_fn)
+
+        assert not os.path.samefile(canonical_fn, target_fn)
+        assert os.stat(canonical_fn).st_mtime == 1000
+        assert os.stat(target_fn).st_mtime != 1000